@@ -18,9 +18,22 @@ class Config:
     payment_window_minutes: int = 15
     offer_window_minutes: int = 15
     invoice_poll_interval: int = 30
+    invoice_poll_max_interval: int = 300
+    presence_interval: int = 60
+    events_heartbeat: int = 25
     storage_path: Path = Path("var/state.json")
+    storage_backend: str = "json"
+    storage_sharded: bool = False
+    storage_compact_interval: int = 300
+    storage_commit_window_ms: int = 10
+    storage_lazy_cold: bool = False
+    storage_cold_cache_mb: int = 64
+    deal_archive_path: Path = Path("var/archive.sqlite3")
+    deal_archive_days: int = 0
     kb_api_url: str | None = None
     kb_api_token: str | None = None
+    kb_max_connections: int = 20
+    kb_batch_window_ms: int = 0
     default_usd_rate: Decimal = Decimal("100")
     fee_percent: Decimal = Decimal("1.0")
     withdraw_fee_percent: Decimal = Decimal("2.5")
@@ -30,9 +43,13 @@ class Config:
     webhook_port: int = 8080
     webhook_path: str = "/crypto-pay/webhook"
     crypto_pay_webhook_secret: str | None = None
+    crypto_pay_api_url: str | None = None
+    crypto_pay_max_connections: int = 20
+    crypto_pay_http2: bool = False
     allow_unsafe_initdata: bool = False
     allow_unsafe_initdata_ids: Set[int] = None
     support_db_path: Path = Path("var/support.db")
+    webhook_inbox_path: Path = Path("var/webhook_inbox.sqlite3")
     telegram_bot_tokens: tuple[str, ...] = ()
 
     @classmethod
@@ -54,11 +71,33 @@ class Config:
         if not storage_path.is_absolute():
             project_root = Path(__file__).resolve().parent.parent
             storage_path = (project_root / storage_path).resolve()
+        storage_backend = os.getenv("STATE_BACKEND", "json").strip().lower()
+        if storage_backend not in {"json", "journal", "sqlite", "binary"}:
+            raise ValueError(f"Unsupported STATE_BACKEND: {storage_backend}")
+        storage_sharded = os.getenv("STATE_SHARDED", "0").lower() in {"1", "true", "yes"}
+        if storage_sharded and storage_backend in {"sqlite", "binary"}:
+            raise ValueError("STATE_SHARDED is only supported for json and journal backends")
+        compact_interval = int(os.getenv("STATE_COMPACT_INTERVAL", "300"))
+        commit_window_ms = int(os.getenv("STATE_COMMIT_WINDOW_MS", "10"))
+        lazy_cold = os.getenv("STATE_LAZY_COLD", "0").lower() in {"1", "true", "yes"}
+        if lazy_cold and storage_backend != "sqlite":
+            raise ValueError("STATE_LAZY_COLD is only supported for the sqlite backend")
+        cold_cache_mb = int(os.getenv("STATE_COLD_CACHE_MB", "64"))
+        archive_path = Path(os.getenv("DEAL_ARCHIVE_FILE", "var/archive.sqlite3")).expanduser()
+        if not archive_path.is_absolute():
+            project_root = Path(__file__).resolve().parent.parent
+            archive_path = (project_root / archive_path).resolve()
+        archive_days = int(os.getenv("DEAL_ARCHIVE_DAYS", "0"))
         payment_window = int(os.getenv("DEAL_TTL_MINUTES", "15"))
         offer_window = int(os.getenv("OFFER_TTL_MINUTES", "15"))
         poll_interval = int(os.getenv("INVOICE_POLL_INTERVAL", "30"))
+        poll_max_interval = max(poll_interval, int(os.getenv("INVOICE_POLL_MAX_INTERVAL", "300")))
+        presence_interval = int(os.getenv("PRESENCE_INTERVAL", "60"))
+        events_heartbeat = max(1, int(os.getenv("EVENTS_HEARTBEAT", "25")))
         kb_api_url = os.getenv("KB_API_URL") or None
         kb_api_token = os.getenv("KB_API_TOKEN") or None
+        kb_max_connections = int(os.getenv("KB_MAX_CONNECTIONS", "20"))
+        kb_batch_window_ms = int(os.getenv("KB_BATCH_WINDOW_MS", "0"))
         default_rate = Decimal(os.getenv("DEFAULT_USD_RATE", "100"))
         fee_percent = Decimal(os.getenv("FEE_PERCENT", "1.0"))
         withdraw_fee_percent = Decimal(os.getenv("WITHDRAW_FEE_PERCENT", "2.5"))
@@ -68,12 +107,21 @@ class Config:
         webhook_port = int(os.getenv("CRYPTO_PAY_WEBHOOK_PORT", "8080"))
         webhook_path = os.getenv("CRYPTO_PAY_WEBHOOK_PATH", "/crypto-pay/webhook")
         webhook_secret = os.getenv("CRYPTO_PAY_WEBHOOK_SECRET") or None
+        crypto_pay_api_url = os.getenv("CRYPTO_PAY_API_URL") or None
+        crypto_pay_max_connections = int(os.getenv("CRYPTO_PAY_MAX_CONNECTIONS", "20"))
+        crypto_pay_http2 = os.getenv("CRYPTO_PAY_HTTP2", "0").lower() in {"1", "true", "yes"}
         allow_unsafe = os.getenv("ALLOW_UNSAFE_INITDATA", "0").lower() in {"1", "true", "yes"}
         unsafe_ids = _parse_admin_ids(os.getenv("ALLOW_UNSAFE_INITDATA_IDS"))
         support_db_path = Path(os.getenv("SUPPORT_DB_PATH", "var/support.db")).expanduser()
         if not support_db_path.is_absolute():
             project_root = Path(__file__).resolve().parent.parent
             support_db_path = (project_root / support_db_path).resolve()
+        webhook_inbox_path = Path(
+            os.getenv("WEBHOOK_INBOX_FILE", "var/webhook_inbox.sqlite3")
+        ).expanduser()
+        if not webhook_inbox_path.is_absolute():
+            project_root = Path(__file__).resolve().parent.parent
+            webhook_inbox_path = (project_root / webhook_inbox_path).resolve()
         return cls(
             telegram_bot_token=token,
             telegram_bot_tokens=(token,) + extra_tokens,
@@ -83,9 +131,22 @@ class Config:
             payment_window_minutes=payment_window,
             offer_window_minutes=offer_window,
             invoice_poll_interval=poll_interval,
+            invoice_poll_max_interval=poll_max_interval,
+            presence_interval=presence_interval,
+            events_heartbeat=events_heartbeat,
             storage_path=storage_path,
+            storage_backend=storage_backend,
+            storage_sharded=storage_sharded,
+            storage_compact_interval=compact_interval,
+            storage_commit_window_ms=commit_window_ms,
+            storage_lazy_cold=lazy_cold,
+            storage_cold_cache_mb=cold_cache_mb,
+            deal_archive_path=archive_path,
+            deal_archive_days=archive_days,
             kb_api_url=kb_api_url,
             kb_api_token=kb_api_token,
+            kb_max_connections=kb_max_connections,
+            kb_batch_window_ms=kb_batch_window_ms,
             default_usd_rate=default_rate,
             fee_percent=fee_percent,
             withdraw_fee_percent=withdraw_fee_percent,
@@ -95,9 +156,13 @@ class Config:
             webhook_port=webhook_port,
             webhook_path=webhook_path,
             crypto_pay_webhook_secret=webhook_secret,
+            crypto_pay_api_url=crypto_pay_api_url,
+            crypto_pay_max_connections=crypto_pay_max_connections,
+            crypto_pay_http2=crypto_pay_http2,
             allow_unsafe_initdata=allow_unsafe,
             allow_unsafe_initdata_ids=unsafe_ids,
             support_db_path=support_db_path,
+            webhook_inbox_path=webhook_inbox_path,
         )
 
 
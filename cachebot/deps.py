@@ -6,13 +6,16 @@ from typing import Optional
 from cachebot.config import Config
 from cachebot.services.crypto_pay import CryptoPayClient
 from cachebot.services.adverts import AdvertService
+from cachebot.services.changes import ChangeFeed
 from cachebot.services.deals import DealService
 from cachebot.services.kb_client import KBClient
+from cachebot.services.payouts import PayoutService
 from cachebot.services.rate_provider import RateProvider
 from cachebot.services.disputes import DisputeService
 from cachebot.services.reviews import ReviewService
 from cachebot.services.topups import TopupService
 from cachebot.services.users import UserService
+from cachebot.services.webhooks import WebhookConsumer
 from cachebot.services.chats import ChatService
 from cachebot.services.support import SupportService
 
@@ -31,6 +34,9 @@ class AppDeps:
     topup_service: TopupService
     chat_service: ChatService
     support_service: SupportService
+    payout_service: PayoutService
+    webhook_consumer: WebhookConsumer
+    change_feed: ChangeFeed
 
 
 _current: Optional[AppDeps] = None
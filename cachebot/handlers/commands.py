@@ -5,7 +5,7 @@ import logging
 from datetime import datetime, timezone
 from decimal import Decimal
 from html import escape
-from typing import List
+from typing import Dict, List
 from uuid import uuid4
 
 from aiogram import F, Router
@@ -694,7 +694,7 @@ async def view_user_profile(callback: CallbackQuery) -> None:
     if not profile:
         await callback.answer("Профиль не найден", show_alert=True)
         return
-    deals = await deps.deal_service.list_user_deals(target_id)
+    counts = await deps.deal_service.user_deal_counts(target_id)
     reviews = await deps.review_service.list_for_user(target_id)
     role = await deps.user_service.role_of(target_id)
     show_private = bool(callback.from_user and callback.from_user.id in deps.config.admin_ids)
@@ -703,7 +703,7 @@ async def view_user_profile(callback: CallbackQuery) -> None:
     await callback.message.answer(
         _format_profile(
             profile,
-            deals,
+            counts,
             review_summary=_review_summary_text(reviews),
             role=role,
             show_private=show_private,
@@ -746,7 +746,7 @@ async def reviews_back(callback: CallbackQuery) -> None:
     if not profile:
         await callback.answer("Профиль не найден", show_alert=True)
         return
-    deals = await deps.deal_service.list_user_deals(target_id)
+    counts = await deps.deal_service.user_deal_counts(target_id)
     reviews = await deps.review_service.list_for_user(target_id)
     role = await deps.user_service.role_of(target_id)
     show_private = bool(callback.from_user and callback.from_user.id in deps.config.admin_ids)
@@ -757,7 +757,7 @@ async def reviews_back(callback: CallbackQuery) -> None:
     await callback.message.answer(
         _format_profile(
             profile,
-            deals,
+            counts,
             review_summary=_review_summary_text(reviews),
             role=role,
             show_private=show_private,
@@ -2960,7 +2960,7 @@ async def _send_profile(
         full_name=user.full_name,
         username=user.username,
     )
-    deals = await deps.deal_service.list_user_deals(user.id)
+    counts = await deps.deal_service.user_deal_counts(user.id)
     reviews = await deps.review_service.list_for_user(user.id)
     builder = InlineKeyboardBuilder()
     builder.button(text="💬 Отзывы", callback_data=f"{REVIEWS_VIEW_PREFIX}{user.id}:pos")
@@ -2970,7 +2970,7 @@ async def _send_profile(
         chat_id,
         _format_profile(
             profile,
-            deals,
+            counts,
             review_summary=_review_summary_text(reviews),
             role=role,
             show_private=user.id in deps.config.admin_ids,
@@ -2991,8 +2991,9 @@ async def _render_my_deals(
     state: FSMContext | None = None,
 ) -> None:
     deps = get_deps()
-    deals = await deps.deal_service.list_user_deals(user_id)
-    if not deals:
+    counts = await deps.deal_service.user_deal_counts(user_id)
+    total = sum(counts.values())
+    if not total:
         text = "У тебя пока нет сделок"
         if message:
             with suppress(TelegramBadRequest):
@@ -3009,13 +3010,12 @@ async def _render_my_deals(
                     last_menu_chat_id=sent.chat.id,
                 )
         return
-    total_pages = max(1, (len(deals) + DEALS_PER_PAGE - 1) // DEALS_PER_PAGE)
+    total_pages = max(1, (total + DEALS_PER_PAGE - 1) // DEALS_PER_PAGE)
     page = max(0, min(page, total_pages - 1))
     start = page * DEALS_PER_PAGE
-    chunk = deals[start : start + DEALS_PER_PAGE]
-    total = len(deals)
-    success = sum(1 for item in deals if item.status == DealStatus.COMPLETED)
-    failed = sum(1 for item in deals if item.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
+    chunk = await deps.deal_service.user_deals_at(user_id, start, DEALS_PER_PAGE)
+    success = counts.get(DealStatus.COMPLETED, 0)
+    failed = counts.get(DealStatus.CANCELED, 0) + counts.get(DealStatus.EXPIRED, 0)
     text = _format_deal_list_text(
         total=total,
         success=success,
@@ -3361,7 +3361,9 @@ async def _handle_deal_completed(deal: Deal, deps, bot) -> None:
         kb_configured = bool(deps.config.kb_api_url and deps.config.kb_api_token)
         credited = True
         if kb_configured:
-            credited = await deps.kb_client.credit_balance(deal.buyer_id, deal.usdt_amount)
+            credited = await deps.kb_client.credit_balance(
+                deal.buyer_id, deal.usdt_amount, idempotency_key=f"deal-{deal.id}"
+            )
         buyer_note = (
             f"Средства зачислены на баланс ({_format_decimal(deal.usdt_amount)} USDT)."
             if credited or not kb_configured
@@ -3480,40 +3482,36 @@ async def balance_withdraw_amount(message: Message, state: FSMContext) -> None:
         )
         return
     try:
-        await deps.deal_service.withdraw_balance(user.id, total)
+        await deps.payout_service.request(user.id, amount, fee)
     except Exception as exc:
         await message.answer(f"Не удалось списать средства: {exc}")
         return
-    try:
-        await deps.crypto_pay.transfer(user_id=user.id, amount=amount, currency="USDT")
-    except Exception as exc:
-        await deps.deal_service.deposit_balance(user.id, total, kind="refund", record_event=False)
-        await message.answer(f"Перевод не выполнен: {exc}")
-        return
     await state.clear()
     await message.answer(
-        "Заявка на вывод выполнена.\n"
+        "Заявка на вывод принята.\n"
         f"Получатель: @{user.username or user.id}\n"
         f"Сумма: {_format_decimal(amount)} USDT\n"
         f"Комиссия: {_format_decimal(fee)} USDT\n"
         f"Списано: {_format_decimal(total)} USDT\n"
-        "Отправлено в Crypto Bot."
+        "Перевод в Crypto Bot будет выполнен в ближайшее время, мы пришлём уведомление."
     )
 
 
+def _deal_totals(counts: Dict[DealStatus, int]) -> tuple[int, int, int]:
+    # All, completed and canceled or expired deals.
+    failed = counts.get(DealStatus.CANCELED, 0) + counts.get(DealStatus.EXPIRED, 0)
+    return sum(counts.values()), counts.get(DealStatus.COMPLETED, 0), failed
+
+
 def _format_profile(
     profile: UserProfile,
-    deals: List[Deal],
+    counts: Dict[DealStatus, int],
     *,
     review_summary: str,
     role: UserRole | None = None,
     show_private: bool = False,
 ) -> str:
-    total = len(deals)
-    success = sum(1 for deal in deals if deal.status == DealStatus.COMPLETED)
-    failed = sum(
-        1 for deal in deals if deal.status in {DealStatus.CANCELED, DealStatus.EXPIRED}
-    )
+    total, success, failed = _deal_totals(counts)
     display_name = getattr(profile, "display_name", None) or profile.full_name or "—"
     name = escape(display_name)
     registered = profile.registered_at.astimezone(timezone.utc).strftime(
@@ -4223,8 +4221,8 @@ async def _send_merchant_detail(callback: CallbackQuery, merchant_id: int) -> No
     deps = get_deps()
     profile = await deps.user_service.profile_of(merchant_id)
     since = await deps.user_service.merchant_since_of(merchant_id)
-    deals = await deps.deal_service.list_user_deals(merchant_id)
-    text = _format_merchant_summary(merchant_id, profile, since, deals)
+    counts = await deps.deal_service.user_deal_counts(merchant_id)
+    text = _format_merchant_summary(merchant_id, profile, since, counts)
     builder = InlineKeyboardBuilder()
     builder.button(
         text="📂 Сделки",
@@ -4246,12 +4244,12 @@ async def _send_merchant_detail(callback: CallbackQuery, merchant_id: int) -> No
 
 async def _send_merchant_deals(callback: CallbackQuery, merchant_id: int, *, page: int) -> None:
     deps = get_deps()
-    deals = await deps.deal_service.list_user_deals(merchant_id)
+    total = sum((await deps.deal_service.user_deal_counts(merchant_id)).values())
     builder = InlineKeyboardBuilder()
-    total_pages = max(1, (len(deals) + ADMIN_DEALS_PER_PAGE - 1) // ADMIN_DEALS_PER_PAGE)
+    total_pages = max(1, (total + ADMIN_DEALS_PER_PAGE - 1) // ADMIN_DEALS_PER_PAGE)
     page = max(0, min(page, total_pages - 1))
     start = page * ADMIN_DEALS_PER_PAGE
-    chunk = deals[start : start + ADMIN_DEALS_PER_PAGE]
+    chunk = await deps.deal_service.user_deals_at(merchant_id, start, ADMIN_DEALS_PER_PAGE)
     for deal in chunk:
         builder.row(
             InlineKeyboardButton(
@@ -4332,7 +4330,7 @@ def _format_merchant_summary(
     user_id: int,
     profile: UserProfile | None,
     merchant_since: datetime | None,
-    deals: List[Deal],
+    counts: Dict[DealStatus, int],
 ) -> str:
     name = escape(profile.full_name) if profile and profile.full_name else "—"
     username = (
@@ -4343,11 +4341,7 @@ def _format_merchant_summary(
         if merchant_since
         else "—"
     )
-    total = len(deals)
-    success = sum(1 for deal in deals if deal.status == DealStatus.COMPLETED)
-    failed = sum(
-        1 for deal in deals if deal.status in {DealStatus.CANCELED, DealStatus.EXPIRED}
-    )
+    total, success, failed = _deal_totals(counts)
     lines = [
         "<b>👔 Мерчант</b>",
         f"Имя: {name}",
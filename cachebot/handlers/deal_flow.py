@@ -1112,7 +1112,9 @@ async def _notify_completion(deal: Deal, deps, bot) -> None:
     dispute_resolved = bool(dispute_any and dispute_any.resolved)
     credited = False
     if deal.buyer_id:
-        credited = await deps.kb_client.credit_balance(deal.buyer_id, deal.usdt_amount)
+        credited = await deps.kb_client.credit_balance(
+            deal.buyer_id, deal.usdt_amount, idempotency_key=f"deal-{deal.id}"
+        )
         buyer_note = (
             f"Средства зачислены на баланс ({deal.usdt_amount} USDT)."
             if credited
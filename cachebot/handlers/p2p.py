@@ -374,8 +374,9 @@ async def send_p2p_my_deals(
     bot, chat_id: int, user_id: int, *, page: int, state: FSMContext | None = None
 ) -> None:
     deps = get_deps()
-    deals = await deps.deal_service.list_user_deals(user_id)
-    if not deals:
+    counts = await deps.deal_service.user_deal_counts(user_id)
+    total = sum(counts.values())
+    if not total:
         builder = InlineKeyboardBuilder()
         # back navigation via reply keyboard
         if state:
@@ -385,13 +386,12 @@ async def send_p2p_my_deals(
         if state:
             await state.update_data(last_menu_message_id=sent.message_id, last_menu_chat_id=sent.chat.id)
         return
-    total_pages = max(1, (len(deals) + 7 - 1) // 7)
+    total_pages = max(1, (total + 7 - 1) // 7)
     page = max(0, min(page, total_pages - 1))
     start = page * 7
-    chunk = deals[start : start + 7]
-    total = len(deals)
-    success = sum(1 for item in deals if item.status == DealStatus.COMPLETED)
-    failed = sum(1 for item in deals if item.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
+    chunk = await deps.deal_service.user_deals_at(user_id, start, 7)
+    success = counts.get(DealStatus.COMPLETED, 0)
+    failed = counts.get(DealStatus.CANCELED, 0) + counts.get(DealStatus.EXPIRED, 0)
     text = (
         "<b>📂 Мои сделки</b>\n"
         f"Всего: {total}\n"
@@ -499,8 +499,9 @@ async def _render_p2p_deals(
     user = callback.from_user
     if not user:
         return
-    deals = await deps.deal_service.list_user_deals(user.id)
-    if not deals:
+    counts = await deps.deal_service.user_deal_counts(user.id)
+    total = sum(counts.values())
+    if not total:
         builder = InlineKeyboardBuilder()
         # back navigation via reply keyboard
         if state:
@@ -511,13 +512,12 @@ async def _render_p2p_deals(
         if state:
             await state.update_data(last_menu_message_id=sent.message_id, last_menu_chat_id=sent.chat.id)
         return
-    total_pages = max(1, (len(deals) + 7 - 1) // 7)
+    total_pages = max(1, (total + 7 - 1) // 7)
     page = max(0, min(page, total_pages - 1))
     start = page * 7
-    chunk = deals[start : start + 7]
-    total = len(deals)
-    success = sum(1 for item in deals if item.status == DealStatus.COMPLETED)
-    failed = sum(1 for item in deals if item.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
+    chunk = await deps.deal_service.user_deals_at(user.id, start, 7)
+    success = counts.get(DealStatus.COMPLETED, 0)
+    failed = counts.get(DealStatus.CANCELED, 0) + counts.get(DealStatus.EXPIRED, 0)
     text = (
         "<b>📂 Мои сделки</b>\n"
         f"Всего: {total}\n"
@@ -12,23 +12,36 @@ from cachebot.config import Config
 from cachebot.deps import AppDeps, get_deps, wire
 from cachebot.handlers import commands, deal_flow, p2p
 from cachebot.services.adverts import AdvertService
+from cachebot.services.changes import ChangeFeed
 from cachebot.services.crypto_pay import CryptoPayClient
+from cachebot.services.deadlines import DeadlineScheduler
 from cachebot.services.deals import DealService
 from cachebot.services.kb_client import KBClient
+from cachebot.services.notifier import Notifier
+from cachebot.services.payouts import PayoutService
 from cachebot.services.disputes import DisputeService
 from cachebot.services.rate_provider import RateProvider
 from cachebot.services.reviews import ReviewService
 from cachebot.services.scheduler import (
-    dispute_timer_watcher,
-    expiry_watcher,
+    archive_watcher,
+    compaction_watcher,
     invoice_watcher,
-    support_inactive_watcher,
+    register_deadline_jobs,
 )
 from cachebot.services.topups import TopupService
 from cachebot.services.users import UserService
+from cachebot.services.webhooks import WebhookConsumer
 from cachebot.services.chats import ChatService
 from cachebot.services.support import SupportService
-from cachebot.storage import StateRepository
+from cachebot.storage import (
+    BinaryStateRepository,
+    DealArchive,
+    JournalStateRepository,
+    ShardedStateRepository,
+    SqliteStateRepository,
+    StateRepository,
+    WebhookInbox,
+)
 from cachebot.webhook import create_app
 
 
@@ -37,7 +50,35 @@ async def run_bot() -> None:
     config = Config.from_env()
     logging.info("Using state file: %s", config.storage_path)
     logging.info("Commands file: %s", commands.__file__)
-    repository = StateRepository(config.storage_path)
+    commit_window = config.storage_commit_window_ms / 1000
+    if config.storage_sharded:
+        repository = ShardedStateRepository(
+            config.storage_path,
+            commit_window,
+            shard_class=(
+                JournalStateRepository
+                if config.storage_backend == "journal"
+                else StateRepository
+            ),
+        )
+    elif config.storage_backend == "journal":
+        repository = JournalStateRepository(config.storage_path, commit_window)
+    elif config.storage_backend == "binary":
+        repository = BinaryStateRepository(
+            config.storage_path.with_suffix(".bin"),
+            legacy_path=config.storage_path,
+            commit_window=commit_window,
+        )
+    elif config.storage_backend == "sqlite":
+        repository = SqliteStateRepository(
+            config.storage_path.with_suffix(".sqlite3"),
+            legacy_path=config.storage_path,
+            commit_window=commit_window,
+            lazy=config.storage_lazy_cold,
+            cold_cache_bytes=config.storage_cold_cache_mb * 1024 * 1024,
+        )
+    else:
+        repository = StateRepository(config.storage_path, commit_window)
     rate_provider = RateProvider(
         repository,
         default_rate=config.default_usd_rate,
@@ -46,9 +87,25 @@ async def run_bot() -> None:
         default_transfer_fee_percent=config.transfer_fee_percent,
     )
     config.withdraw_fee_percent = await rate_provider.withdraw_fee_percent()
-    crypto_pay = CryptoPayClient(config.crypto_pay_token)
-    kb_client = KBClient(config.kb_api_url, config.kb_api_token)
-    user_service = UserService(repository, admin_ids=config.admin_ids)
+    crypto_pay = CryptoPayClient(
+        config.crypto_pay_token,
+        config.crypto_pay_api_url,
+        max_connections=config.crypto_pay_max_connections,
+        http2=config.crypto_pay_http2,
+    )
+    kb_client = KBClient(
+        config.kb_api_url,
+        config.kb_api_token,
+        max_connections=config.kb_max_connections,
+        batch_window_ms=config.kb_batch_window_ms,
+    )
+    scheduler = DeadlineScheduler()
+    user_service = UserService(
+        repository,
+        admin_ids=config.admin_ids,
+        scheduler=scheduler,
+        presence_interval=config.presence_interval,
+    )
     try:
         config.admin_ids = set(await user_service.list_admins())
     except Exception:
@@ -57,15 +114,39 @@ async def run_bot() -> None:
     dispute_service = DisputeService(repository)
     advert_service = AdvertService(repository)
     topup_service = TopupService(repository)
-    chat_service = ChatService(repository)
-    support_service = SupportService(config.support_db_path)
+    # Kept open once it exists so archived deals stay reachable even after
+    # archiving is switched off.
+    archive = (
+        DealArchive(config.deal_archive_path)
+        if config.deal_archive_days > 0 or config.deal_archive_path.exists()
+        else None
+    )
+    change_feed = ChangeFeed()
+    chat_service = ChatService(repository, archive, changes=change_feed)
+    support_service = SupportService(config.support_db_path, scheduler=scheduler, changes=change_feed)
     deal_service = DealService(
         repository,
         rate_provider,
         config.payment_window_minutes,
         config.offer_window_minutes,
         admin_ids=config.admin_ids,
+        archive=archive,
+        scheduler=scheduler,
+        changes=change_feed,
     )
+    bot = Bot(
+        token=config.telegram_bot_token,
+        default=DefaultBotProperties(parse_mode="HTML"),
+    )
+    notifier = Notifier(bot)
+    notifier.start()
+    payout_service = PayoutService(deal_service, crypto_pay, notifier)
+    await payout_service.start()
+    webhook_inbox = WebhookInbox(config.webhook_inbox_path)
+    webhook_consumer = WebhookConsumer(
+        webhook_inbox, deal_service, topup_service, kb_client, notifier
+    )
+    await webhook_consumer.start()
 
     wire(
         AppDeps(
@@ -81,32 +162,46 @@ async def run_bot() -> None:
             topup_service=topup_service,
             chat_service=chat_service,
             support_service=support_service,
+            payout_service=payout_service,
+            webhook_consumer=webhook_consumer,
+            change_feed=change_feed,
         )
     )
 
-    bot = Bot(
-        token=config.telegram_bot_token,
-        default=DefaultBotProperties(parse_mode="HTML"),
-    )
     dp = Dispatcher()
     dp.include_router(commands.router)
     dp.include_router(deal_flow.router)
     dp.include_router(p2p.router)
 
-    expiry_task = asyncio.create_task(expiry_watcher(deal_service, advert_service, bot))
+    register_deadline_jobs(
+        scheduler, deal_service, advert_service, user_service, support_service, notifier
+    )
+    scheduler_task = asyncio.create_task(scheduler.run())
     invoice_task = asyncio.create_task(
         invoice_watcher(
             deal_service,
             crypto_pay,
             kb_client,
-            bot,
+            notifier,
             config.invoice_poll_interval,
+            config.invoice_poll_max_interval,
         )
     )
-    dispute_task = asyncio.create_task(dispute_timer_watcher(deal_service, bot))
-    support_task = asyncio.create_task(support_inactive_watcher(support_service, bot))
+    background_tasks = [scheduler_task, invoice_task]
+    if archive is not None and config.deal_archive_days > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                archive_watcher(deal_service, chat_service, archive, config.deal_archive_days)
+            )
+        )
+    if config.storage_backend == "journal":
+        background_tasks.append(
+            asyncio.create_task(
+                compaction_watcher(repository, config.storage_compact_interval)
+            )
+        )
 
-    app = create_app(bot, get_deps())
+    app = create_app(bot, get_deps(), notifier)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(
@@ -125,18 +220,24 @@ async def run_bot() -> None:
     try:
         await dp.start_polling(bot)
     finally:
-        for task in (expiry_task, invoice_task, dispute_task, support_task):
+        for task in background_tasks:
             task.cancel()
-        await asyncio.gather(
-            expiry_task,
-            invoice_task,
-            dispute_task,
-            support_task,
-            return_exceptions=True,
-        )
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await payout_service.close()
         with contextlib.suppress(Exception):
             await runner.cleanup()
+        await webhook_consumer.close()
+        webhook_inbox.close()
+        await user_service.flush_presence()
+        await repository.flush()
+        if isinstance(repository, (JournalStateRepository, ShardedStateRepository)):
+            await repository.compact()
+        repository.close()
+        if archive is not None:
+            archive.close()
         await crypto_pay.close()
+        await kb_client.close()
+        await notifier.close()
         await bot.session.close()
 
 
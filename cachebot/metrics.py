@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Dict, Sequence
+
+LATENCY_BUCKETS_MS: tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000)
+SIZE_BUCKETS: tuple[float, ...] = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 3),
+            "buckets": {
+                **{str(bound): count for bound, count in zip(self.buckets, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def to_dict(self) -> int:
+        return self.value
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def set(self, value: int) -> None:
+        self.value = value
+
+    def to_dict(self) -> int:
+        return self.value
+
+
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, Counter] = {}
+_gauges: Dict[str, Gauge] = {}
+
+
+def histogram(name: str, buckets: Sequence[float] = LATENCY_BUCKETS_MS) -> Histogram:
+    metric = _histograms.get(name)
+    if metric is None:
+        metric = _histograms[name] = Histogram(buckets)
+    return metric
+
+
+def counter(name: str) -> Counter:
+    metric = _counters.get(name)
+    if metric is None:
+        metric = _counters[name] = Counter()
+    return metric
+
+
+def gauge(name: str) -> Gauge:
+    metric = _gauges.get(name)
+    if metric is None:
+        metric = _gauges[name] = Gauge()
+    return metric
+
+
+def snapshot() -> dict:
+    return {
+        "counters": {name: metric.to_dict() for name, metric in sorted(_counters.items())},
+        "gauges": {name: metric.to_dict() for name, metric in sorted(_gauges.items())},
+        "histograms": {name: metric.to_dict() for name, metric in sorted(_histograms.items())},
+    }
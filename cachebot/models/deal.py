@@ -62,6 +62,8 @@ class Deal:
     is_p2p: bool = False
     advert_id: str | None = None
     balance_reserved: bool = False
+    # Bumped on every change, see ChangeFeed.
+    version: int = 0
 
     @property
     def hashtag(self) -> str:
@@ -107,6 +109,7 @@ class Deal:
             "is_p2p": self.is_p2p,
             "advert_id": self.advert_id,
             "balance_reserved": self.balance_reserved,
+            "version": self.version,
         }
 
     @classmethod
@@ -156,6 +159,7 @@ class Deal:
             is_p2p=bool(data.get("is_p2p")),
             advert_id=data.get("advert_id"),
             balance_reserved=bool(data.get("balance_reserved", True)),
+            version=int(data.get("version") or 0),
         )
 
 
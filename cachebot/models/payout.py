@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+
+
+class PayoutStatus(str, Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    REFUNDED = "refunded"
+
+
+@dataclass(slots=True)
+class Payout:
+    id: str
+    user_id: int
+    amount: Decimal
+    fee: Decimal
+    currency: str
+    spend_id: str
+    created_at: datetime
+    updated_at: datetime
+    status: PayoutStatus = PayoutStatus.PENDING
+    attempts: int = 0
+    error: str | None = None
+    transfer_id: str | None = None
+
+    @property
+    def total(self) -> Decimal:
+        return self.amount + self.fee
+
+    def to_dict(self) -> dict[str, str | int | None]:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "amount": str(self.amount),
+            "fee": str(self.fee),
+            "currency": self.currency,
+            "spend_id": self.spend_id,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "status": self.status.value,
+            "attempts": self.attempts,
+            "error": self.error,
+            "transfer_id": self.transfer_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Payout":
+        return cls(
+            id=str(data["id"]),
+            user_id=int(data["user_id"]),
+            amount=Decimal(data["amount"]),
+            fee=Decimal(data.get("fee", "0")),
+            currency=data.get("currency", "USDT"),
+            spend_id=str(data["spend_id"]),
+            created_at=datetime.fromisoformat(data["created_at"]),
+            updated_at=datetime.fromisoformat(data.get("updated_at") or data["created_at"]),
+            status=PayoutStatus(data.get("status", PayoutStatus.PENDING.value)),
+            attempts=int(data.get("attempts", 0)),
+            error=data.get("error"),
+            transfer_id=data.get("transfer_id"),
+        )
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+from cachebot.services.chats import ChatService
+from cachebot.services.deals import DealService
+from cachebot.storage import DealArchive
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_finished_deals(
+    deal_service: DealService,
+    chat_service: ChatService,
+    archive: DealArchive,
+    max_age: timedelta,
+    batch_size: int = 500,
+) -> int:
+    """Moves finished deals older than ``max_age`` and their chats to ``archive``.
+
+    Everything is written to the archive before it is dropped from the state,
+    so a crash in between leaves the deals in both places rather than in none.
+    The state itself is persisted once per run.
+    """
+    before = datetime.now(timezone.utc) - max_age
+    deals = await deal_service.list_archivable(before)
+    if not deals:
+        return 0
+    stored: Dict[str, dict] = {}
+    counts: Dict[str, int] = {}
+    for start in range(0, len(deals), batch_size):
+        batch = [deal.to_dict() for deal in deals[start : start + batch_size]]
+        chats = {data["id"]: await chat_service.list_messages(data["id"]) for data in batch}
+        await archive.store(batch, chats)
+        stored.update((data["id"], data) for data in batch)
+        counts.update((deal_id, len(messages)) for deal_id, messages in chats.items())
+    # Deals that changed while being archived stay; the next run stores them again.
+    dropped = await deal_service.forget_archived(stored)
+    await chat_service.forget_archived({deal_id: counts[deal_id] for deal_id in dropped})
+    logger.info("Archived %s finished deals", len(dropped))
+    return len(dropped)
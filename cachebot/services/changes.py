@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+_DEAL = "deal"
+_CHAT = "chat"
+_BALANCE = "balance"
+_SUPPORT = "support"
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+async def _nobody(deal_id: str) -> Iterable[int]:
+    return ()
+
+
+@dataclass(slots=True)
+class Changes:
+    deal_ids: List[str] = field(default_factory=list)
+    chat_deal_ids: List[str] = field(default_factory=list)
+    support_ticket_ids: List[int] = field(default_factory=list)
+    balance: bool = False
+
+
+class ChangeFeed:
+    """Versions of what the webapp follows, for ``/api/sync`` and ``/api/events``.
+
+    One clock is shared by the services: a version is the current time in
+    microseconds, kept strictly increasing, so versions stored with deals keep
+    growing across restarts.  Per user the feed remembers the deals, chats,
+    support tickets and the balance changed since start-up, newest last, for
+    the ``max_users`` users who changed most recently.  Asking for changes
+    older than the start-up, or older than the last change of a user whose
+    feed was dropped to make room, gives ``None`` and the caller has to look
+    at the stored versions instead.
+
+    Listeners ``wait`` on a user: every change wakes all of them at once and
+    each reads what it has not seen yet, so nothing is queued per listener.
+    """
+
+    def __init__(self, max_users: int = 50_000) -> None:
+        self._version = _now_us()
+        self._started = self._version
+        # Least recently changed first.
+        self._users: OrderedDict[int, Dict[tuple[str, object], int]] = OrderedDict()
+        self._max_users = max_users
+        # Changes up to this version may have been dropped with a feed.
+        self._complete_from = self._started
+        self._waiters: Dict[int, asyncio.Future[None]] = {}
+        self._listeners: Dict[int, int] = {}
+        # Participants of a deal, for chat changes; set by DealService.
+        self._participants: Callable[[str], Awaitable[Iterable[int]]] = _nobody
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def started(self) -> int:
+        return self._started
+
+    def advance(self, version: int) -> None:
+        # Versions already handed out by an earlier run stay behind the feed.
+        if version > self._version:
+            self._version = self._started = version
+            self._complete_from = max(self._complete_from, version)
+
+    def resolve_participants(self, participants: Callable[[str], Awaitable[Iterable[int]]]) -> None:
+        self._participants = participants
+
+    def deal_changed(self, deal_id: str, user_ids: Iterable[int | None]) -> int:
+        return self._touch(user_ids, (_DEAL, deal_id))
+
+    def balance_changed(self, user_id: int) -> None:
+        self._touch((user_id,), (_BALANCE, None))
+
+    async def chat_changed(self, deal_id: str) -> None:
+        # The participants of an archived deal are read from the archive.
+        self._touch(await self._participants(deal_id), (_CHAT, deal_id))
+
+    def support_changed(self, ticket_id: int, user_ids: Iterable[int | None]) -> None:
+        self._touch(user_ids, (_SUPPORT, ticket_id))
+
+    def forget_deal(self, deal_id: str, user_ids: Iterable[int | None]) -> None:
+        for user_id in user_ids:
+            feed = self._users.get(user_id)
+            if feed is not None:
+                feed.pop((_DEAL, deal_id), None)
+                feed.pop((_CHAT, deal_id), None)
+                if not feed:
+                    del self._users[user_id]
+
+    def changes(self, user_id: int, since: int) -> Changes | None:
+        if since < self._complete_from:
+            return None
+        result = Changes()
+        # The feed is ordered by version, so only the tail is read.
+        for (kind, key), version in reversed(self._users.get(user_id, {}).items()):
+            if version <= since:
+                break
+            if kind == _DEAL:
+                result.deal_ids.append(key)
+            elif kind == _CHAT:
+                result.chat_deal_ids.append(key)
+            elif kind == _SUPPORT:
+                result.support_ticket_ids.append(key)
+            else:
+                result.balance = True
+        return result
+
+    def changed_since(self, user_id: int, since: int) -> bool:
+        feed = self._users.get(user_id)
+        if not feed:
+            return since < self._complete_from
+        return next(reversed(feed.values())) > since
+
+    async def wait(self, user_id: int, since: int, timeout: float) -> bool:
+        # True as soon as the user has changes newer than ``since``, False
+        # after ``timeout`` without any.
+        if self.changed_since(user_id, since):
+            return True
+        waiter = self._waiters.get(user_id)
+        if waiter is None:
+            waiter = self._waiters[user_id] = asyncio.get_running_loop().create_future()
+        self._listeners[user_id] = self._listeners.get(user_id, 0) + 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            count = self._listeners.pop(user_id) - 1
+            if count:
+                self._listeners[user_id] = count
+            elif self._waiters.get(user_id) is waiter:
+                del self._waiters[user_id]
+        return True
+
+    def _touch(self, user_ids: Iterable[int | None], key: tuple[str, object]) -> int:
+        self._version = max(self._version + 1, _now_us())
+        for user_id in user_ids:
+            if user_id is None:
+                continue
+            feed = self._users.get(user_id)
+            if feed is None:
+                feed = self._users[user_id] = {}
+                if len(self._users) > self._max_users:
+                    _, dropped = self._users.popitem(last=False)
+                    self._complete_from = max(
+                        self._complete_from, next(reversed(dropped.values()))
+                    )
+            else:
+                self._users.move_to_end(user_id)
+            feed.pop(key, None)
+            feed[key] = self._version
+            waiter = self._waiters.pop(user_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+        return self._version
@@ -1,37 +1,135 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from datetime import datetime, timezone
-from typing import Dict, List
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Sequence
 from uuid import uuid4
 
 from cachebot.models.chat import ChatMessage
-from cachebot.storage import StateRepository
+from cachebot.services.changes import ChangeFeed
+from cachebot.storage import DealArchive, StateRepository
+
+
+class _ChatIndex:
+    """Positions of one chat's messages by id, and per recipient the
+    positions of the messages addressed to them (``None``: to everyone)."""
+
+    __slots__ = ("messages", "size", "positions", "visible")
+
+    def __init__(self, messages: List[ChatMessage]) -> None:
+        self.messages = messages
+        self.size = 0
+        self.positions: Dict[str, int] = {}
+        self.visible: Dict[int | None, List[int]] = {}
+        for msg in messages:
+            self.add(msg)
+
+    def add(self, msg: ChatMessage) -> None:
+        self.positions[msg.id] = self.size
+        self.visible.setdefault(msg.recipient_id, []).append(self.size)
+        self.size += 1
+
+    def current(self, messages: List[ChatMessage]) -> bool:
+        return messages is self.messages and self.size == len(messages)
+
+    def page(
+        self,
+        user_id: int | None,
+        *,
+        after: str | None,
+        before: str | None,
+        limit: int,
+    ) -> tuple[List[ChatMessage], bool]:
+        # ``user_id`` None reads every message.  Pages are in chat order;
+        # the flag tells whether more messages lie beyond the page.
+        if user_id is None:
+            lists = [range(self.size)]
+        else:
+            lists = [self.visible.get(None, []), self.visible.get(user_id, [])]
+        if after is not None:
+            start = self.positions[after]
+            merged = heapq.merge(*(_ascending(items, bisect_right(items, start)) for items in lists))
+        else:
+            end = self.positions[before] if before is not None else self.size
+            merged = heapq.merge(
+                *(_descending(items, bisect_left(items, end)) for items in lists), reverse=True
+            )
+        picked = list(islice(merged, limit + 1))
+        more = len(picked) > limit
+        del picked[limit:]
+        if after is None:
+            picked.reverse()
+        return [self.messages[position] for position in picked], more
+
+
+def _ascending(items: Sequence[int], start: int) -> Iterator[int]:
+    return (items[i] for i in range(start, len(items)))
+
+
+def _descending(items: Sequence[int], end: int) -> Iterator[int]:
+    return (items[i] for i in range(end - 1, -1, -1))
 
 
 class ChatService:
-    def __init__(self, repository: StateRepository) -> None:
+    INDEX_SIZE = 1024
+
+    def __init__(
+        self,
+        repository: StateRepository,
+        archive: DealArchive | None = None,
+        *,
+        changes: ChangeFeed | None = None,
+    ) -> None:
         self._repository = repository
+        self._archive = archive
+        self._changes = changes or ChangeFeed()
         snapshot = repository.snapshot()
         self._chats: Dict[str, List[ChatMessage]] = {
             deal_id: list(messages) for deal_id, messages in snapshot.chats.items()
         }
+        # Chats of older deals may be left on disk by the repository.
+        self._cold = repository.cold("chats")
         self._lock = asyncio.Lock()
+        # Indexes of recently read chats, dropped when the chat goes away.
+        self._indexes: OrderedDict[str, _ChatIndex] = OrderedDict()
+
+    async def _messages_locked(self, deal_id: str) -> List[ChatMessage]:
+        messages = self._chats.get(deal_id)
+        if messages is None:
+            messages = self._cold.get(deal_id)
+        if messages is None and self._archive is not None:
+            messages = await self._archive.chat(deal_id)
+        return messages or []
+
+    async def _index_locked(self, deal_id: str) -> _ChatIndex:
+        messages = await self._messages_locked(deal_id)
+        index = self._indexes.get(deal_id)
+        if index is None or not index.current(messages):
+            index = self._indexes[deal_id] = _ChatIndex(messages)
+            while len(self._indexes) > self.INDEX_SIZE:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(deal_id)
+        return index
 
     async def list_messages(self, deal_id: str) -> List[ChatMessage]:
         async with self._lock:
-            return list(self._chats.get(deal_id, []))
+            return list(await self._messages_locked(deal_id))
 
     async def latest_message_at(self, deal_id: str) -> datetime | None:
         async with self._lock:
-            messages = self._chats.get(deal_id, [])
+            messages = await self._messages_locked(deal_id)
             if not messages:
                 return None
             return messages[-1].created_at
 
     async def latest_message(self, deal_id: str) -> ChatMessage | None:
         async with self._lock:
-            messages = self._chats.get(deal_id, [])
+            messages = await self._messages_locked(deal_id)
             if not messages:
                 return None
             return messages[-1]
@@ -59,9 +157,15 @@ class ChatService:
                 system=system,
                 recipient_id=recipient_id,
             )
-            bucket = self._chats.setdefault(deal_id, [])
+            bucket = self._chats.get(deal_id)
+            if bucket is None:
+                bucket = self._chats[deal_id] = list(await self._messages_locked(deal_id))
             bucket.append(msg)
-            await self._repository.persist_chats(self._chats)
+            index = self._indexes.get(deal_id)
+            if index is not None and index.messages is bucket:
+                index.add(msg)
+            await self._changes.chat_changed(deal_id)
+            await self._repository.persist_chats(self._chats, changed=[deal_id])
             return msg
 
     async def list_messages_for_user(
@@ -72,14 +176,32 @@ class ChatService:
         include_all: bool = False,
     ) -> List[ChatMessage]:
         async with self._lock:
-            messages = list(self._chats.get(deal_id, []))
-        if include_all:
+            if include_all:
+                return list(await self._messages_locked(deal_id))
+            index = await self._index_locked(deal_id)
+            messages, _ = index.page(user_id, after=None, before=None, limit=index.size)
             return messages
-        return [
-            msg
-            for msg in messages
-            if msg.recipient_id is None or msg.recipient_id == user_id
-        ]
+
+    async def page_messages_for_user(
+        self,
+        deal_id: str,
+        user_id: int,
+        *,
+        include_all: bool = False,
+        after: str | None = None,
+        before: str | None = None,
+        limit: int,
+    ) -> tuple[List[ChatMessage], bool]:
+        # Up to ``limit`` messages the user sees right after ``after`` or
+        # right before ``before`` (the latest ones without either), oldest
+        # first, and whether there are more past them.  LookupError for a
+        # message id that is not in the chat.
+        async with self._lock:
+            index = await self._index_locked(deal_id)
+            for message_id in (after, before):
+                if message_id is not None and message_id not in index.positions:
+                    raise LookupError(message_id)
+            return index.page(None if include_all else user_id, after=after, before=before, limit=limit)
 
     async def latest_message_for_user(
         self,
@@ -91,8 +213,44 @@ class ChatService:
         messages = await self.list_messages_for_user(deal_id, user_id, include_all=include_all)
         return messages[-1] if messages else None
 
+    async def latest_messages_for_user(
+        self,
+        deal_ids: Iterable[str],
+        user_id: int,
+        *,
+        include_all: bool = False,
+    ) -> Dict[str, ChatMessage]:
+        # Bulk ``latest_message_for_user``; deals without a visible message
+        # are left out.
+        result: Dict[str, ChatMessage] = {}
+        async with self._lock:
+            for deal_id in deal_ids:
+                for msg in reversed(await self._messages_locked(deal_id)):
+                    if include_all or msg.recipient_id is None or msg.recipient_id == user_id:
+                        result[deal_id] = msg
+                        break
+        return result
+
     async def purge_chat(self, deal_id: str) -> None:
         async with self._lock:
-            if deal_id in self._chats:
+            if deal_id in self._chats or self._cold.get(deal_id) is not None:
                 self._chats.pop(deal_id, None)
-                await self._repository.persist_chats(self._chats)
+                self._indexes.pop(deal_id, None)
+                await self._changes.chat_changed(deal_id)
+                await self._repository.persist_chats(self._chats, changed=[deal_id])
+
+    async def forget_archived(self, counts: Dict[str, int]) -> None:
+        # ``counts`` maps archived deal ids to the number of messages stored
+        # with them; chats that got new messages since are kept.
+        async with self._lock:
+            forgotten = []
+            for deal_id, count in counts.items():
+                messages = self._chats.get(deal_id)
+                if messages is None:
+                    messages = self._cold.get(deal_id)
+                if messages is not None and len(messages) == count:
+                    self._chats.pop(deal_id, None)
+                    self._indexes.pop(deal_id, None)
+                    forgotten.append(deal_id)
+            if forgotten:
+                await self._repository.persist_chats(self._chats, changed=forgotten)
@@ -1,13 +1,47 @@
 from __future__ import annotations
 
 import asyncio
+import logging
+import random
+import time
 from dataclasses import dataclass
 from decimal import Decimal
-from typing import Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 from uuid import uuid4
 
 import httpx
 
+from cachebot import metrics
+
+logger = logging.getLogger(__name__)
+
+# Failures that happened before the request left, so even calls that are not
+# idempotent can be repeated.
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CryptoPayUnavailable(RuntimeError):
+    """The API is failing and calls are refused until it recovers."""
+
+
+class CryptoPayError(RuntimeError):
+    """The call was refused; ``name`` is the API's error code.
+
+    ``name`` is None when the answer was not the API's JSON (a proxy error
+    page), so the call may still have run behind the proxy.
+    """
+
+    def __init__(self, message: str, name: str | None = None) -> None:
+        super().__init__(message)
+        self.name = name
+
+
+def _error_name(data: dict[str, Any]) -> str | None:
+    error = data.get("error")
+    if isinstance(error, dict):
+        return error.get("name")
+    return error if isinstance(error, str) else None
+
 
 @dataclass(slots=True)
 class CryptoInvoice:
@@ -18,11 +52,87 @@ class CryptoInvoice:
     pay_url: str
 
 
+@dataclass(slots=True)
+class _CircuitBreaker:
+    threshold: int
+    reset_after: float
+    failures: int = 0
+    opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_after:
+            return False
+        # Half-open: one probe per ``reset_after`` decides whether to close.
+        self.opened_at = now
+        return True
+
+    def succeeded(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Crypto Pay API recovered")
+        self.failures = 0
+        self.opened_at = None
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Crypto Pay API is failing, pausing calls for %ss", self.reset_after)
+            self.opened_at = time.monotonic()
+
+
 class CryptoPayClient:
+    """Crypto Pay API client.
+
+    Each method has its own timeout.  Reads and transfers (repeated with the
+    same ``spend_id``) are retried with jittered back-off on network errors,
+    429 and 5xx; invoice creation only when the request never left.  After
+    ``breaker_threshold`` failures in a row calls fail fast with
+    ``CryptoPayUnavailable`` for ``breaker_reset`` seconds.
+    """
+
     API_BASE = "https://pay.crypt.bot/api/"
+    # getInvoices answers with at most ``count`` items, 1000 at the most.
+    INVOICES_PER_REQUEST = 100
+    TIMEOUTS = {"createInvoice": 10.0, "getInvoices": 10.0, "transfer": 30.0}
 
-    def __init__(self, token: str | None) -> None:
+    def __init__(
+        self,
+        token: str | None,
+        api_base: str | None = None,
+        max_concurrency: int = 4,
+        *,
+        timeouts: Dict[str, float] | None = None,
+        max_attempts: int = 3,
+        retry_backoff: float = 0.5,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        max_connections: int = 20,
+        http2: bool = False,
+    ) -> None:
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                raise RuntimeError("HTTP/2 needs the h2 package: pip install 'httpx[http2]'") from None
         self._token = token
+        self._api_base = api_base or self.API_BASE
+        self._fetch_slots = asyncio.Semaphore(max_concurrency)
+        self._timeouts = {**self.TIMEOUTS, **(timeouts or {})}
+        self._max_attempts = max_attempts
+        self._retry_backoff = retry_backoff
+        self._breaker = _CircuitBreaker(breaker_threshold, breaker_reset)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._http2 = http2
         self._client: Optional[httpx.AsyncClient] = None
         self._dry_run = token is None
         self._lock = asyncio.Lock()
@@ -33,7 +143,13 @@ class CryptoPayClient:
                 headers = {"Content-Type": "application/json"}
                 if self._token:
                     headers["Crypto-Pay-API-Token"] = self._token
-                self._client = httpx.AsyncClient(base_url=self.API_BASE, headers=headers, timeout=20.0)
+                self._client = httpx.AsyncClient(
+                    base_url=self._api_base,
+                    headers=headers,
+                    timeout=20.0,
+                    limits=self._limits,
+                    http2=self._http2,
+                )
             return self._client
 
     async def close(self) -> None:
@@ -58,20 +174,19 @@ class CryptoPayClient:
                 currency=currency,
                 pay_url="https://t.me/CryptoBot?start=dry",
             )
-        client = await self._client_instance()
-        response = await client.post(
+        data = await self._call(
             "createInvoice",
-            json={
+            {
                 "amount": str(amount),
                 "currency_type": "crypto",
                 "asset": currency,
                 "description": description,
                 "payload": payload,
             },
+            idempotent=False,
         )
-        data = response.json()
         if not data.get("ok"):
-            raise RuntimeError(f"Crypto Pay error: {data}")
+            raise CryptoPayError(f"Crypto Pay error: {data}", _error_name(data))
         result = data["result"]
         return CryptoInvoice(
             invoice_id=str(result["invoice_id"]),
@@ -87,14 +202,22 @@ class CryptoPayClient:
             return []
         if self._dry_run:
             return []
-        client = await self._client_instance()
-        response = await client.post(
-            "getInvoices",
-            json={"invoice_ids": ",".join(ids)},
-        )
-        data = response.json()
+        chunks = [
+            ids[start : start + self.INVOICES_PER_REQUEST]
+            for start in range(0, len(ids), self.INVOICES_PER_REQUEST)
+        ]
+        results = await asyncio.gather(*(self._fetch_chunk(chunk) for chunk in chunks))
+        return [invoice for invoices in results for invoice in invoices]
+
+    async def _fetch_chunk(self, ids: List[str]) -> List[CryptoInvoice]:
+        async with self._fetch_slots:
+            data = await self._call(
+                "getInvoices",
+                {"invoice_ids": ",".join(ids), "count": len(ids)},
+                idempotent=True,
+            )
         if not data.get("ok"):
-            raise RuntimeError(f"Crypto Pay error: {data}")
+            raise CryptoPayError(f"Crypto Pay error: {data}", _error_name(data))
         result = data.get("result") or []
         if isinstance(result, dict):
             items = result.get("items", [])
@@ -113,20 +236,70 @@ class CryptoPayClient:
             )
         return invoices
 
-    async def transfer(self, *, user_id: int, amount: Decimal, currency: str = "USDT") -> dict:
+    async def transfer(
+        self,
+        *,
+        user_id: int,
+        amount: Decimal,
+        currency: str = "USDT",
+        spend_id: str | None = None,
+    ) -> dict:
         if self._dry_run:
             return {"status": "ok", "transfer_id": f"dry-{uuid4().hex}"}
-        client = await self._client_instance()
-        response = await client.post(
+        # Crypto Pay performs a transfer once per spend_id, so a retry cannot
+        # pay twice; callers that retry on their own pass a stable one.
+        data = await self._call(
             "transfer",
-            json={
+            {
                 "user_id": user_id,
                 "asset": currency,
                 "amount": str(amount),
-                "spend_id": str(uuid4()),
+                "spend_id": spend_id or str(uuid4()),
             },
+            idempotent=True,
         )
-        data = response.json()
         if not data.get("ok"):
-            raise RuntimeError(f"Crypto Pay transfer error: {data}")
+            raise CryptoPayError(f"Crypto Pay transfer error: {data}", _error_name(data))
         return data["result"]
+
+    async def _call(self, method: str, payload: dict[str, Any], *, idempotent: bool) -> dict[str, Any]:
+        if not self._breaker.allow():
+            metrics.counter("crypto_pay.rejected").inc()
+            raise CryptoPayUnavailable("Crypto Pay API is temporarily unavailable")
+        client = await self._client_instance()
+        latency = metrics.histogram(f"crypto_pay.{method}_ms")
+        timeout = self._timeouts.get(method, 20.0)
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(method, json=payload, timeout=timeout)
+            except httpx.TransportError as exc:
+                error: Exception = exc
+                retryable = idempotent or isinstance(exc, _NOT_SENT)
+            else:
+                if response.status_code < 500 and response.status_code != 429:
+                    self._breaker.succeeded()
+                    try:
+                        return response.json()
+                    except ValueError:
+                        # An error page from a proxy; the call may have run,
+                        # so the error carries no API name.
+                        if response.status_code >= 400:
+                            raise CryptoPayError(
+                                f"Crypto Pay error: HTTP {response.status_code} without JSON"
+                            ) from None
+                        raise RuntimeError(
+                            f"Crypto Pay error: HTTP {response.status_code} without JSON"
+                        ) from None
+                error = RuntimeError(f"Crypto Pay error: HTTP {response.status_code}")
+                retryable = idempotent
+            finally:
+                latency.observe((time.perf_counter() - started) * 1000)
+            self._breaker.failed()
+            metrics.counter(f"crypto_pay.{method}.errors").inc()
+            if not retryable or attempt >= self._max_attempts or self._breaker.is_open:
+                raise error
+            metrics.counter(f"crypto_pay.{method}.retries").inc()
+            await asyncio.sleep(self._retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
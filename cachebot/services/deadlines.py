@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+from cachebot import metrics
+
+logger = logging.getLogger(__name__)
+
+# Receives the keys whose deadline has passed; it must re-check its own state,
+# because a key may fire again after a failed run.
+Handler = Callable[[List[Any]], Awaitable[None]]
+
+
+class DeadlineScheduler:
+    """A single timer for every deadline the services keep.
+
+    Services ``schedule`` a ``(job, key)`` pair for a moment in time and the
+    handler registered for ``job`` gets the due keys in one batch.  Scheduling
+    a key again moves its deadline and ``None`` cancels it; the heap entries
+    left behind are skipped when they come up.
+    """
+
+    def __init__(self, retry_delay: float = 5.0, max_sleep: float = 300.0) -> None:
+        self._heap: List[tuple[datetime, int, str, Any]] = []
+        self._entries: Dict[tuple[str, Any], tuple[datetime, int]] = {}
+        self._seq = itertools.count()
+        self._handlers: Dict[str, Handler] = {}
+        self._depth: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._retry_delay = timedelta(seconds=retry_delay)
+        self._max_sleep = max_sleep
+
+    def register(self, job: str, handler: Handler) -> None:
+        self._handlers[job] = handler
+
+    def schedule(self, job: str, key: Any, when: datetime | None) -> None:
+        current = self._entries.get((job, key))
+        if when is None:
+            if current is not None:
+                del self._entries[(job, key)]
+                self._count(job, -1)
+            return
+        if current is not None and current[0] == when:
+            return
+        if current is None:
+            self._count(job, 1)
+        seq = next(self._seq)
+        self._entries[(job, key)] = (when, seq)
+        heapq.heappush(self._heap, (when, seq, job, key))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [(when, seq, job, key) for (job, key), (when, seq) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, job: str, key: Any) -> None:
+        self.schedule(job, key, None)
+
+    def deadline(self, job: str, key: Any) -> datetime | None:
+        entry = self._entries.get((job, key))
+        return entry[0] if entry is not None else None
+
+    def pending(self, job: str) -> int:
+        return self._depth.get(job, 0)
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = datetime.now(timezone.utc)
+            due = self._pop_due(now)
+            for job, items in due.items():
+                await self._fire(job, items)
+            if due:
+                continue
+            delay = self._max_sleep
+            if self._heap:
+                delay = min(delay, (self._heap[0][0] - now).total_seconds())
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[tuple[Any, datetime]]]:
+        due: Dict[str, List[tuple[Any, datetime]]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            when, seq, job, key = heapq.heappop(self._heap)
+            if self._entries.get((job, key)) != (when, seq):
+                continue
+            del self._entries[(job, key)]
+            self._count(job, -1)
+            due.setdefault(job, []).append((key, when))
+        return due
+
+    async def _fire(self, job: str, items: List[tuple[Any, datetime]]) -> None:
+        handler = self._handlers.get(job)
+        if handler is None:
+            logger.warning("No handler for %s, dropping %s deadlines", job, len(items))
+            return
+        now = datetime.now(timezone.utc)
+        lateness = metrics.histogram(f"scheduler.{job}.lateness_ms")
+        for _, when in items:
+            lateness.observe((now - when).total_seconds() * 1000)
+        keys = [key for key, _ in items]
+        started = time.perf_counter()
+        try:
+            await handler(keys)
+        except Exception as exc:  # pragma: no cover - protection loop
+            metrics.counter(f"scheduler.{job}.errors").inc()
+            logger.exception("Scheduled job %s failed: %s", job, exc)
+            retry_at = datetime.now(timezone.utc) + self._retry_delay
+            for key in keys:
+                if (job, key) not in self._entries:
+                    self.schedule(job, key, retry_at)
+        finally:
+            metrics.histogram(f"scheduler.{job}.run_ms").observe((time.perf_counter() - started) * 1000)
+
+    def _count(self, job: str, delta: int) -> None:
+        depth = self._depth.get(job, 0) + delta
+        self._depth[job] = depth
+        metrics.gauge(f"scheduler.{job}.depth").set(depth)
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import AbstractSet, Dict, Iterable, Iterator, List
+
+from cachebot.models.deal import Deal, DealStatus
+
+# (seller_id, buyer_id, status, upper public_id, invoice_id)
+_Keys = tuple
+# Position in a user's deal list, newest first: ``(created_at, id)``.
+DealCursor = tuple[datetime, str]
+
+
+def _users(keys: _Keys) -> set[int]:
+    return {user_id for user_id in keys[:2] if user_id is not None}
+
+
+def _keys_of(deal: Deal) -> _Keys:
+    public_id = deal.public_id or None
+    if public_id and not public_id.isupper():
+        public_id = public_id.upper()
+    return (deal.seller_id, deal.buyer_id, deal.status, public_id, deal.invoice_id)
+
+
+class DealIndex:
+    """Secondary lookups over the deals kept in memory.
+
+    Deals are mutated in place, so the index remembers the keys each deal was
+    filed under and ``update`` moves it when any of them changed.  Every
+    bucket maps deal ids to deals in insertion order.  Per user there is also
+    a sorted timeline of ``(created_at, id)`` for paging and a count of deals
+    by status.
+    """
+
+    def __init__(self, deals: Iterable[Deal] = ()) -> None:
+        self._keys: Dict[str, _Keys] = {}
+        self._by_user: Dict[int, Dict[str, Deal]] = {}
+        self._by_status: Dict[DealStatus, Dict[str, Deal]] = {}
+        self._by_public_id: Dict[str, Deal] = {}
+        self._by_invoice: Dict[str, Deal] = {}
+        self._timelines: Dict[int, List[DealCursor]] = {}
+        self._counts: Dict[int, Dict[DealStatus, int]] = {}
+        for deal in deals:
+            self._file(deal, timeline=False)
+        for user_id, bucket in self._by_user.items():
+            self._timelines[user_id] = sorted(
+                (deal.created_at, deal.id) for deal in bucket.values()
+            )
+
+    def update(self, deal: Deal) -> None:
+        old = self._keys.get(deal.id)
+        if old is not None:
+            keys = _keys_of(deal)
+            if old == keys and self._by_status[deal.status].get(deal.id) is deal:
+                return
+            # Timelines only change for users who joined or left the deal.
+            self._unfile(deal.id, old, keep=_users(keys))
+            self._file(deal, placed=_users(old))
+            return
+        self._file(deal)
+
+    def remove(self, deal_id: str) -> None:
+        old = self._keys.pop(deal_id, None)
+        if old is not None:
+            self._unfile(deal_id, old)
+
+    def of_user(self, user_id: int) -> List[Deal]:
+        return list(self._by_user.get(user_id, {}).values())
+
+    def with_status(self, *statuses: DealStatus) -> List[Deal]:
+        deals: List[Deal] = []
+        for status in statuses:
+            deals.extend(self._by_status.get(status, {}).values())
+        return deals
+
+    def user_deals(self, user_id: int, before: DealCursor | None = None) -> Iterator[Deal]:
+        # Newest first, starting below ``before``.  Reads the live index, so
+        # it has to be consumed before any deal changes.
+        timeline = self._timelines.get(user_id)
+        if not timeline:
+            return
+        bucket = self._by_user[user_id]
+        position = len(timeline) if before is None else bisect_left(timeline, before)
+        for index in range(position - 1, -1, -1):
+            yield bucket[timeline[index][1]]
+
+    def status_counts(self, user_id: int) -> Dict[DealStatus, int]:
+        return dict(self._counts.get(user_id, {}))
+
+    def users_of(self, deal_id: str) -> set[int]:
+        keys = self._keys.get(deal_id)
+        return _users(keys) if keys is not None else set()
+
+    def by_public_id(self, public_id: str) -> Deal | None:
+        return self._by_public_id.get(public_id.upper())
+
+    def by_invoice(self, invoice_id: str) -> Deal | None:
+        return self._by_invoice.get(invoice_id)
+
+    def verify(self, deals: Dict[str, Deal]) -> None:
+        """Raises ``RuntimeError`` when the index disagrees with ``deals``."""
+        expected = DealIndex(deals.values())
+        for name in (
+            "_keys",
+            "_by_user",
+            "_by_status",
+            "_by_public_id",
+            "_by_invoice",
+            "_timelines",
+            "_counts",
+        ):
+            actual = getattr(self, name)
+            wanted = getattr(expected, name)
+            if name in ("_by_user", "_by_status"):
+                actual = {key: set(bucket) for key, bucket in actual.items() if bucket}
+                wanted = {key: set(bucket) for key, bucket in wanted.items()}
+            elif name not in ("_keys", "_timelines", "_counts"):
+                actual = {key: deal.id for key, deal in actual.items()}
+                wanted = {key: deal.id for key, deal in wanted.items()}
+            if actual != wanted:
+                raise RuntimeError(f"Deal index {name.lstrip('_')} is out of sync")
+        for deal_id, deal in deals.items():
+            if self._by_status[deal.status][deal_id] is not deal:
+                raise RuntimeError(f"Deal index holds a stale copy of {deal_id}")
+
+    def _file(
+        self,
+        deal: Deal,
+        placed: AbstractSet[int] = frozenset(),
+        timeline: bool = True,
+    ) -> None:
+        # ``placed``: users whose timeline already has the deal.
+        keys = _keys_of(deal)
+        self._keys[deal.id] = keys
+        seller_id, buyer_id, status, public_id, invoice_id = keys
+        by_user = self._by_user
+        for user_id in _users(keys):
+            bucket = by_user.get(user_id)
+            if bucket is None:
+                bucket = by_user[user_id] = {}
+            bucket[deal.id] = deal
+            counts = self._counts.get(user_id)
+            if counts is None:
+                counts = self._counts[user_id] = {}
+            counts[status] = counts.get(status, 0) + 1
+            if timeline and user_id not in placed:
+                insort(self._timelines.setdefault(user_id, []), (deal.created_at, deal.id))
+        bucket = self._by_status.get(status)
+        if bucket is None:
+            bucket = self._by_status[status] = {}
+        bucket[deal.id] = deal
+        if public_id:
+            self._by_public_id[public_id] = deal
+        if invoice_id:
+            self._by_invoice[invoice_id] = deal
+
+    def _unfile(self, deal_id: str, keys: _Keys, keep: AbstractSet[int] = frozenset()) -> None:
+        # ``keep``: users whose timeline entry stays.
+        seller_id, buyer_id, status, public_id, invoice_id = keys
+        for user_id in _users(keys):
+            bucket = self._by_user.get(user_id)
+            if bucket is None:
+                continue
+            deal = bucket.pop(deal_id, None)
+            if not bucket:
+                del self._by_user[user_id]
+            if deal is None:
+                continue
+            counts = self._counts[user_id]
+            counts[status] -= 1
+            if not counts[status]:
+                del counts[status]
+                if not counts:
+                    del self._counts[user_id]
+            if user_id not in keep:
+                timeline = self._timelines[user_id]
+                del timeline[bisect_left(timeline, (deal.created_at, deal_id))]
+                if not timeline:
+                    del self._timelines[user_id]
+        bucket = self._by_status.get(status)
+        if bucket is not None:
+            bucket.pop(deal_id, None)
+        for lookup, key in ((self._by_public_id, public_id), (self._by_invoice, invoice_id)):
+            deal = lookup.get(key) if key else None
+            if deal is not None and deal.id == deal_id:
+                del lookup[key]
@@ -1,15 +1,66 @@
 from __future__ import annotations
 
 import asyncio
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import AbstractSet, AsyncGenerator, AsyncIterator, Dict, Iterable, List, Optional
 from uuid import uuid4
 
 from cachebot.models.deal import Deal, DealStatus, QrStage
 from cachebot.models.balance_event import BalanceEvent
+from cachebot.models.payout import Payout, PayoutStatus
+from cachebot.services.changes import ChangeFeed
+from cachebot.services.deadlines import DeadlineScheduler
+from cachebot.services.deal_index import DealCursor, DealIndex
 from cachebot.services.rate_provider import RateProvider
-from cachebot.storage import StateRepository
+from cachebot.storage import DealArchive, StateRepository
+from cachebot.storage.state import collector_paused
+
+TERMINAL_STATUSES = frozenset({DealStatus.COMPLETED, DealStatus.CANCELED, DealStatus.EXPIRED})
+
+# Deadline jobs keyed by deal id.
+EXPIRY_JOB = "deal_expiry"
+DISPUTE_TIMER_JOB = "dispute_timer"
+# Ledger id prefix of a credited top-up, followed by its invoice id.
+TOPUP_EVENT_PREFIX = "topup:"
+
+
+@dataclass(frozen=True, slots=True)
+class DealFilter:
+    statuses: AbstractSet[DealStatus] = frozenset()
+    role: str | None = None  # "seller" or "buyer"
+    is_p2p: bool | None = None
+    created_from: datetime | None = None  # inclusive
+    created_to: datetime | None = None  # exclusive
+
+    def matches(self, deal: Deal, user_id: int) -> bool:
+        if self.statuses and deal.status not in self.statuses:
+            return False
+        if self.role == "seller" and deal.seller_id != user_id:
+            return False
+        if self.role == "buyer" and deal.buyer_id != user_id:
+            return False
+        if self.is_p2p is not None and deal.is_p2p != self.is_p2p:
+            return False
+        return True
+
+
+async def _islice(deals: AsyncGenerator[Deal, None], start: int, stop: int) -> List[Deal]:
+    # ``itertools.islice`` for the deal generators below, which are closed
+    # once enough has been read.
+    taken: List[Deal] = []
+    position = 0
+    try:
+        async for deal in deals:
+            if position >= start:
+                taken.append(deal)
+            position += 1
+            if position >= stop:
+                break
+    finally:
+        await deals.aclose()
+    return taken
 
 
 class DealService:
@@ -21,14 +72,43 @@ class DealService:
         offer_window_minutes: int | None = None,
         *,
         admin_ids: set[int] | None = None,
+        archive: DealArchive | None = None,
+        scheduler: DeadlineScheduler | None = None,
+        changes: ChangeFeed | None = None,
     ) -> None:
         self._repository = repository
+        self._scheduler = scheduler or DeadlineScheduler()
+        self._changes = changes or ChangeFeed()
+        self._archive = archive
         self._rate_provider = rate_provider
         self._lock = asyncio.Lock()
         snapshot = repository.snapshot()
         self._deals: Dict[str, Deal] = {deal.id: deal for deal in snapshot.deals}
+        # Built once at start; ``verify_indexes`` rebuilds it on the loop
+        # with the collector left alone.
+        with collector_paused():
+            self._index = DealIndex(self._deals.values())
+        self._changes.advance(max((deal.version for deal in self._deals.values()), default=0))
+        self._changes.resolve_participants(self._participants)
+        # Working-set deals that also have a row in the archive (changed after
+        # archiving), so that counts take each deal once; read on first use,
+        # see ``_revived_locked``.
+        self._revived: Dict[str, Deal] | None = None if archive is not None else {}
+        # The archived deal last handed out by ``_ensure_deal`` as a copy.
+        self._reviving: Deal | None = None
+        for deal in self._index.with_status(DealStatus.PENDING, DealStatus.PAID):
+            self._schedule_locked(deal)
         self._balances: Dict[int, Decimal] = snapshot.balances.copy()
         self._balance_events: List[BalanceEvent] = list(getattr(snapshot, "balance_events", []))
+        # Older ledger entries may be left on disk by the repository.
+        self._cold_events = repository.cold("balance_events")
+        # Ledger ids of credited top-ups still in memory; see ``credit_topup``.
+        self._topup_events = {
+            event.id for event in self._balance_events if event.id.startswith(TOPUP_EVENT_PREFIX)
+        }
+        self._payouts: Dict[str, Payout] = {payout.id: payout for payout in snapshot.payouts}
+        # Keys written since the last ``_persist``, by storage section.
+        self._unsaved: Dict[str, Dict[str, None]] = {}
         self._payment_window = timedelta(minutes=payment_window_minutes)
         self._offer_window = timedelta(
             minutes=offer_window_minutes if offer_window_minutes is not None else payment_window_minutes
@@ -63,9 +143,9 @@ class DealService:
             )
             deal.dispute_available_at = None
             deal.dispute_notified = False
-            self._deals[deal.id] = deal
+            self._put_deal_locked(deal)
             self._reset_qr_locked(deal)
-            await self._persist()
+            await self._persist(deal)
         return deal
 
     async def create_p2p_deal(
@@ -94,7 +174,7 @@ class DealService:
             current = self._balances.get(seller_id, Decimal("0"))
             if current < seller_debit:
                 raise ValueError("Недостаточно баланса")
-            self._balances[seller_id] = current - seller_debit
+            self._set_balance_locked(seller_id, current - seller_debit)
             now = datetime.now(timezone.utc)
             deal = Deal(
                 id=str(uuid4()),
@@ -116,9 +196,9 @@ class DealService:
             )
             deal.dispute_available_at = None
             deal.dispute_notified = False
-            self._deals[deal.id] = deal
+            self._put_deal_locked(deal)
             self._reset_qr_locked(deal)
-            await self._persist()
+            await self._persist(deal)
         return deal
 
     async def create_p2p_offer(
@@ -175,11 +255,11 @@ class DealService:
             )
             deal.dispute_available_at = None
             deal.dispute_notified = False
-            self._deals[deal.id] = deal
+            self._put_deal_locked(deal)
             self._reset_qr_locked(deal)
             if bank_options:
                 deal.qr_bank_options = list(bank_options)
-            await self._persist()
+            await self._persist(deal)
         return deal
 
     async def create_p2p_deal_reserved(
@@ -233,13 +313,13 @@ class DealService:
             if bank_options:
                 deal.qr_bank_options = list(bank_options)
             deal.qr_stage = QrStage.AWAITING_SELLER_ATTACH
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
         return deal
 
     async def accept_p2p_offer(self, deal_id: str, actor_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status != DealStatus.PENDING:
                 raise ValueError("Предложение уже обработано")
             if deal.offer_initiator_id == actor_id:
@@ -257,7 +337,7 @@ class DealService:
             seller_debit = base_usdt + (base_usdt * fee_multiplier)
             if current < seller_debit:
                 raise ValueError("Недостаточно баланса")
-            self._balances[deal.seller_id] = current - seller_debit
+            self._set_balance_locked(deal.seller_id, current - seller_debit)
             deal.balance_reserved = True
             deal.status = DealStatus.PAID
             deal.offer_expires_at = None
@@ -268,13 +348,13 @@ class DealService:
             deal.dispute_notified = False
             self._reset_qr_locked(deal)
             deal.qr_stage = QrStage.AWAITING_SELLER_ATTACH
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def choose_p2p_bank(self, deal_id: str, actor_id: int, bank: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status != DealStatus.PENDING:
                 raise ValueError("Предложение уже обработано")
             if deal.offer_initiator_id == actor_id:
@@ -287,8 +367,8 @@ class DealService:
                 raise ValueError("Некорректный банкомат")
             deal.atm_bank = bank
             deal.qr_bank_options = []
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def decline_p2p_offer(
@@ -299,7 +379,7 @@ class DealService:
         expired: bool = False,
     ) -> tuple[Deal, Decimal]:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status != DealStatus.PENDING:
                 raise ValueError("Предложение уже обработано")
             if actor_id not in {deal.seller_id, deal.buyer_id} and not self._is_admin(actor_id):
@@ -315,28 +395,143 @@ class DealService:
             deal.invoice_id = None
             deal.invoice_url = None
             self._reset_qr_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal, base_usdt
 
     async def list_open_deals(self) -> List[Deal]:
         async with self._lock:
-            return sorted(
-                (deal for deal in self._deals.values() if deal.status == DealStatus.OPEN),
-                key=lambda deal: deal.created_at,
+            return sorted(self._index.with_status(DealStatus.OPEN), key=lambda deal: deal.created_at)
+
+    async def user_deals_page(
+        self,
+        user_id: int,
+        *,
+        limit: int,
+        cursor: DealCursor | None = None,
+        filters: DealFilter | None = None,
+    ) -> tuple[List[Deal], DealCursor | None]:
+        # Keyset page of the user's deals, newest first, with the cursor of
+        # the next page (None on the last one).
+        async with self._lock:
+            deals = await _islice(
+                self._user_deals_locked(user_id, cursor, filters or DealFilter(), limit + 1),
+                0,
+                limit + 1,
+            )
+        if len(deals) <= limit:
+            return deals, None
+        deals = deals[:limit]
+        return deals, (deals[-1].created_at, deals[-1].id)
+
+    async def iter_user_deals(
+        self, user_id: int, filters: DealFilter | None = None, page: int = 200
+    ) -> AsyncIterator[Deal]:
+        # All of the user's deals, newest first; the lock is held for one page
+        # at a time.
+        cursor: DealCursor | None = None
+        while True:
+            deals, cursor = await self.user_deals_page(
+                user_id, limit=page, cursor=cursor, filters=filters
             )
+            for deal in deals:
+                yield deal
+            if cursor is None:
+                return
+
+    async def user_deals_at(self, user_id: int, offset: int, limit: int) -> List[Deal]:
+        # For the bot's numbered pages.
+        async with self._lock:
+            deals = self._user_deals_locked(user_id, None, DealFilter(), offset + limit)
+            return await _islice(deals, offset, offset + limit)
 
-    async def list_user_deals(self, user_id: int) -> List[Deal]:
+    async def user_deal_counts(self, user_id: int) -> Dict[DealStatus, int]:
         async with self._lock:
-            return sorted(
-                (
-                    deal
-                    for deal in self._deals.values()
-                    if deal.seller_id == user_id or deal.buyer_id == user_id
-                ),
-                key=lambda deal: deal.created_at,
-                reverse=True,
+            counts = self._index.status_counts(user_id)
+            if self._archive is None:
+                return counts
+            for status, count in (await self._archive.user_status_counts(user_id)).items():
+                status = DealStatus(status)
+                counts[status] = counts.get(status, 0) + count
+            for deal in (await self._revived_locked()).values():
+                if user_id in (deal.seller_id, deal.buyer_id):
+                    counts[deal.status] -= 1
+            return {status: count for status, count in counts.items() if count}
+
+    async def _user_deals_locked(
+        self,
+        user_id: int,
+        cursor: DealCursor | None,
+        filters: DealFilter,
+        wanted: int,
+    ) -> AsyncGenerator[Deal, None]:
+        before = cursor
+        if filters.created_to is not None and (
+            before is None or (filters.created_to, "") < before
+        ):
+            before = (filters.created_to, "")
+        live = self._index.user_deals(user_id, before)
+        archived = None
+        if self._archive is not None:
+            archived = self._archived_user_deals(user_id, before, min(wanted, 100), filters)
+        try:
+            mine = next(live, None)
+            other = await anext(archived, None) if archived is not None else None
+            last_id = None
+            while mine is not None or other is not None:
+                # Newest first; revived deals come from both sides and the
+                # live copy is taken first.
+                if other is None or (
+                    mine is not None and (mine.created_at, mine.id) >= (other.created_at, other.id)
+                ):
+                    deal, mine = mine, next(live, None)
+                else:
+                    deal, other = other, await anext(archived, None)
+                if filters.created_from is not None and deal.created_at < filters.created_from:
+                    return
+                if deal.id == last_id:
+                    continue
+                last_id = deal.id
+                if filters.matches(deal, user_id):
+                    yield deal
+        finally:
+            if archived is not None:
+                await archived.aclose()
+
+    async def _archived_user_deals(
+        self, user_id: int, before: DealCursor | None, size: int, filters: DealFilter
+    ) -> AsyncGenerator[Deal, None]:
+        # Read in batches, the first one sized to the page; rows that do not
+        # pass ``filters`` stay in SQLite.
+        position = None if before is None else (before[0].isoformat(), before[1])
+        statuses = [status.value for status in filters.statuses]
+        while True:
+            batch = await self._archive.user_deals_before(
+                user_id, position, size, statuses=statuses, role=filters.role, is_p2p=filters.is_p2p
             )
+            for deal in batch:
+                yield deal
+            if len(batch) < size:
+                return
+            position = (batch[-1].created_at.isoformat(), batch[-1].id)
+            size = 100
+
+    async def get_deals(self, deal_ids: Iterable[str]) -> List[Deal]:
+        # Unknown ids are skipped.
+        async with self._lock:
+            deals = []
+            for deal_id in deal_ids:
+                deal = self._deals.get(deal_id)
+                if deal is None and self._archive is not None:
+                    deal = await self._archive.get(deal_id)
+                if deal is not None:
+                    deals.append(deal)
+            return deals
+
+    async def working_deals_of(self, user_id: int) -> List[Deal]:
+        # The user's deals that are not archived; only these can change.
+        async with self._lock:
+            return self._index.of_user(user_id)
 
     async def list_all_deals(self) -> List[Deal]:
         async with self._lock:
@@ -344,22 +539,49 @@ class DealService:
 
     async def get_deal(self, deal_id: str) -> Deal | None:
         async with self._lock:
-            return self._deals.get(deal_id)
+            deal = self._deals.get(deal_id)
+            if deal is None and self._archive is not None:
+                deal = await self._archive.get(deal_id)
+            return deal
 
     async def get_deal_by_public_id(self, public_id: str) -> Deal | None:
         needle = public_id.upper()
         async with self._lock:
-            for deal in self._deals.values():
-                if deal.public_id and deal.public_id.upper() == needle:
-                    return deal
+            deal = self._index.by_public_id(needle)
+            if deal is not None:
+                return deal
+            if self._archive is not None:
+                return await self._archive.get_by_public_id(needle)
         return None
 
     async def get_deal_by_token(self, token: str) -> Deal | None:
         async with self._lock:
-            try:
-                return self._ensure_deal(token)
-            except LookupError:
-                return None
+            return await self._find_deal_locked(token)
+
+    async def list_archivable(self, before: datetime) -> List[Deal]:
+        async with self._lock:
+            return [deal for deal in self._index.with_status(*TERMINAL_STATUSES) if deal.created_at < before]
+
+    async def forget_archived(self, stored: Dict[str, dict]) -> List[str]:
+        # ``stored`` maps deal ids to the payload written to the archive; deals
+        # that changed since are kept.  Returns the ids actually dropped.
+        async with self._lock:
+            revived = await self._revived_locked()
+            dropped = []
+            for deal_id, data in stored.items():
+                deal = self._deals.get(deal_id)
+                if deal is not None and deal.status in TERMINAL_STATUSES and deal.to_dict() == data:
+                    del self._deals[deal_id]
+                    self._unsaved.setdefault("deals", {})[deal_id] = None
+                    self._changes.forget_deal(deal_id, self._index.users_of(deal_id))
+                    self._index.remove(deal_id)
+                    revived.pop(deal_id, None)
+                    dropped.append(deal_id)
+                elif deal is not None:
+                    revived[deal_id] = Deal.from_dict(data)
+            if dropped:
+                await self._persist()
+            return dropped
 
     async def accept_deal(self, deal_id: str, buyer_id: int) -> Deal:
         async with self._lock:
@@ -378,13 +600,13 @@ class DealService:
             deal.dispute_notified = False
             self._reset_qr_locked(deal)
             deal.qr_stage = QrStage.AWAITING_SELLER_ATTACH
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def release_deal(self, deal_id: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             deal.buyer_id = None
             deal.invoice_id = None
             deal.invoice_url = None
@@ -395,36 +617,42 @@ class DealService:
             deal.dispute_notified = False
             deal.dispute_opened_by = None
             deal.dispute_opened_at = None
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def attach_invoice(self, deal_id: str, invoice_id: str, invoice_url: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             deal.invoice_id = invoice_id
             deal.invoice_url = invoice_url
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def mark_invoice_paid(self, invoice_id: str) -> Deal:
+        deal, _ = await self.settle_invoice(invoice_id)
+        return deal
+
+    async def settle_invoice(self, invoice_id: str) -> tuple[Deal, bool]:
+        # The flag is False when the invoice was already confirmed, so the
+        # webhook and the poller do not both announce the same payment.
         async with self._lock:
             deal = self._find_deal_by_invoice(invoice_id)
             if deal.status in {DealStatus.PAID, DealStatus.COMPLETED}:
-                return deal
+                return deal, False
             deal.status = DealStatus.PAID
             deal.invoice_url = None
             deal.dispute_available_at = datetime.now(timezone.utc) + self._payment_window
             deal.dispute_notified = False
             self._reset_qr_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
-            return deal
+            self._put_deal_locked(deal)
+            await self._persist(deal)
+            return deal, True
 
     async def mark_paid_manual(self, deal_id: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if not deal.invoice_id:
                 raise ValueError("Сделка не имеет счета Crypto Pay")
             if deal.status in {DealStatus.PAID, DealStatus.COMPLETED}:
@@ -434,13 +662,13 @@ class DealService:
             deal.dispute_available_at = datetime.now(timezone.utc) + self._payment_window
             deal.dispute_notified = False
             self._reset_qr_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def complete_deal(self, deal_id: str, actor_id: int) -> tuple[Deal, bool]:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if actor_id not in (deal.seller_id, deal.buyer_id) and not self._is_admin(actor_id):
                 raise PermissionError("Not allowed to complete this deal")
             if deal.status not in {DealStatus.PAID, DealStatus.RESERVED}:
@@ -448,8 +676,8 @@ class DealService:
             deal.buyer_cash_confirmed = True
             deal.seller_cash_confirmed = True
             payout = self._finalize_cash_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal, payout
 
     async def cancel_deal(
@@ -461,7 +689,7 @@ class DealService:
         force_refund_seller: bool = False,
     ) -> tuple[Deal, Decimal | None]:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status == DealStatus.PENDING:
                 if actor_id not in {deal.seller_id, deal.buyer_id} and not self._is_admin(actor_id):
                     raise PermissionError("Not allowed to cancel")
@@ -497,21 +725,19 @@ class DealService:
             deal.invoice_id = None
             deal.invoice_url = None
             self._reset_qr_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal, refund_amount
 
-    async def cleanup_expired(self) -> List[Deal]:
+    async def cleanup_expired(self, deal_ids: Iterable[str] | None = None) -> List[Deal]:
+        # Without ``deal_ids`` every pending deal is checked.
         now = datetime.now(timezone.utc)
         expired: List[Deal] = []
         async with self._lock:
-            for deal in list(self._deals.values()):
-                if deal.status != DealStatus.PENDING:
+            for deal in self._candidates_locked(DealStatus.PENDING, deal_ids):
+                if (deal.offer_expires_at or deal.expires_at) > now:
                     continue
-                expires_at = deal.offer_expires_at or deal.expires_at
-                if not expires_at or expires_at > now:
-                    continue
-                base_usdt = deal.usd_amount / deal.rate
+                base_usdt = deal.usd_amount / deal.rate if deal.rate else Decimal("0")
                 if deal.balance_reserved and base_usdt > 0:
                     fee_multiplier = (deal.fee_percent or Decimal("0")) / Decimal("100")
                     seller_debit = base_usdt + (base_usdt * fee_multiplier)
@@ -522,20 +748,19 @@ class DealService:
                 deal.invoice_id = None
                 deal.invoice_url = None
                 self._reset_qr_locked(deal)
-                self._deals[deal.id] = deal
+                self._put_deal_locked(deal)
                 expired.append(deal)
             if expired:
-                await self._persist()
+                await self._persist(*expired)
         return expired
 
-    async def list_dispute_ready(self) -> List[Deal]:
+    async def list_dispute_ready(self, deal_ids: Iterable[str] | None = None) -> List[Deal]:
         now = datetime.now(timezone.utc)
         async with self._lock:
             return [
                 deal
-                for deal in self._deals.values()
-                if deal.status == DealStatus.PAID
-                and deal.dispute_available_at
+                for deal in self._candidates_locked(DealStatus.PAID, deal_ids)
+                if deal.dispute_available_at
                 and deal.dispute_available_at <= now
                 and not deal.dispute_notified
             ]
@@ -549,33 +774,29 @@ class DealService:
             DealStatus.DISPUTE,
         }
         async with self._lock:
-            return sum(
-                1
-                for deal in self._deals.values()
-                if deal.status in active_statuses and user_id in {deal.seller_id, deal.buyer_id}
-            )
+            return sum(1 for deal in self._index.of_user(user_id) if deal.status in active_statuses)
 
     async def list_dispute_deals(self) -> List[Deal]:
         async with self._lock:
-            return [deal for deal in self._deals.values() if deal.status == DealStatus.DISPUTE]
+            return self._index.with_status(DealStatus.DISPUTE)
 
     async def mark_dispute_notified(self, deal_id: str) -> None:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             deal.dispute_notified = True
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
 
     async def open_dispute(self, deal_id: str, opener_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status != DealStatus.PAID:
                 raise ValueError("Спор можно открыть только после оплаты")
             deal.status = DealStatus.DISPUTE
             deal.dispute_opened_by = opener_id
             deal.dispute_opened_at = datetime.now(timezone.utc)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def resolve_dispute(
@@ -586,7 +807,7 @@ class DealService:
         buyer_amount: Decimal,
     ) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.status != DealStatus.DISPUTE:
                 if deal.dispute_opened_by is None:
                     raise ValueError("Спор не открыт")
@@ -619,20 +840,13 @@ class DealService:
             deal.buyer_cash_confirmed = True
             deal.seller_cash_confirmed = True
             deal.payout_completed = True
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def reserved_deals_with_invoices(self) -> List[Deal]:
         async with self._lock:
-            deals = list(self._deals.values())
-        return await asyncio.to_thread(
-            lambda: [
-                deal
-                for deal in deals
-                if deal.status == DealStatus.RESERVED and deal.invoice_id
-            ]
-        )
+            return [deal for deal in self._index.with_status(DealStatus.RESERVED) if deal.invoice_id]
 
     async def balance_of(self, user_id: int) -> Decimal:
         async with self._lock:
@@ -645,7 +859,7 @@ class DealService:
     async def reserved_of(self, user_id: int) -> Decimal:
         async with self._lock:
             reserved = Decimal("0")
-            for deal in self._deals.values():
+            for deal in self._index.of_user(user_id):
                 if deal.seller_id != user_id or not deal.is_p2p:
                     continue
                 if deal.balance_reserved and deal.status in {
@@ -661,7 +875,16 @@ class DealService:
             return reserved
 
     def _credit_balance_locked(self, user_id: int, amount: Decimal) -> None:
-        self._balances[user_id] = self._balances.get(user_id, Decimal("0")) + amount
+        self._set_balance_locked(user_id, self._balances.get(user_id, Decimal("0")) + amount)
+        self._changes.balance_changed(user_id)
+
+    def _set_balance_locked(self, user_id: int, amount: Decimal) -> None:
+        self._balances[user_id] = amount
+        self._unsaved.setdefault("balances", {})[str(user_id)] = None
+
+    def _put_payout_locked(self, payout: Payout) -> None:
+        self._payouts[payout.id] = payout
+        self._unsaved.setdefault("payouts", {})[payout.id] = None
 
     def _finalize_cash_locked(self, deal: Deal) -> bool:
         if (
@@ -682,17 +905,27 @@ class DealService:
             return True
         return False
 
-    def _ensure_deal(self, deal_token: str) -> Deal:
+    async def _find_deal_locked(self, deal_token: str) -> Deal | None:
         deal = self._deals.get(deal_token)
         if not deal:
-            match_token = deal_token.upper()
-            for candidate in self._deals.values():
-                if candidate.public_id.upper() == match_token:
-                    deal = candidate
-                    break
+            deal = self._index.by_public_id(deal_token)
+        if not deal and self._archive is not None:
+            deal = await self._archive.get(deal_token) or await self._archive.get_by_public_id(
+                deal_token
+            )
+        return deal
+
+    async def _ensure_deal(self, deal_token: str) -> Deal:
+        deal = await self._find_deal_locked(deal_token)
         if not deal:
             raise LookupError("Deal not found")
-        return deal
+        if deal.id in self._deals:
+            return deal
+        # An archived deal is changed on a copy, which joins the working set
+        # in ``_put_deal_locked`` only if the change is made; a later archive
+        # run stores the new version.
+        self._reviving = deal
+        return Deal.from_dict(deal.to_dict())
 
     def _can_cancel(self, deal: Deal, actor_id: int) -> bool:
         if actor_id == deal.buyer_id:
@@ -706,14 +939,14 @@ class DealService:
         return self._is_admin(actor_id)
 
     def _find_deal_by_invoice(self, invoice_id: str) -> Deal:
-        for deal in self._deals.values():
-            if deal.invoice_id == invoice_id:
-                return deal
+        deal = self._index.by_invoice(invoice_id)
+        if deal is not None:
+            return deal
         raise LookupError("Invoice is not attached to any deal")
 
     async def start_qr_request(self, deal_id: str, buyer_id: int, banks: list[str]) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.buyer_id != buyer_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.status != DealStatus.PAID:
@@ -726,13 +959,13 @@ class DealService:
             deal.atm_bank = None
             deal.qr_stage = QrStage.AWAITING_SELLER_BANK
             deal.qr_photo_id = None
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def seller_choose_qr_bank(self, deal_id: str, seller_id: int, bank: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.seller_id != seller_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.qr_stage != QrStage.AWAITING_SELLER_BANK:
@@ -741,37 +974,37 @@ class DealService:
                 raise ValueError("Такой банк не запрашивали")
             deal.atm_bank = bank
             deal.qr_stage = QrStage.AWAITING_SELLER_ATTACH
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def seller_request_qr(self, deal_id: str, seller_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.seller_id != seller_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.qr_stage not in {QrStage.AWAITING_SELLER_ATTACH, QrStage.AWAITING_BUYER_READY}:
                 raise ValueError("Сейчас нельзя отправить QR")
             deal.qr_stage = QrStage.AWAITING_BUYER_READY
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def buyer_ready_for_qr(self, deal_id: str, buyer_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.buyer_id != buyer_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.qr_stage != QrStage.AWAITING_BUYER_READY:
                 raise ValueError("Пока не требуется подтверждение")
             deal.qr_stage = QrStage.AWAITING_SELLER_PHOTO
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def attach_qr_photo(self, deal_id: str, seller_id: int, file_id: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.seller_id != seller_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.qr_stage not in {QrStage.AWAITING_SELLER_PHOTO}:
@@ -779,13 +1012,13 @@ class DealService:
             deal.qr_photo_id = file_id
             deal.qr_scanned = False
             deal.qr_stage = QrStage.AWAITING_BUYER_SCAN
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def attach_qr_web(self, deal_id: str, seller_id: int, file_name: str) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.seller_id != seller_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.qr_stage not in {QrStage.AWAITING_SELLER_PHOTO}:
@@ -793,13 +1026,13 @@ class DealService:
             deal.qr_photo_id = f"web:{file_name}"
             deal.qr_scanned = False
             deal.qr_stage = QrStage.AWAITING_BUYER_SCAN
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def buyer_scanned_qr(self, deal_id: str, buyer_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.buyer_id != buyer_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.status != DealStatus.PAID:
@@ -808,13 +1041,13 @@ class DealService:
                 raise ValueError("Сейчас не требуется подтверждать сканирование")
             deal.qr_scanned = True
             deal.qr_stage = QrStage.READY
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def buyer_request_new_qr(self, deal_id: str, buyer_id: int) -> Deal:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.buyer_id != buyer_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.status != DealStatus.PAID:
@@ -824,13 +1057,13 @@ class DealService:
             deal.qr_photo_id = None
             deal.qr_scanned = False
             deal.qr_stage = QrStage.AWAITING_SELLER_PHOTO
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal
 
     async def confirm_buyer_cash(self, deal_id: str, buyer_id: int) -> tuple[Deal, bool]:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.buyer_id != buyer_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.status not in {DealStatus.PAID, DealStatus.COMPLETED}:
@@ -839,13 +1072,13 @@ class DealService:
                 raise ValueError("По сделке открыт спор")
             deal.buyer_cash_confirmed = True
             payout = self._finalize_cash_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal, payout
 
     async def confirm_seller_cash(self, deal_id: str, seller_id: int) -> tuple[Deal, bool]:
         async with self._lock:
-            deal = self._ensure_deal(deal_id)
+            deal = await self._ensure_deal(deal_id)
             if deal.seller_id != seller_id:
                 raise PermissionError("Нет доступа к сделке")
             if deal.status not in {DealStatus.PAID, DealStatus.COMPLETED}:
@@ -854,8 +1087,8 @@ class DealService:
                 raise ValueError("По сделке открыт спор")
             deal.seller_cash_confirmed = True
             payout = self._finalize_cash_locked(deal)
-            self._deals[deal.id] = deal
-            await self._persist()
+            self._put_deal_locked(deal)
+            await self._persist(deal)
             return deal, payout
 
     async def withdraw_balance(self, user_id: int, amount: Decimal) -> Decimal:
@@ -865,11 +1098,108 @@ class DealService:
             current = self._balances.get(user_id, Decimal("0"))
             if current < amount:
                 raise ValueError("Недостаточно средств")
-            self._balances[user_id] = current - amount
+            self._set_balance_locked(user_id, current - amount)
             self._record_event_locked(user_id, -amount, "withdraw", {})
             await self._persist()
             return self._balances[user_id]
 
+    async def request_payout(
+        self,
+        user_id: int,
+        amount: Decimal,
+        fee: Decimal,
+        currency: str = "USDT",
+    ) -> Payout:
+        # Debits the balance and records the payout in the same write, so a
+        # crash can neither lose the money nor the transfer still owed.
+        if amount <= 0:
+            raise ValueError("Сумма должна быть больше нуля")
+        async with self._lock:
+            total = amount + fee
+            current = self._balances.get(user_id, Decimal("0"))
+            if current < total:
+                raise ValueError("Недостаточно средств")
+            now = datetime.now(timezone.utc)
+            payout = Payout(
+                id=str(uuid4()),
+                user_id=user_id,
+                amount=amount,
+                fee=fee,
+                currency=currency,
+                spend_id=str(uuid4()),
+                created_at=now,
+                updated_at=now,
+            )
+            self._set_balance_locked(user_id, current - total)
+            self._record_event_locked(user_id, -total, "withdraw", {"payout_id": payout.id})
+            self._put_payout_locked(payout)
+            await self._persist()
+            return payout
+
+    async def get_payout(self, payout_id: str) -> Payout | None:
+        async with self._lock:
+            return self._payouts.get(payout_id)
+
+    async def payouts_of(self, user_id: int) -> List[Payout]:
+        async with self._lock:
+            payouts = [payout for payout in self._payouts.values() if payout.user_id == user_id]
+        return sorted(payouts, key=lambda payout: payout.created_at, reverse=True)
+
+    async def pending_payouts(self) -> List[Payout]:
+        async with self._lock:
+            return [
+                payout for payout in self._payouts.values() if payout.status == PayoutStatus.PENDING
+            ]
+
+    async def note_payout_attempt(self, payout_id: str, error: str) -> Payout:
+        async with self._lock:
+            payout = self._payouts[payout_id]
+            if payout.status != PayoutStatus.PENDING:
+                return payout
+            payout = replace(
+                payout,
+                attempts=payout.attempts + 1,
+                error=error,
+                updated_at=datetime.now(timezone.utc),
+            )
+            self._put_payout_locked(payout)
+            await self._persist()
+            return payout
+
+    async def complete_payout(self, payout_id: str, transfer_id: str | None) -> Payout:
+        async with self._lock:
+            payout = self._payouts[payout_id]
+            if payout.status != PayoutStatus.PENDING:
+                return payout
+            payout = replace(
+                payout,
+                status=PayoutStatus.SENT,
+                attempts=payout.attempts + 1,
+                error=None,
+                transfer_id=transfer_id,
+                updated_at=datetime.now(timezone.utc),
+            )
+            self._put_payout_locked(payout)
+            await self._persist()
+            return payout
+
+    async def refund_payout(self, payout_id: str, error: str) -> Payout:
+        async with self._lock:
+            payout = self._payouts[payout_id]
+            if payout.status != PayoutStatus.PENDING:
+                return payout
+            payout = replace(
+                payout,
+                status=PayoutStatus.REFUNDED,
+                attempts=payout.attempts + 1,
+                error=error,
+                updated_at=datetime.now(timezone.utc),
+            )
+            self._put_payout_locked(payout)
+            self._credit_balance_locked(payout.user_id, payout.total)
+            await self._persist()
+            return payout
+
     async def reserve_balance(
         self,
         user_id: int,
@@ -884,7 +1214,7 @@ class DealService:
             current = self._balances.get(user_id, Decimal("0"))
             if current < amount:
                 raise ValueError("Недостаточно средств")
-            self._balances[user_id] = current - amount
+            self._set_balance_locked(user_id, current - amount)
             self._record_event_locked(user_id, -amount, kind, meta or {})
             await self._persist()
             return self._balances[user_id]
@@ -920,7 +1250,7 @@ class DealService:
             current = self._balances.get(sender_id, Decimal("0"))
             if current < debit_amount:
                 raise ValueError("Недостаточно средств")
-            self._balances[sender_id] = current - debit_amount
+            self._set_balance_locked(sender_id, current - debit_amount)
             self._credit_balance_locked(recipient_id, credit_amount)
             meta_out = {
                 "to": recipient_id,
@@ -954,6 +1284,84 @@ class DealService:
             await self._persist()
             return self._balances[user_id]
 
+    async def credit_topup(self, invoice_id: str, user_id: int, amount: Decimal) -> bool:
+        # The ledger entry is written under an id derived from the invoice, so
+        # a repeated call finds it and credits nothing.  False in that case.
+        if amount <= 0:
+            raise ValueError("Сумма должна быть больше нуля")
+        event_id = f"{TOPUP_EVENT_PREFIX}{invoice_id}"
+        async with self._lock:
+            if event_id in self._topup_events or self._cold_events.get(event_id) is not None:
+                return False
+            self._credit_balance_locked(user_id, amount)
+            self._record_event_locked(
+                user_id, amount, "topup", {"invoice_id": invoice_id}, event_id=event_id
+            )
+            self._topup_events.add(event_id)
+            await self._persist()
+            return True
+
+    def _put_deal_locked(self, deal: Deal) -> None:
+        # Every change to a deal ends here so that the index follows it.
+        reviving, self._reviving = self._reviving, None
+        if (
+            reviving is not None
+            and reviving.id == deal.id
+            and deal.id not in self._deals
+            and self._revived is not None
+        ):
+            self._revived[deal.id] = reviving
+        users = self._index.users_of(deal.id)
+        users.update((deal.seller_id, deal.buyer_id))
+        deal.version = self._changes.deal_changed(deal.id, users)
+        self._deals[deal.id] = deal
+        self._unsaved.setdefault("deals", {})[deal.id] = None
+        self._index.update(deal)
+        self._schedule_locked(deal)
+
+    async def _participants(self, deal_id: str) -> set[int]:
+        users = self._index.users_of(deal_id)
+        if not users and self._archive is not None:
+            deal = await self._archive.get(deal_id)
+            if deal is not None:
+                users = {user_id for user_id in (deal.seller_id, deal.buyer_id) if user_id is not None}
+        return users
+
+    async def _revived_locked(self) -> Dict[str, Deal]:
+        if self._revived is None:
+            # Until read, a revived deal is just part of the working set and
+            # is picked up here with the rest.
+            self._revived = await self._archive.stored(list(self._deals))
+        return self._revived
+
+    def _schedule_locked(self, deal: Deal) -> None:
+        for job, deadline in self._deadlines_of(deal).items():
+            self._scheduler.schedule(job, deal.id, deadline)
+
+    @staticmethod
+    def _deadlines_of(deal: Deal) -> Dict[str, datetime | None]:
+        expiry = None
+        if deal.status == DealStatus.PENDING:
+            expiry = deal.offer_expires_at or deal.expires_at
+        timer = None
+        if deal.status == DealStatus.PAID and not deal.dispute_notified:
+            timer = deal.dispute_available_at
+        return {EXPIRY_JOB: expiry, DISPUTE_TIMER_JOB: timer}
+
+    def _candidates_locked(self, status: DealStatus, deal_ids: Iterable[str] | None) -> List[Deal]:
+        if deal_ids is None:
+            return self._index.with_status(status)
+        deals = (self._deals.get(deal_id) for deal_id in deal_ids)
+        return [deal for deal in deals if deal is not None and deal.status == status]
+
+    async def verify_indexes(self) -> None:
+        async with self._lock:
+            self._index.verify(self._deals)
+            for deal in self._deals.values():
+                for job, deadline in self._deadlines_of(deal).items():
+                    if self._scheduler.deadline(job, deal.id) != deadline:
+                        raise RuntimeError(f"Deadline {job} of {deal.id} is out of sync")
+
     def _reset_qr_locked(self, deal: Deal) -> None:
         deal.qr_stage = QrStage.IDLE
         deal.qr_bank_options = []
@@ -963,12 +1371,17 @@ class DealService:
         if deal.status != DealStatus.COMPLETED:
             deal.payout_completed = False
 
-    async def _persist(self) -> None:
+    async def _persist(self, *changed: Deal) -> None:
+        if changed:
+            self._unsaved.setdefault("deals", {}).update(dict.fromkeys(deal.id for deal in changed))
+        unsaved, self._unsaved = self._unsaved, {}
         await self._repository.persist_deals_and_balances(
-            list(self._deals.values()),
+            self._deals,
             self._balances,
             deal_sequence=self._deal_seq,
             balance_events=self._balance_events,
+            payouts=self._payouts,
+            changed=unsaved,
         )
 
     def _record_event_locked(
@@ -977,21 +1390,24 @@ class DealService:
         amount: Decimal,
         kind: str,
         meta: dict,
+        *,
+        event_id: str | None = None,
     ) -> None:
-        self._balance_events.append(
-            BalanceEvent(
-                id=str(uuid4()),
-                user_id=user_id,
-                amount=amount,
-                kind=kind,
-                created_at=datetime.now(timezone.utc),
-                meta=meta,
-            )
+        event = BalanceEvent(
+            id=event_id or str(uuid4()),
+            user_id=user_id,
+            amount=amount,
+            kind=kind,
+            created_at=datetime.now(timezone.utc),
+            meta=meta,
         )
+        self._balance_events.append(event)
+        self._unsaved.setdefault("balance_events", {})[event.id] = None
+        self._changes.balance_changed(user_id)
 
     async def balance_history(self, user_id: int) -> List[BalanceEvent]:
         async with self._lock:
-            items = [event for event in self._balance_events if event.user_id == user_id]
+            items = self._cold_events.select("user_id", user_id, self._balance_events)
         items.sort(key=lambda ev: ev.created_at, reverse=True)
         return items
 
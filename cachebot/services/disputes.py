@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import asyncio
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 from uuid import uuid4
 
 from cachebot.models.dispute import Dispute, EvidenceItem, MessageItem
@@ -14,8 +14,20 @@ class DisputeService:
         self._repository = repository
         snapshot = repository.snapshot()
         self._disputes: List[Dispute] = list(getattr(snapshot, "disputes", []))
+        # Resolved disputes may be left on disk by the repository.
+        self._cold = repository.cold("disputes")
         self._lock = asyncio.Lock()
 
+    def _index_locked(self, dispute_id: str) -> int | None:
+        for index, item in enumerate(self._disputes):
+            if item.id == dispute_id:
+                return index
+        stored = self._cold.get(dispute_id)
+        if stored is None:
+            return None
+        self._disputes.append(stored)
+        return len(self._disputes) - 1
+
     async def open_dispute(
         self,
         *,
@@ -68,8 +80,8 @@ class DisputeService:
         async with self._lock:
             return sum(
                 1
-                for item in self._disputes
-                if item.resolved and item.resolved_by == user_id
+                for item in self._cold.select("resolved_by", user_id, self._disputes)
+                if item.resolved
             )
 
     async def dispute_by_id(self, dispute_id: str) -> Optional[Dispute]:
@@ -77,7 +89,7 @@ class DisputeService:
             for item in self._disputes:
                 if item.id == dispute_id:
                     return item
-        return None
+            return self._cold.get(dispute_id)
 
     async def dispute_for_deal(self, deal_id: str) -> Optional[Dispute]:
         async with self._lock:
@@ -87,11 +99,25 @@ class DisputeService:
         return None
 
     async def dispute_any_for_deal(self, deal_id: str) -> Optional[Dispute]:
+        async with self._lock:
+            matches = self._cold.select("deal_id", deal_id, self._disputes)
+        return matches[0] if matches else None
+
+    async def disputes_for_deals(self, deal_ids: Iterable[str]) -> Dict[str, Dispute]:
+        # Bulk ``dispute_for_deal``: the open dispute of each deal that has one.
+        wanted = set(deal_ids)
+        result: Dict[str, Dispute] = {}
         async with self._lock:
             for item in self._disputes:
-                if item.deal_id == deal_id:
-                    return item
-        return None
+                if item.deal_id in wanted and not item.resolved:
+                    result.setdefault(item.deal_id, item)
+        return result
+
+    async def disputes_any_for_deals(self, deal_ids: Iterable[str]) -> Dict[str, Dispute]:
+        # Bulk ``dispute_any_for_deal``.
+        async with self._lock:
+            matches = self._cold.select_many("deal_id", deal_ids, self._disputes)
+        return {deal_id: items[0] for deal_id, items in matches.items()}
 
     async def resolve_dispute(
         self,
@@ -102,28 +128,29 @@ class DisputeService:
         buyer_amount: str | None,
     ) -> Dispute:
         async with self._lock:
-            for index, item in enumerate(self._disputes):
-                if item.id == dispute_id:
-                    resolved = Dispute(
-                        id=item.id,
-                        deal_id=item.deal_id,
-                        opened_by=item.opened_by,
-                        opened_at=item.opened_at,
-                        reason=item.reason,
-                        comment=item.comment,
-                        evidence=item.evidence,
-                        messages=item.messages,
-                        resolved=True,
-                        resolved_at=datetime.now(timezone.utc),
-                        resolved_by=resolved_by,
-                        seller_amount=seller_amount,
-                        buyer_amount=buyer_amount,
-                        assigned_to=item.assigned_to,
-                        assigned_at=item.assigned_at,
-                    )
-                    self._disputes[index] = resolved
-                    await self._repository.persist_disputes(list(self._disputes))
-                    return resolved
+            index = self._index_locked(dispute_id)
+            if index is not None:
+                item = self._disputes[index]
+                resolved = Dispute(
+                    id=item.id,
+                    deal_id=item.deal_id,
+                    opened_by=item.opened_by,
+                    opened_at=item.opened_at,
+                    reason=item.reason,
+                    comment=item.comment,
+                    evidence=item.evidence,
+                    messages=item.messages,
+                    resolved=True,
+                    resolved_at=datetime.now(timezone.utc),
+                    resolved_by=resolved_by,
+                    seller_amount=seller_amount,
+                    buyer_amount=buyer_amount,
+                    assigned_to=item.assigned_to,
+                    assigned_at=item.assigned_at,
+                )
+                self._disputes[index] = resolved
+                await self._repository.persist_disputes(list(self._disputes))
+                return resolved
         raise LookupError("Спор не найден")
 
     async def resolve_for_deal(self, deal_id: str, *, resolved_by: int) -> None:
@@ -160,63 +187,65 @@ class DisputeService:
 
     async def append_message(self, dispute_id: str, author_id: int, text: str) -> MessageItem:
         async with self._lock:
-            for index, item in enumerate(self._disputes):
-                if item.id == dispute_id:
-                    if item.resolved:
-                        raise ValueError("Спор уже закрыт")
-                    message = MessageItem(
-                        author_id=author_id,
-                        text=text,
-                        created_at=datetime.now(timezone.utc),
-                    )
-                    updated = Dispute(
-                        id=item.id,
-                        deal_id=item.deal_id,
-                        opened_by=item.opened_by,
-                        opened_at=item.opened_at,
-                        reason=item.reason,
-                        comment=item.comment,
-                        evidence=item.evidence,
-                        messages=item.messages + [message],
-                        resolved=item.resolved,
-                        resolved_at=item.resolved_at,
-                        resolved_by=item.resolved_by,
-                        seller_amount=item.seller_amount,
-                        buyer_amount=item.buyer_amount,
-                        assigned_to=item.assigned_to,
-                        assigned_at=item.assigned_at,
-                    )
-                    self._disputes[index] = updated
-                    await self._repository.persist_disputes(list(self._disputes))
-                    return message
+            index = self._index_locked(dispute_id)
+            if index is not None:
+                item = self._disputes[index]
+                if item.resolved:
+                    raise ValueError("Спор уже закрыт")
+                message = MessageItem(
+                    author_id=author_id,
+                    text=text,
+                    created_at=datetime.now(timezone.utc),
+                )
+                updated = Dispute(
+                    id=item.id,
+                    deal_id=item.deal_id,
+                    opened_by=item.opened_by,
+                    opened_at=item.opened_at,
+                    reason=item.reason,
+                    comment=item.comment,
+                    evidence=item.evidence,
+                    messages=item.messages + [message],
+                    resolved=item.resolved,
+                    resolved_at=item.resolved_at,
+                    resolved_by=item.resolved_by,
+                    seller_amount=item.seller_amount,
+                    buyer_amount=item.buyer_amount,
+                    assigned_to=item.assigned_to,
+                    assigned_at=item.assigned_at,
+                )
+                self._disputes[index] = updated
+                await self._repository.persist_disputes(list(self._disputes))
+                return message
         raise LookupError("Спор не найден")
 
     async def append_evidence(self, dispute_id: str, evidence: EvidenceItem) -> None:
         async with self._lock:
-            for index, item in enumerate(self._disputes):
-                if item.id == dispute_id:
-                    if item.resolved:
-                        raise ValueError("Спор уже закрыт")
-                    updated = Dispute(
-                        id=item.id,
-                        deal_id=item.deal_id,
-                        opened_by=item.opened_by,
-                        opened_at=item.opened_at,
-                        reason=item.reason,
-                        comment=item.comment,
-                        evidence=item.evidence + [evidence],
-                        messages=item.messages,
-                        resolved=item.resolved,
-                        resolved_at=item.resolved_at,
-                        resolved_by=item.resolved_by,
-                        seller_amount=item.seller_amount,
-                        buyer_amount=item.buyer_amount,
-                        assigned_to=item.assigned_to,
-                        assigned_at=item.assigned_at,
-                    )
-                    self._disputes[index] = updated
-                    await self._repository.persist_disputes(list(self._disputes))
-                    return
+            index = self._index_locked(dispute_id)
+            if index is not None:
+                item = self._disputes[index]
+                if item.resolved:
+                    raise ValueError("Спор уже закрыт")
+                updated = Dispute(
+                    id=item.id,
+                    deal_id=item.deal_id,
+                    opened_by=item.opened_by,
+                    opened_at=item.opened_at,
+                    reason=item.reason,
+                    comment=item.comment,
+                    evidence=item.evidence + [evidence],
+                    messages=item.messages,
+                    resolved=item.resolved,
+                    resolved_at=item.resolved_at,
+                    resolved_by=item.resolved_by,
+                    seller_amount=item.seller_amount,
+                    buyer_amount=item.buyer_amount,
+                    assigned_to=item.assigned_to,
+                    assigned_at=item.assigned_at,
+                )
+                self._disputes[index] = updated
+                await self._repository.persist_disputes(list(self._disputes))
+                return
         raise LookupError("Спор не найден")
 
     async def append_evidence_with_reason(
@@ -227,64 +256,66 @@ class DisputeService:
         comment: str | None = None,
     ) -> None:
         async with self._lock:
-            for index, item in enumerate(self._disputes):
-                if item.id == dispute_id:
-                    if item.resolved:
-                        raise ValueError("Спор уже закрыт")
-                    next_reason = item.reason
-                    if reason and (not item.reason or item.reason == "Открыт через WebApp"):
-                        next_reason = reason
-                    next_comment = item.comment
-                    if comment and not item.comment:
-                        next_comment = comment
-                    updated = Dispute(
-                        id=item.id,
-                        deal_id=item.deal_id,
-                        opened_by=item.opened_by,
-                        opened_at=item.opened_at,
-                        reason=next_reason,
-                        comment=next_comment,
-                        evidence=item.evidence + [evidence],
-                        messages=item.messages,
-                        resolved=item.resolved,
-                        resolved_at=item.resolved_at,
-                        resolved_by=item.resolved_by,
-                        seller_amount=item.seller_amount,
-                        buyer_amount=item.buyer_amount,
-                        assigned_to=item.assigned_to,
-                        assigned_at=item.assigned_at,
-                    )
-                    self._disputes[index] = updated
-                    await self._repository.persist_disputes(list(self._disputes))
-                    return
+            index = self._index_locked(dispute_id)
+            if index is not None:
+                item = self._disputes[index]
+                if item.resolved:
+                    raise ValueError("Спор уже закрыт")
+                next_reason = item.reason
+                if reason and (not item.reason or item.reason == "Открыт через WebApp"):
+                    next_reason = reason
+                next_comment = item.comment
+                if comment and not item.comment:
+                    next_comment = comment
+                updated = Dispute(
+                    id=item.id,
+                    deal_id=item.deal_id,
+                    opened_by=item.opened_by,
+                    opened_at=item.opened_at,
+                    reason=next_reason,
+                    comment=next_comment,
+                    evidence=item.evidence + [evidence],
+                    messages=item.messages,
+                    resolved=item.resolved,
+                    resolved_at=item.resolved_at,
+                    resolved_by=item.resolved_by,
+                    seller_amount=item.seller_amount,
+                    buyer_amount=item.buyer_amount,
+                    assigned_to=item.assigned_to,
+                    assigned_at=item.assigned_at,
+                )
+                self._disputes[index] = updated
+                await self._repository.persist_disputes(list(self._disputes))
+                return
         raise LookupError("Спор не найден")
 
     async def assign(self, dispute_id: str, user_id: int) -> Dispute:
         async with self._lock:
-            for index, item in enumerate(self._disputes):
-                if item.id == dispute_id:
-                    if item.resolved:
-                        raise ValueError("Спор уже закрыт")
-                    if item.assigned_to and item.assigned_to != user_id:
-                        raise ValueError("Спор уже в работе")
-                    updated = Dispute(
-                        id=item.id,
-                        deal_id=item.deal_id,
-                        opened_by=item.opened_by,
-                        opened_at=item.opened_at,
-                        reason=item.reason,
-                        comment=item.comment,
-                        evidence=item.evidence,
-                        messages=item.messages,
-                        resolved=item.resolved,
-                        resolved_at=item.resolved_at,
-                        resolved_by=item.resolved_by,
-                        seller_amount=item.seller_amount,
-                        buyer_amount=item.buyer_amount,
-                        assigned_to=user_id,
-                        assigned_at=item.assigned_at or datetime.now(timezone.utc),
-                    )
-                    self._disputes[index] = updated
-                    await self._repository.persist_disputes(list(self._disputes))
-                    return updated
+            index = self._index_locked(dispute_id)
+            if index is not None:
+                item = self._disputes[index]
+                if item.resolved:
+                    raise ValueError("Спор уже закрыт")
+                if item.assigned_to and item.assigned_to != user_id:
+                    raise ValueError("Спор уже в работе")
+                updated = Dispute(
+                    id=item.id,
+                    deal_id=item.deal_id,
+                    opened_by=item.opened_by,
+                    opened_at=item.opened_at,
+                    reason=item.reason,
+                    comment=item.comment,
+                    evidence=item.evidence,
+                    messages=item.messages,
+                    resolved=item.resolved,
+                    resolved_at=item.resolved_at,
+                    resolved_by=item.resolved_by,
+                    seller_amount=item.seller_amount,
+                    buyer_amount=item.buyer_amount,
+                    assigned_to=user_id,
+                    assigned_at=item.assigned_at or datetime.now(timezone.utc),
+                )
+                self._disputes[index] = updated
+                await self._repository.persist_disputes(list(self._disputes))
+                return updated
         raise LookupError("Спор не найден")
@@ -1,30 +1,200 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import random
+import time
+from dataclasses import dataclass
 from decimal import Decimal
-from typing import Optional
+from typing import Any, List, Optional
+from uuid import uuid4
 
 import httpx
 
+from cachebot import metrics
+
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class _PendingCredit:
+    user_id: int
+    amount: Decimal
+    idempotency_key: str
+    future: asyncio.Future
+
+
 class KBClient:
-    def __init__(self, base_url: str | None, token: str | None) -> None:
+    """Credits the ruble balance service over one pooled connection.
+
+    Every credit carries an idempotency key, so a request that timed out can
+    be sent again without paying twice; callers that may repeat a credit
+    themselves should pass a key of their own.  With ``batch_window_ms`` set,
+    credits issued within the window go out as one ``/balances/credit/batch``
+    request.
+    """
+
+    BATCH_LIMIT = 100
+
+    def __init__(
+        self,
+        base_url: str | None,
+        token: str | None,
+        *,
+        timeout: float = 15.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        batch_window_ms: int = 0,
+        max_attempts: int = 3,
+    ) -> None:
         self._base_url = base_url.rstrip("/") if base_url else None
         self._token = token
+        self._timeout = timeout
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self._batch_window = batch_window_ms / 1000
+        self._max_attempts = max_attempts
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lock = asyncio.Lock()
+        self._batch: List[_PendingCredit] = []
+        self._batch_handle: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def _client_instance(self) -> httpx.AsyncClient:
+        async with self._lock:
+            if not self._client:
+                self._client = httpx.AsyncClient(
+                    base_url=self._base_url,
+                    headers={"Authorization": f"Bearer {self._token}"},
+                    timeout=self._timeout,
+                    limits=self._limits,
+                )
+            return self._client
 
-    async def credit_balance(self, user_id: int, amount: Decimal) -> bool:
+    async def close(self) -> None:
+        self._flush_batch()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        async with self._lock:
+            if self._client:
+                await self._client.aclose()
+                self._client = None
+
+    async def credit_balance(
+        self,
+        user_id: int,
+        amount: Decimal,
+        idempotency_key: str | None = None,
+    ) -> bool:
         if not self._base_url or not self._token:
             logger.info("KB client is not configured; skipping credit for user %s", user_id)
             return False
-        async with httpx.AsyncClient(base_url=self._base_url, headers={"Authorization": f"Bearer {self._token}"}, timeout=15.0) as client:
-            response = await client.post(
+        key = idempotency_key or uuid4().hex
+        started = time.perf_counter()
+        try:
+            if self._batch_window > 0:
+                return await self._queue_credit(user_id, amount, key)
+            response = await self._post(
                 "/balances/credit",
-                json={"user_id": user_id, "amount": str(amount)},
+                {"user_id": user_id, "amount": str(amount)},
+                {"Idempotency-Key": key},
             )
+            if response is None:
+                return False
             if response.status_code >= 400:
                 logger.error("KB credit failed (%s): %s", response.status_code, response.text)
                 return False
-        return True
+            return True
+        finally:
+            metrics.histogram("kb.credit_ms").observe((time.perf_counter() - started) * 1000)
+
+    async def _queue_credit(self, user_id: int, amount: Decimal, key: str) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append(_PendingCredit(user_id, amount, key, future))
+        if len(self._batch) >= self.BATCH_LIMIT:
+            self._flush_batch()
+        elif self._batch_handle is None:
+            self._batch_handle = asyncio.get_running_loop().call_later(
+                self._batch_window, self._flush_batch
+            )
+        return await future
+
+    def _flush_batch(self) -> None:
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        task = asyncio.create_task(self._send_batch(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _send_batch(self, batch: List[_PendingCredit]) -> None:
+        results: List[bool] = [False] * len(batch)
+        try:
+            response = await self._post(
+                "/balances/credit/batch",
+                {
+                    "credits": [
+                        {
+                            "user_id": item.user_id,
+                            "amount": str(item.amount),
+                            "idempotency_key": item.idempotency_key,
+                        }
+                        for item in batch
+                    ]
+                },
+                # Retried as a whole: the service skips the credits it has
+                # already applied by their own keys.
+                {},
+            )
+            if response is not None and response.status_code < 400:
+                results = _batch_results(response.json(), len(batch))
+            elif response is not None:
+                logger.error("KB batch credit failed (%s): %s", response.status_code, response.text)
+        except Exception as exc:
+            logger.exception("KB batch credit failed: %s", exc)
+        metrics.histogram("kb.batch_size").observe(len(batch))
+        for item, ok in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(ok)
+
+    async def _post(
+        self,
+        path: str,
+        payload: dict[str, Any],
+        headers: dict[str, str],
+    ) -> httpx.Response | None:
+        # Returns None when the service could not be reached at all.
+        client = await self._client_instance()
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                response = await client.post(path, json=payload, headers=headers)
+            except httpx.TransportError as exc:
+                if attempt == self._max_attempts:
+                    metrics.counter("kb.failed").inc()
+                    logger.error("KB request %s failed: %s", path, exc)
+                    return None
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt == self._max_attempts:
+                    metrics.counter("kb.failed").inc()
+                    return response
+            metrics.counter("kb.retried").inc()
+            await asyncio.sleep(0.2 * 2 ** (attempt - 1) * (1 + random.random()))
+        return None
+
+
+def _batch_results(data: Any, size: int) -> List[bool]:
+    # ``{"results": [{"ok": bool}, ...]}`` in request order.  Any other answer
+    # leaves the credits unconfirmed, so they are reported as failed.
+    items = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(items, list) or len(items) != size:
+        logger.error("Unexpected KB batch answer: %s", data)
+        return [False] * size
+    return [isinstance(item, dict) and bool(item.get("ok")) for item in items]
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from cachebot import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Outgoing:
+    method: str
+    chat_id: int
+    kwargs: Dict[str, Any]
+    queued_at: float
+    critical: bool = False
+    attempts: int = 0
+
+
+@dataclass(slots=True)
+class _TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float = 0.0
+    updated: float = 0.0
+    paused_until: float = 0.0
+
+    def pause(self, until: float) -> None:
+        self.paused_until = max(self.paused_until, until)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+    """Background delivery of bot messages that nobody waits for.
+
+    ``send_message`` and ``send_photo`` take the arguments of the ``Bot``
+    methods, queue the message and return at once.  Workers deliver it within
+    a global rate (Telegram allows about 30 messages per second) and at most
+    one message per ``chat_interval`` to the same chat, keeping the order of
+    messages within a chat.  A flood-control answer holds back every chat for
+    the requested time, since Telegram applies it to the whole bot; network
+    and server errors are retried with back-off.
+
+    Once ``max_pending`` messages wait, new ones are dropped unless they are
+    ``critical`` (payments and deal status changes), which are always queued.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        *,
+        rate: float = 30.0,
+        chat_interval: float = 1.0,
+        workers: int = 8,
+        max_attempts: int = 5,
+        max_pending: int = 10000,
+    ) -> None:
+        self._bot = bot
+        # No burst allowance: a full bucket on top of the refill would let
+        # twice the rate through within a second.
+        self._bucket = _TokenBucket(rate=rate, capacity=1.0)
+        self._chat_interval = chat_interval
+        self._worker_count = workers
+        self._max_attempts = max_attempts
+        self._max_pending = max_pending
+        self._chats: Dict[int, Deque[_Outgoing]] = {}
+        # Chats with queued messages that no worker holds, by the time they
+        # may be sent to next.
+        self._ready: List[tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._last_sent: Dict[int, float] = {}
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers: List[asyncio.Task] = []
+        self._depth = metrics.gauge("notifier.queue_depth")
+        self._latency = metrics.histogram("notifier.delivery_ms")
+        self._sent = metrics.counter("notifier.sent")
+        self._retried = metrics.counter("notifier.retried")
+        self._failed = metrics.counter("notifier.failed")
+        self._dropped = metrics.counter("notifier.dropped")
+        self._over_limit = metrics.counter("notifier.over_limit")
+
+    def start(self) -> None:
+        for _ in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def close(self, timeout: float = 5.0) -> None:
+        # Gives queued messages a chance to go out before stopping.
+        if self._workers:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Dropping %s undelivered notifications", self._pending)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def send_message(self, chat_id: int, text: str, *, critical: bool = False, **kwargs: Any) -> None:
+        self._enqueue("send_message", chat_id, {"text": text, **kwargs}, critical)
+
+    def send_photo(self, chat_id: int, photo: Any, *, critical: bool = False, **kwargs: Any) -> None:
+        self._enqueue("send_photo", chat_id, {"photo": photo, **kwargs}, critical)
+
+    def _enqueue(self, method: str, chat_id: int, kwargs: Dict[str, Any], critical: bool) -> None:
+        if self._pending >= self._max_pending:
+            if not critical:
+                self._dropped.inc()
+                logger.warning("Notification queue is full, dropping message to %s", chat_id)
+                return
+            self._over_limit.inc()
+        loop = asyncio.get_running_loop()
+        item = _Outgoing(method, chat_id, kwargs, loop.time(), critical)
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            self._push_ready(chat_id, self._last_sent.get(chat_id, 0.0) + self._chat_interval)
+        queue.append(item)
+        self._pending += 1
+        self._depth.set(self._pending)
+        self._idle.clear()
+
+    def _push_ready(self, chat_id: int, at: float) -> None:
+        heapq.heappush(self._ready, (at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _next_chat(self) -> int:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            delay = None
+            if self._ready:
+                at, _, chat_id = self._ready[0]
+                delay = at - loop.time()
+                if delay <= 0:
+                    heapq.heappop(self._ready)
+                    return chat_id
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._next_chat()
+            queue = self._chats[chat_id]
+            item = queue[0]
+            await self._bucket.acquire()
+            retry_at = await self._deliver(item)
+            now = loop.time()
+            if retry_at is None:
+                queue.popleft()
+                self._pending -= 1
+                self._depth.set(self._pending)
+                self._last_sent[chat_id] = now
+                retry_at = now + self._chat_interval
+            if queue:
+                self._push_ready(chat_id, retry_at)
+                continue
+            del self._chats[chat_id]
+            if not self._pending:
+                self._idle.set()
+            if len(self._last_sent) > 10000:
+                # Only chats written to within the interval still matter.
+                horizon = now - self._chat_interval
+                self._last_sent = {
+                    chat: sent for chat, sent in self._last_sent.items() if sent > horizon
+                }
+
+    async def _deliver(self, item: _Outgoing) -> float | None:
+        # Returns when to try again, or None once the message is done with.
+        loop = asyncio.get_running_loop()
+        item.attempts += 1
+        try:
+            await getattr(self._bot, item.method)(item.chat_id, **item.kwargs)
+        except TelegramRetryAfter as exc:
+            self._retried.inc()
+            self._bucket.pause(loop.time() + exc.retry_after)
+            if item.critical or item.attempts < self._max_attempts:
+                return loop.time() + exc.retry_after
+            self._failed.inc()
+            logger.warning("Giving up on message to %s after flood control", item.chat_id)
+            return None
+        except (TelegramNetworkError, TelegramServerError) as exc:
+            if item.attempts < self._max_attempts:
+                self._retried.inc()
+                return loop.time() + min(2 ** item.attempts, 60)
+            self._failed.inc()
+            logger.warning("Failed to deliver message to %s: %s", item.chat_id, exc)
+            return None
+        except Exception as exc:
+            # Blocked bot, deleted chat, bad markup: retrying will not help.
+            self._failed.inc()
+            logger.warning("Failed to deliver message to %s: %s", item.chat_id, exc)
+            return None
+        self._sent.inc()
+        self._latency.observe((loop.time() - item.queued_at) * 1000)
+        return None
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List
+
+from cachebot import metrics
+from cachebot.models.payout import Payout, PayoutStatus
+from cachebot.services.crypto_pay import CryptoPayClient, CryptoPayError
+from cachebot.services.deals import DealService
+from cachebot.services.notifier import Notifier
+
+logger = logging.getLogger(__name__)
+
+# Error code of a transfer whose spend_id has already been paid out.
+SPEND_ID_USED = "SPEND_ID_ALREADY_USED"
+# Error codes the API returns only for a transfer it did not perform; any
+# other refusal may follow a transfer that went through, so it is retried.
+PERMANENT_ERRORS = frozenset(
+    {"INSUFFICIENT_FUNDS", "USER_NOT_FOUND", "AMOUNT_TOO_SMALL", "AMOUNT_TOO_BIG"}
+)
+
+
+class PayoutService:
+    """Runs withdrawals to Crypto Pay in the background.
+
+    ``request`` debits the balance, stores the payout and returns at once;
+    workers then perform the transfer with the payout's own ``spend_id``, so
+    repeating it after a timeout or a restart cannot pay twice.  Errors that
+    leave the outcome unknown (network, 5xx, proxy pages, unknown error
+    codes) are retried with growing delays up to ``max_attempts`` times;
+    after that the payout stays pending for an operator, since refunding it
+    could pay twice.  Only a transfer refused with one of
+    ``PERMANENT_ERRORS`` is refunded to the balance.
+    """
+
+    def __init__(
+        self,
+        deal_service: DealService,
+        crypto_pay: CryptoPayClient,
+        notifier: Notifier,
+        *,
+        workers: int = 4,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+        max_attempts: int = 20,
+    ) -> None:
+        self._deal_service = deal_service
+        self._crypto_pay = crypto_pay
+        self._notifier = notifier
+        self._worker_count = workers
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_attempts = max_attempts
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._retries: set[asyncio.TimerHandle] = set()
+        self._depth = metrics.gauge("payouts.queue_depth")
+
+    async def start(self) -> None:
+        # Payouts left pending by the previous run go first.
+        for payout in sorted(
+            await self._deal_service.pending_payouts(), key=lambda payout: payout.created_at
+        ):
+            if payout.attempts >= self._max_attempts:
+                logger.error("Payout %s is stuck after %s attempts", payout.id, payout.attempts)
+                continue
+            self._enqueue(payout.id)
+        for _ in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def close(self) -> None:
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def request(self, user_id: int, amount: Decimal, fee: Decimal) -> Payout:
+        payout = await self._deal_service.request_payout(user_id, amount, fee)
+        self._enqueue(payout.id)
+        return payout
+
+    def _enqueue(self, payout_id: str) -> None:
+        self._queue.put_nowait(payout_id)
+        self._depth.set(self._queue.qsize())
+
+    def _retry_later(self, payout_id: str, attempts: int) -> None:
+        delay = min(self._max_retry_delay, self._retry_delay * 2 ** max(0, attempts - 1))
+
+        def fire() -> None:
+            self._retries.discard(handle)
+            self._enqueue(payout_id)
+
+        handle = asyncio.get_running_loop().call_later(delay, fire)
+        self._retries.add(handle)
+
+    async def _work(self) -> None:
+        while True:
+            payout_id = await self._queue.get()
+            self._depth.set(self._queue.qsize())
+            try:
+                await self._execute(payout_id)
+            except Exception as exc:  # pragma: no cover - protection loop
+                logger.exception("Payout %s failed: %s", payout_id, exc)
+                self._retry_later(payout_id, 1)
+
+    async def _execute(self, payout_id: str) -> None:
+        payout = await self._deal_service.get_payout(payout_id)
+        if payout is None or payout.status != PayoutStatus.PENDING:
+            return
+        try:
+            result = await self._crypto_pay.transfer(
+                user_id=payout.user_id,
+                amount=payout.amount,
+                currency=payout.currency,
+                spend_id=payout.spend_id,
+            )
+        except Exception as exc:
+            name = (exc.name or "").upper() if isinstance(exc, CryptoPayError) else ""
+            if name == SPEND_ID_USED:
+                # An earlier attempt went through but its answer was lost.
+                await self._finish(payout, None)
+            elif name in PERMANENT_ERRORS:
+                await self._refund(payout, exc)
+            else:
+                await self._retry_or_give_up(payout, exc)
+            return
+        transfer_id = result.get("transfer_id") if isinstance(result, dict) else None
+        await self._finish(payout, None if transfer_id is None else str(transfer_id))
+
+    async def _refund(self, payout: Payout, exc: Exception) -> None:
+        payout = await self._deal_service.refund_payout(payout.id, str(exc))
+        metrics.counter("payouts.refunded").inc()
+        logger.warning("Payout %s refused, refunded: %s", payout.id, exc)
+        self._notifier.send_message(
+            payout.user_id,
+            f"❌ Вывод {_amount_text(payout)} {payout.currency} не выполнен.\n"
+            "Средства возвращены на баланс.",
+            critical=True,
+        )
+
+    async def _retry_or_give_up(self, payout: Payout, exc: Exception) -> None:
+        payout = await self._deal_service.note_payout_attempt(payout.id, str(exc))
+        if payout.attempts >= self._max_attempts:
+            metrics.counter("payouts.stuck").inc()
+            logger.error("Payout %s gave up after %s attempts: %s", payout.id, payout.attempts, exc)
+            self._notifier.send_message(
+                payout.user_id,
+                f"⚠️ Вывод {_amount_text(payout)} {payout.currency} задерживается.\n"
+                "Обратитесь в поддержку.",
+                critical=True,
+            )
+            return
+        metrics.counter("payouts.retried").inc()
+        logger.warning("Payout %s attempt %s failed: %s", payout.id, payout.attempts, exc)
+        self._retry_later(payout.id, payout.attempts)
+
+    async def _finish(self, payout: Payout, transfer_id: str | None) -> None:
+        payout = await self._deal_service.complete_payout(payout.id, transfer_id)
+        metrics.counter("payouts.sent").inc()
+        metrics.histogram("payouts.completion_ms").observe(
+            (datetime.now(timezone.utc) - payout.created_at).total_seconds() * 1000
+        )
+        self._notifier.send_message(
+            payout.user_id,
+            f"✅ Вывод {_amount_text(payout)} {payout.currency} выполнен.",
+            critical=True,
+        )
+
+
+def _amount_text(payout: Payout) -> str:
+    return f"{payout.amount.quantize(Decimal('0.01')):f}"
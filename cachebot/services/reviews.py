@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import asyncio
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 
 from cachebot.models.review import Review
 from cachebot.storage import StateRepository
@@ -59,6 +59,16 @@ class ReviewService:
                     return review
         return None
 
+    async def reviews_from(self, user_id: int, deal_ids: Iterable[str]) -> Dict[str, Review]:
+        # The review ``user_id`` left on each of ``deal_ids``, where there is one.
+        wanted = set(deal_ids)
+        result: Dict[str, Review] = {}
+        async with self._lock:
+            for review in self._reviews:
+                if review.from_user_id == user_id and review.deal_id in wanted:
+                    result.setdefault(review.deal_id, review)
+        return result
+
     async def review_between(self, from_user_id: int, to_user_id: int) -> Optional[Review]:
         async with self._lock:
             for review in self._reviews:
@@ -2,122 +2,196 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from datetime import datetime, timezone, timedelta
-from typing import Optional
+from datetime import timedelta
+from functools import partial
+from typing import Dict, List, Optional
 
-from aiogram import Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from cachebot import metrics
 from cachebot.models.deal import Deal, DealStatus
+from cachebot.services.archiver import archive_finished_deals
+from cachebot.services.chats import ChatService
 from cachebot.services.crypto_pay import CryptoPayClient
-from cachebot.services.deals import DealService
+from cachebot.services.deadlines import DeadlineScheduler
+from cachebot.services.deals import DISPUTE_TIMER_JOB, EXPIRY_JOB, DealService
 from cachebot.services.adverts import AdvertService
 from cachebot.services.kb_client import KBClient
-from cachebot.services.support import SupportService
+from cachebot.services.notifier import Notifier
+from cachebot.services.support import INACTIVITY_JOB, SupportService
+from cachebot.services.users import MODERATION_JOB, PRESENCE_JOB, UserService
+from cachebot.storage import DealArchive, JournalStateRepository, ShardedStateRepository
 
 logger = logging.getLogger(__name__)
 
 
-async def expiry_watcher(
+def register_deadline_jobs(
+    scheduler: DeadlineScheduler,
     deal_service: DealService,
     advert_service: AdvertService,
-    bot: Bot,
-    interval: int = 30,
+    user_service: UserService,
+    support_service: SupportService,
+    notifier: Notifier,
 ) -> None:
-    while True:
-        try:
-            expired = await deal_service.cleanup_expired()
-            for deal in expired:
-                if deal.is_p2p and deal.advert_id:
-                    try:
-                        base_usdt = deal.usd_amount / deal.rate
-                        await advert_service.restore_volume(deal.advert_id, base_usdt)
-                    except Exception:
-                        pass
-                text = f"⏳ Предложение {deal.hashtag} не было принято вовремя и отменено."
-                await bot.send_message(deal.seller_id, text)
-                if deal.buyer_id:
-                    await bot.send_message(deal.buyer_id, text)
-        except Exception as exc:  # pragma: no cover - protection loop
-            logger.exception("Expiry watcher error: %s", exc)
-        await asyncio.sleep(interval)
+    scheduler.register(EXPIRY_JOB, partial(expire_offers, deal_service, advert_service, notifier))
+    scheduler.register(DISPUTE_TIMER_JOB, partial(notify_dispute_timers, deal_service, notifier))
+    scheduler.register(MODERATION_JOB, user_service.expire_moderation)
+    scheduler.register(PRESENCE_JOB, user_service.flush_presence)
+    scheduler.register(INACTIVITY_JOB, partial(close_inactive_tickets, support_service, notifier))
 
 
-async def dispute_timer_watcher(deal_service: DealService, bot: Bot, interval: int = 30) -> None:
-    while True:
-        try:
-            ready = await deal_service.list_dispute_ready()
-            for deal in ready:
-                text = (
-                    f"⏳ Таймер по сделке {deal.hashtag} истёк.\n"
-                    "Если есть спорные моменты, советуем открыть спор."
-                )
-                await bot.send_message(deal.seller_id, text)
-                if deal.buyer_id:
-                    await bot.send_message(deal.buyer_id, text)
-                await deal_service.mark_dispute_notified(deal.id)
-        except Exception as exc:  # pragma: no cover
-            logger.exception("Dispute timer watcher error: %s", exc)
-        await asyncio.sleep(interval)
+async def expire_offers(
+    deal_service: DealService,
+    advert_service: AdvertService,
+    notifier: Notifier,
+    deal_ids: List[str],
+) -> None:
+    expired = await deal_service.cleanup_expired(deal_ids)
+    for deal in expired:
+        if deal.is_p2p and deal.advert_id:
+            try:
+                base_usdt = deal.usd_amount / deal.rate
+                await advert_service.restore_volume(deal.advert_id, base_usdt)
+            except Exception:
+                pass
+        text = f"⏳ Предложение {deal.hashtag} не было принято вовремя и отменено."
+        notifier.send_message(deal.seller_id, text, critical=True)
+        if deal.buyer_id:
+            notifier.send_message(deal.buyer_id, text, critical=True)
+
+
+async def notify_dispute_timers(
+    deal_service: DealService,
+    notifier: Notifier,
+    deal_ids: List[str],
+) -> None:
+    ready = await deal_service.list_dispute_ready(deal_ids)
+    for deal in ready:
+        text = (
+            f"⏳ Таймер по сделке {deal.hashtag} истёк.\n"
+            "Если есть спорные моменты, советуем открыть спор."
+        )
+        notifier.send_message(deal.seller_id, text, critical=True)
+        if deal.buyer_id:
+            notifier.send_message(deal.buyer_id, text, critical=True)
+        await deal_service.mark_dispute_notified(deal.id)
 
 
 async def invoice_watcher(
     deal_service: DealService,
     crypto_client: CryptoPayClient,
     kb_client: KBClient,
-    bot: Bot,
+    notifier: Notifier,
     interval: int,
+    max_interval: int | None = None,
 ) -> None:
+    # Fresh invoices are polled every ``interval`` seconds and older ones less
+    # often, at a tenth of their age up to ``max_interval``: most invoices are
+    # paid within minutes and the webhook reports the rest anyway.  Only
+    # reserved deals are polled, so invoices the webhook has settled drop out.
+    max_interval = max(interval, max_interval or interval)
+    loop = asyncio.get_running_loop()
+    first_seen: Dict[str, float] = {}
+    polled_at: Dict[str, float] = {}
     while True:
         try:
+            now = loop.time()
             deals = await deal_service.reserved_deals_with_invoices()
-            invoices = await crypto_client.fetch_invoices([deal.invoice_id for deal in deals])
-            paid_ids = {invoice.invoice_id for invoice in invoices if invoice.status == "paid"}
-            for invoice_id in paid_ids:
-                deal = await deal_service.mark_invoice_paid(invoice_id)
-                await handle_paid_invoice(deal, kb_client, bot)
+            first_seen = {deal.invoice_id: first_seen.get(deal.invoice_id, now) for deal in deals}
+            polled_at = {key: value for key, value in polled_at.items() if key in first_seen}
+            metrics.gauge("invoice_watcher.open").set(len(first_seen))
+            due = due_invoices(first_seen, polled_at, now, interval, max_interval)
+            if due:
+                invoices = await crypto_client.fetch_invoices(due)
+                polled_at.update(dict.fromkeys(due, now))
+                metrics.counter("invoice_watcher.polled").inc(len(due))
+                for invoice in invoices:
+                    if invoice.status != "paid":
+                        continue
+                    try:
+                        deal, settled = await deal_service.settle_invoice(invoice.invoice_id)
+                    except LookupError:
+                        continue
+                    if settled:
+                        handle_paid_invoice(deal, kb_client, notifier)
         except Exception as exc:  # pragma: no cover
             logger.exception("Invoice watcher error: %s", exc)
-    await asyncio.sleep(interval)
+        await asyncio.sleep(interval)
+
+
+def due_invoices(
+    first_seen: Dict[str, float],
+    polled_at: Dict[str, float],
+    now: float,
+    interval: float,
+    max_interval: float,
+) -> List[str]:
+    return [
+        invoice_id
+        for invoice_id, seen in first_seen.items()
+        if invoice_id not in polled_at
+        or now - polled_at[invoice_id] >= min(max_interval, max(interval, (now - seen) / 10))
+    ]
 
 
-async def support_inactive_watcher(
+async def close_inactive_tickets(
     support_service: SupportService,
-    bot: Bot,
+    notifier: Notifier,
+    ticket_ids: List[int],
+) -> None:
+    inactive = await support_service.take_inactive(ticket_ids)
+    for ticket in inactive:
+        notifier.send_message(
+            ticket.user_id,
+            "🕓 Чат поддержки закрыт автоматически из-за отсутствия активности 24 часа.",
+        )
+        await support_service.close(ticket.id)
+
+
+async def compaction_watcher(
+    repository: JournalStateRepository | ShardedStateRepository,
     interval: int = 300,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await repository.compact()
+        except Exception as exc:  # pragma: no cover
+            logger.exception("State compaction error: %s", exc)
+
+
+async def archive_watcher(
+    deal_service: DealService,
+    chat_service: ChatService,
+    archive: DealArchive,
+    max_age_days: int,
+    interval: int = 3600,
 ) -> None:
     while True:
         try:
-            cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
-            cutoff_iso = cutoff.isoformat()
-            inactive = await support_service.list_inactive_tickets(cutoff_iso)
-            for ticket in inactive:
-                try:
-                    await bot.send_message(
-                        ticket.user_id,
-                        "🕓 Чат поддержки закрыт автоматически из-за отсутствия активности 24 часа.",
-                    )
-                except Exception:
-                    pass
-                await support_service.close(ticket.id)
+            await archive_finished_deals(
+                deal_service, chat_service, archive, timedelta(days=max_age_days)
+            )
         except Exception as exc:  # pragma: no cover
-            logger.exception("Support inactive watcher error: %s", exc)
+            logger.exception("Deal archive error: %s", exc)
         await asyncio.sleep(interval)
 
 
-async def handle_paid_invoice(deal: Deal, kb_client: KBClient, bot: Bot) -> None:
+def handle_paid_invoice(deal: Deal, kb_client: KBClient, notifier: Notifier) -> None:
     builder = InlineKeyboardBuilder()
     builder.button(text="К сделке", callback_data=f"deal_info:{deal.id}")
-    await bot.send_message(
+    notifier.send_message(
         deal.seller_id,
         "✅ Платеж отправлен!\n"
         "Ожидай выбора банка для снятия.",
         reply_markup=builder.as_markup(),
+        critical=True,
     )
     if deal.buyer_id:
-        await bot.send_message(
+        notifier.send_message(
             deal.buyer_id,
             f"✅ Платеж по сделке {deal.hashtag} подтвержден.\n"
             "Выбери банк и запроси QR в меню сделки.",
             reply_markup=builder.as_markup(),
+            critical=True,
         )
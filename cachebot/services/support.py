@@ -3,10 +3,17 @@ from __future__ import annotations
 import asyncio
 import sqlite3
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any, List
 
+from cachebot.services.changes import ChangeFeed
+from cachebot.services.deadlines import DeadlineScheduler
+
+# Deadline job keyed by ticket id: open tickets without activity are closed.
+INACTIVITY_JOB = "support_inactivity"
+INACTIVITY_TIMEOUT = timedelta(hours=24)
+
 
 @dataclass(slots=True)
 class SupportTicket:
@@ -38,11 +45,29 @@ class SupportMessage:
 
 
 class SupportService:
-    def __init__(self, db_path: Path) -> None:
+    def __init__(
+        self,
+        db_path: Path,
+        *,
+        scheduler: DeadlineScheduler | None = None,
+        changes: ChangeFeed | None = None,
+    ) -> None:
         self._db_path = db_path
         self._lock = asyncio.Lock()
+        self._scheduler = scheduler or DeadlineScheduler()
+        self._changes = changes or ChangeFeed()
         self._db_path.parent.mkdir(parents=True, exist_ok=True)
         self._init_db()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, COALESCE(last_message_at, updated_at, created_at) AS active_at "
+                "FROM support_tickets WHERE status != 'closed'"
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            self._schedule_inactivity(row["id"], row["active_at"])
 
     def _connect(self) -> sqlite3.Connection:
         conn = sqlite3.connect(self._db_path)
@@ -147,7 +172,10 @@ class SupportService:
                     return SupportTicket(**dict(row))
                 finally:
                     conn.close()
-            return await asyncio.to_thread(_run)
+            ticket = await asyncio.to_thread(_run)
+            self._schedule_inactivity(ticket.id, now)
+            self._changes.support_changed(ticket.id, (ticket.user_id,))
+            return ticket
 
     async def has_open_ticket(self, user_id: int) -> bool:
         async with self._lock:
@@ -200,6 +228,32 @@ class SupportService:
                     conn.close()
             return await asyncio.to_thread(_run)
 
+    async def take_inactive(self, ticket_ids: List[int]) -> List[SupportTicket]:
+        # Tickets among ``ticket_ids`` that have been quiet for the whole
+        # timeout; the others are rescheduled from their last activity.
+        async with self._lock:
+            def _run() -> List[SupportTicket]:
+                conn = self._connect()
+                try:
+                    marks = ",".join("?" * len(ticket_ids))
+                    rows = conn.execute(
+                        f"SELECT * FROM support_tickets WHERE status != 'closed' AND id IN ({marks})",
+                        ticket_ids,
+                    ).fetchall()
+                    return [SupportTicket(**dict(row)) for row in rows]
+                finally:
+                    conn.close()
+            tickets = await asyncio.to_thread(_run) if ticket_ids else []
+            now = datetime.now(timezone.utc)
+            inactive = []
+            for ticket in tickets:
+                active_at = ticket.last_message_at or ticket.updated_at or ticket.created_at
+                if datetime.fromisoformat(active_at) + INACTIVITY_TIMEOUT <= now:
+                    inactive.append(ticket)
+                else:
+                    self._schedule_inactivity(ticket.id, active_at)
+            return inactive
+
     async def get_ticket(self, ticket_id: int) -> SupportTicket | None:
         async with self._lock:
             def _run() -> SupportTicket | None:
@@ -237,7 +291,7 @@ class SupportService:
     ) -> SupportMessage:
         async with self._lock:
             now = datetime.now(timezone.utc).isoformat()
-            def _run() -> SupportMessage:
+            def _run() -> tuple[SupportMessage, Any]:
                 conn = self._connect()
                 try:
                     cur = conn.execute(
@@ -261,15 +315,22 @@ class SupportService:
                     )
                     conn.commit()
                     row = conn.execute("SELECT * FROM support_messages WHERE id = ?", (cur.lastrowid,)).fetchone()
-                    return SupportMessage(**dict(row))
+                    users = conn.execute(
+                        "SELECT user_id, assigned_to FROM support_tickets WHERE id = ?", (ticket_id,)
+                    ).fetchone()
+                    return SupportMessage(**dict(row)), users
                 finally:
                     conn.close()
-            return await asyncio.to_thread(_run)
+            message, users = await asyncio.to_thread(_run)
+            self._schedule_inactivity(ticket_id, now)
+            if users is not None:
+                self._changes.support_changed(ticket_id, tuple(users))
+            return message
 
     async def assign(self, ticket_id: int, moderator_id: int, moderator_name: str | None = None) -> None:
         async with self._lock:
             now = datetime.now(timezone.utc).isoformat()
-            def _run() -> None:
+            def _run() -> Any:
                 conn = self._connect()
                 try:
                     conn.execute(
@@ -281,18 +342,34 @@ class SupportService:
                         (moderator_id, moderator_name, now, ticket_id),
                     )
                     conn.commit()
+                    return conn.execute(
+                        "SELECT user_id FROM support_tickets WHERE id = ?", (ticket_id,)
+                    ).fetchone()
                 finally:
                     conn.close()
-            await asyncio.to_thread(_run)
+            row = await asyncio.to_thread(_run)
+            if row is not None:
+                self._changes.support_changed(ticket_id, (row["user_id"], moderator_id))
 
     async def close(self, ticket_id: int) -> None:
         async with self._lock:
-            def _run() -> None:
+            def _run() -> Any:
                 conn = self._connect()
                 try:
+                    users = conn.execute(
+                        "SELECT user_id, assigned_to FROM support_tickets WHERE id = ?", (ticket_id,)
+                    ).fetchone()
                     conn.execute("DELETE FROM support_messages WHERE ticket_id = ?", (ticket_id,))
                     conn.execute("DELETE FROM support_tickets WHERE id = ?", (ticket_id,))
                     conn.commit()
+                    return users
                 finally:
                     conn.close()
-            await asyncio.to_thread(_run)
+            users = await asyncio.to_thread(_run)
+            self._scheduler.cancel(INACTIVITY_JOB, ticket_id)
+            if users is not None:
+                self._changes.support_changed(ticket_id, tuple(users))
+
+    def _schedule_inactivity(self, ticket_id: int, active_at: str) -> None:
+        deadline = datetime.fromisoformat(active_at) + INACTIVITY_TIMEOUT
+        self._scheduler.schedule(INACTIVITY_JOB, ticket_id, deadline)
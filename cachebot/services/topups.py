@@ -31,6 +31,10 @@ class TopupService:
             await self._persist_locked()
             return topup
 
+    async def get(self, invoice_id: str) -> Topup | None:
+        async with self._lock:
+            return self._topups.get(str(invoice_id))
+
     async def pop_paid(self, invoice_id: str) -> Topup | None:
         async with self._lock:
             topup = self._topups.pop(str(invoice_id), None)
@@ -2,13 +2,19 @@ from __future__ import annotations
 
 import asyncio
 import random
-from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from cachebot.models.user import ApplicationStatus, MerchantApplication, UserProfile, UserRole
+from cachebot.services.deadlines import DeadlineScheduler
 from cachebot.storage import StateRepository
 
+# Deadline job keyed by ("ban" | "deal_block", user id).
+MODERATION_JOB = "moderation_expiry"
+# Single deadline (key None) for writing out batched ``last_seen_at`` updates.
+PRESENCE_JOB = "presence_flush"
+
 
 @dataclass(slots=True)
 class MerchantRecord:
@@ -18,8 +24,18 @@ class MerchantRecord:
 
 
 class UserService:
-    def __init__(self, repository: StateRepository, admin_ids: set[int] | None = None) -> None:
+    def __init__(
+        self,
+        repository: StateRepository,
+        admin_ids: set[int] | None = None,
+        *,
+        scheduler: DeadlineScheduler | None = None,
+        presence_interval: float = 60.0,
+    ) -> None:
         self._repository = repository
+        self._presence_interval = timedelta(seconds=presence_interval)
+        self._presence_dirty = False
+        self._scheduler = scheduler or DeadlineScheduler()
         snapshot = repository.snapshot()
         self._roles: Dict[int, str] = snapshot.user_roles.copy()
         self._applications: List[MerchantApplication] = list(snapshot.applications)
@@ -42,6 +58,10 @@ class UserService:
             int(uid): datetime.fromisoformat(value)
             for uid, value in (getattr(snapshot, "user_deal_block_until", {}) or {}).items()
         }
+        for uid, until in self._ban_until.items():
+            self._scheduler.schedule(MODERATION_JOB, ("ban", uid), until)
+        for uid, until in self._deal_block_until.items():
+            self._scheduler.schedule(MODERATION_JOB, ("deal_block", uid), until)
         self._admin_actions: List[dict] = list(getattr(snapshot, "admin_actions", []))
         self._lock = asyncio.Lock()
         now = datetime.now(timezone.utc)
@@ -108,9 +128,23 @@ class UserService:
     async def ensure_profile(
         self, user_id: int, *, full_name: str | None, username: str | None
     ) -> UserProfile:
+        # Called on every request: a returning user with the same name only
+        # has ``last_seen_at`` moved, in memory and at most once per
+        # ``presence_interval``; the profiles are written by ``flush_presence``.
         now = datetime.now(timezone.utc)
         async with self._lock:
             profile = self._profiles.get(user_id)
+            if (
+                profile
+                and profile.display_name
+                and (full_name is None or full_name == profile.full_name)
+                and (username is None or username == profile.username)
+            ):
+                if now - profile.last_seen_at >= self._presence_interval:
+                    profile = replace(profile, last_seen_at=now)
+                    self._profiles[user_id] = profile
+                    self._mark_presence_locked()
+                return profile
             display_name = profile.display_name if profile else None
             if not display_name:
                 display_name = _random_display_name()
@@ -140,6 +174,27 @@ class UserService:
             await self._persist()
             return profile
 
+    async def flush_presence(self, _: List[object] | None = None) -> None:
+        # Deadline handler for PRESENCE_JOB; also called on shutdown.
+        async with self._lock:
+            if not self._presence_dirty:
+                return
+            self._presence_dirty = False
+            try:
+                await self._repository.persist_profiles(self._profiles.copy())
+            except Exception:
+                # The scheduler retries the job.
+                self._presence_dirty = True
+                raise
+
+    def _mark_presence_locked(self) -> None:
+        if self._presence_dirty:
+            return
+        self._presence_dirty = True
+        self._scheduler.schedule(
+            PRESENCE_JOB, None, datetime.now(timezone.utc) + self._presence_interval
+        )
+
     async def update_profile(
         self,
         user_id: int,
@@ -179,6 +234,14 @@ class UserService:
         async with self._lock:
             return self._profiles.get(user_id)
 
+    async def profiles_of(self, user_ids: Iterable[int]) -> Dict[int, UserProfile]:
+        async with self._lock:
+            return {
+                user_id: profile
+                for user_id in set(user_ids)
+                if (profile := self._profiles.get(user_id)) is not None
+            }
+
     async def profile_by_username(self, username: str) -> UserProfile | None:
         needle = username.lstrip("@").lower()
         async with self._lock:
@@ -251,26 +314,22 @@ class UserService:
         records.sort(key=lambda rec: rec.merchant_since or datetime.min.replace(tzinfo=timezone.utc))
         return records
 
-    def _refresh_expiries(self) -> bool:
+    async def expire_moderation(self, keys: List[Tuple[str, int]]) -> None:
         now = datetime.now(timezone.utc)
-        expired_bans = [uid for uid, until in self._ban_until.items() if until <= now]
-        for uid in expired_bans:
-            self._ban_until.pop(uid, None)
-        expired_blocks = [uid for uid, until in self._deal_block_until.items() if until <= now]
-        for uid in expired_blocks:
-            self._deal_block_until.pop(uid, None)
-        return bool(expired_bans or expired_blocks)
-
-    async def moderation_status(self, user_id: int) -> dict[str, int | bool]:
         async with self._lock:
-            expired = self._refresh_expiries()
+            expired = False
+            for kind, user_id in keys:
+                deadlines = self._ban_until if kind == "ban" else self._deal_block_until
+                until = deadlines.get(user_id)
+                if until is not None and until <= now:
+                    del deadlines[user_id]
+                    expired = True
             if expired:
                 await self._persist()
-            return {
-                "warnings": int(self._warnings.get(user_id, 0)),
-                "banned": user_id in self._banned or user_id in self._ban_until,
-                "deals_blocked": user_id in self._deal_blocks or user_id in self._deal_block_until,
-            }
+
+    async def moderation_status(self, user_id: int) -> dict[str, int | bool]:
+        async with self._lock:
+            return self._moderation_locked(user_id)
 
     async def add_warning(self, user_id: int) -> dict[str, int | bool]:
         async with self._lock:
@@ -279,14 +338,10 @@ class UserService:
             if count >= 3:
                 self._banned.add(user_id)
                 self._deal_blocks.add(user_id)
-                self._ban_until.pop(user_id, None)
-                self._deal_block_until.pop(user_id, None)
+                self._set_until_locked("ban", user_id, None)
+                self._set_until_locked("deal_block", user_id, None)
             await self._persist()
-            return {
-                "warnings": count,
-                "banned": user_id in self._banned or user_id in self._ban_until,
-                "deals_blocked": user_id in self._deal_blocks or user_id in self._deal_block_until,
-            }
+            return self._moderation_locked(user_id)
 
     async def set_banned(
         self, user_id: int, banned: bool, *, until: datetime | None = None
@@ -294,20 +349,16 @@ class UserService:
         async with self._lock:
             if banned:
                 if until:
-                    self._ban_until[user_id] = until
+                    self._set_until_locked("ban", user_id, until)
                 else:
                     self._banned.add(user_id)
                 self._deal_blocks.add(user_id)
             else:
                 self._banned.discard(user_id)
-                self._ban_until.pop(user_id, None)
+                self._set_until_locked("ban", user_id, None)
                 self._warnings.pop(user_id, None)
             await self._persist()
-            return {
-                "warnings": int(self._warnings.get(user_id, 0)),
-                "banned": user_id in self._banned or user_id in self._ban_until,
-                "deals_blocked": user_id in self._deal_blocks or user_id in self._deal_block_until,
-            }
+            return self._moderation_locked(user_id)
 
     async def set_deal_blocked(
         self, user_id: int, blocked: bool, *, until: datetime | None = None
@@ -315,29 +366,40 @@ class UserService:
         async with self._lock:
             if blocked:
                 if until:
-                    self._deal_block_until[user_id] = until
+                    self._set_until_locked("deal_block", user_id, until)
                 else:
                     self._deal_blocks.add(user_id)
             else:
                 self._deal_blocks.discard(user_id)
-                self._deal_block_until.pop(user_id, None)
+                self._set_until_locked("deal_block", user_id, None)
             await self._persist()
-            return {
-                "warnings": int(self._warnings.get(user_id, 0)),
-                "banned": user_id in self._banned or user_id in self._ban_until,
-                "deals_blocked": user_id in self._deal_blocks or user_id in self._deal_block_until,
-            }
+            return self._moderation_locked(user_id)
 
     async def can_trade(self, user_id: int) -> bool:
         async with self._lock:
-            expired = self._refresh_expiries()
-            if expired:
-                await self._persist()
-            if user_id in self._banned or user_id in self._ban_until:
-                return False
-            if user_id in self._deal_blocks or user_id in self._deal_block_until:
-                return False
-            return True
+            status = self._moderation_locked(user_id)
+            return not status["banned"] and not status["deals_blocked"]
+
+    def _moderation_locked(self, user_id: int) -> dict[str, int | bool]:
+        # Temporary restrictions that ran out count as lifted even before the
+        # scheduler gets to remove them.
+        now = datetime.now(timezone.utc)
+        ban_until = self._ban_until.get(user_id)
+        block_until = self._deal_block_until.get(user_id)
+        return {
+            "warnings": int(self._warnings.get(user_id, 0)),
+            "banned": user_id in self._banned or (ban_until is not None and ban_until > now),
+            "deals_blocked": user_id in self._deal_blocks
+            or (block_until is not None and block_until > now),
+        }
+
+    def _set_until_locked(self, kind: str, user_id: int, until: datetime | None) -> None:
+        deadlines = self._ban_until if kind == "ban" else self._deal_block_until
+        if until is None:
+            deadlines.pop(user_id, None)
+        else:
+            deadlines[user_id] = until
+        self._scheduler.schedule(MODERATION_JOB, (kind, user_id), until)
 
     async def has_merchant_access(self, user_id: int) -> bool:
         async with self._lock:
@@ -361,6 +423,8 @@ class UserService:
             return list(self._admin_actions)
 
     async def _persist(self) -> None:
+        # Profiles go out in full, pending presence updates included; they
+        # stay pending for PRESENCE_JOB if the write fails.
         await self._repository.persist_user_data(
             roles=self._roles.copy(),
             applications=list(self._applications),
@@ -376,6 +440,7 @@ class UserService:
                 uid: value.isoformat() for uid, value in self._deal_block_until.items()
             },
         )
+        self._presence_dirty = False
 
 
 def _random_display_name() -> str:
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, List
+
+from cachebot import metrics
+from cachebot.services.deals import DealService
+from cachebot.services.kb_client import KBClient
+from cachebot.services.notifier import Notifier
+from cachebot.services.scheduler import handle_paid_invoice
+from cachebot.services.topups import TopupService
+from cachebot.storage import WebhookInbox
+from cachebot.storage.inbox import InboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookConsumer:
+    """Applies paid-invoice webhooks from the durable inbox.
+
+    The webhook handler only hands the event to ``accept``, which writes it to
+    the inbox under ``invoice_id:status`` and returns; one background task
+    then settles the deal or credits the top-up, in the order the events
+    arrived.  Replays of an event are answered from a bounded set of recent
+    keys without touching the inbox.  Settling is idempotent, so an event
+    repeated after a crash does not pay or notify twice.  A failing event is
+    retried with growing delays, while newer events go ahead of it; after
+    ``max_attempts`` failures it is left in the inbox as dead.
+    """
+
+    BATCH = 100
+    PRUNE_INTERVAL = 3600.0
+
+    def __init__(
+        self,
+        inbox: WebhookInbox,
+        deal_service: DealService,
+        topup_service: TopupService,
+        kb_client: KBClient,
+        notifier: Notifier,
+        *,
+        dedup_size: int = 10000,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+        max_attempts: int = 20,
+        retention_days: int = 7,
+    ) -> None:
+        self._inbox = inbox
+        self._deal_service = deal_service
+        self._topup_service = topup_service
+        self._kb_client = kb_client
+        self._notifier = notifier
+        self._dedup_size = dedup_size
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_attempts = max_attempts
+        self._retention = timedelta(days=retention_days)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._pruned_at = 0.0
+        self._backlog = 0
+        self._depth = metrics.gauge("webhook.inbox_depth")
+        self._duplicates = metrics.counter("webhook.duplicates")
+        self._dead = metrics.gauge("webhook.dead_letters")
+
+    async def start(self) -> None:
+        for key in await self._inbox.recent_keys(self._dedup_size):
+            self._remember(key)
+        self._backlog = await self._inbox.pending_count()
+        self._depth.set(self._backlog)
+        self._dead.set(await self._inbox.dead_count())
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def backlog(self) -> int:
+        return self._backlog
+
+    async def accept(self, invoice_id: str, status: str, invoice: dict[str, Any]) -> bool:
+        # False for an event that has already been accepted.
+        key = f"{invoice_id}:{status}"
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            self._duplicates.inc()
+            return False
+        added = await self._inbox.add(key, invoice)
+        self._remember(key)
+        if not added:
+            self._duplicates.inc()
+            return False
+        self._backlog += 1
+        self._depth.set(self._backlog)
+        self._wakeup.set()
+        return True
+
+    def _remember(self, key: str) -> None:
+        self._seen[key] = None
+        self._seen.move_to_end(key)
+        while len(self._seen) > self._dedup_size:
+            self._seen.popitem(last=False)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            events = await self._inbox.pending(self.BATCH, datetime.now(timezone.utc))
+            if events:
+                await self._apply(events)
+                continue
+            if loop.time() - self._pruned_at >= self.PRUNE_INTERVAL:
+                self._pruned_at = loop.time()
+                await self._inbox.prune(datetime.now(timezone.utc) - self._retention)
+            delay = self.PRUNE_INTERVAL
+            retry_at = await self._inbox.next_retry_at()
+            if retry_at is not None:
+                delay = min(delay, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _apply(self, events: List[InboxEvent]) -> None:
+        done: List[str] = []
+        dead = 0
+        for event in events:
+            try:
+                await self._process(event)
+            except Exception as exc:
+                attempts = event.attempts + 1
+                logger.exception("Failed to process webhook %s: %s", event.key, exc)
+                if attempts >= self._max_attempts:
+                    metrics.counter("webhook.dead").inc()
+                    logger.error("Webhook %s dropped after %s attempts", event.key, attempts)
+                    await self._inbox.mark_dead(event.key, str(exc))
+                    dead += 1
+                    continue
+                metrics.counter("webhook.retried").inc()
+                delay = min(self._max_retry_delay, self._retry_delay * 2 ** (attempts - 1))
+                await self._inbox.note_failure(
+                    event.key, str(exc), datetime.now(timezone.utc) + timedelta(seconds=delay)
+                )
+                continue
+            done.append(event.key)
+            metrics.histogram("webhook.processing_lag_ms").observe(
+                (datetime.now(timezone.utc) - event.received_at).total_seconds() * 1000
+            )
+        await self._inbox.mark_processed(done)
+        self._backlog = max(0, self._backlog - len(done) - dead)
+        self._depth.set(self._backlog)
+        if dead:
+            self._dead.set(self._dead.value + dead)
+
+    async def _process(self, event: InboxEvent) -> None:
+        invoice_id = str(event.payload["invoice_id"])
+        try:
+            deal, settled = await self._deal_service.settle_invoice(invoice_id)
+        except LookupError:
+            await self._credit_topup(invoice_id)
+            return
+        if settled:
+            handle_paid_invoice(deal, self._kb_client, self._notifier)
+
+    async def _credit_topup(self, invoice_id: str) -> None:
+        # The top-up leaves the list only after the credit is stored; a retry
+        # in between finds the credit already made and just drops it.
+        topup = await self._topup_service.get(invoice_id)
+        if not topup:
+            return
+        if await self._deal_service.credit_topup(topup.invoice_id, topup.user_id, topup.amount):
+            amount_str = f"{topup.amount.quantize(Decimal('0.01')):f}"
+            self._notifier.send_message(
+                topup.user_id,
+                "✅ Пополнение успешно.\n"
+                f"Сумма: {amount_str} USDT\n"
+                "Хороших сделок!",
+                critical=True,
+            )
+        await self._topup_service.pop_paid(invoice_id)
@@ -1,3 +1,19 @@
+from .archive import DealArchive
+from .binary import BinaryStateRepository
+from .inbox import WebhookInbox
+from .journal import JournalStateRepository
 from .repository import RateSettings, StateRepository, StorageState
+from .sharded import ShardedStateRepository
+from .sqlite import SqliteStateRepository
 
-__all__ = ["RateSettings", "StateRepository", "StorageState"]
+__all__ = [
+    "BinaryStateRepository",
+    "DealArchive",
+    "JournalStateRepository",
+    "RateSettings",
+    "ShardedStateRepository",
+    "SqliteStateRepository",
+    "StateRepository",
+    "StorageState",
+    "WebhookInbox",
+]
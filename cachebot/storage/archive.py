@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, TypeVar
+
+from cachebot.models.chat import ChatMessage
+from cachebot.models.deal import Deal
+from cachebot.storage.cold import ColdCache
+
+_T = TypeVar("_T")
+
+
+class DealArchive:
+    """Append-only SQLite table of finished deals together with their chats.
+
+    Archived deals are no longer part of the state; lookups by id, public id
+    or participant read them back on demand, in a worker thread, and keep
+    recent answers in a small LRU.  Archiving the same deal again replaces its
+    row, so an interrupted run can simply be repeated.
+    """
+
+    def __init__(self, path: Path, cache_bytes: int = 8 * 1024 * 1024) -> None:
+        self._path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Reads and writes run in worker threads, each side on its own
+        # connection under a lock that ``close`` takes too.
+        self._reader_guard = threading.Lock()
+        self._writer_guard = threading.Lock()
+        self._reader = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS deals (
+                id TEXT PRIMARY KEY,
+                public_id TEXT,
+                seller_id INTEGER,
+                buyer_id INTEGER,
+                created_at TEXT,
+                archived_at TEXT NOT NULL,
+                data TEXT NOT NULL,
+                chat TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_deals_public_id ON deals (public_id);
+            CREATE INDEX IF NOT EXISTS idx_deals_seller_id ON deals (seller_id);
+            CREATE INDEX IF NOT EXISTS idx_deals_buyer_id ON deals (buyer_id);
+            CREATE INDEX IF NOT EXISTS idx_deals_seller_created
+                ON deals (seller_id, created_at, id);
+            CREATE INDEX IF NOT EXISTS idx_deals_buyer_created
+                ON deals (buyer_id, created_at, id);
+            """
+        )
+        self._writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=FULL")
+        self._write_lock = asyncio.Lock()
+        self._cache = ColdCache(cache_bytes, "archive.cache")
+        # Bumped by ``store``, so that a read started before it is not cached.
+        self._generation = 0
+
+    async def store(
+        self,
+        deals: Iterable[dict[str, Any]],
+        chats: Dict[str, List[ChatMessage]],
+    ) -> None:
+        # ``deals`` are ``Deal.to_dict()`` payloads.
+        archived_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            (
+                data["id"],
+                data["public_id"].upper() if data.get("public_id") else None,
+                data["seller_id"],
+                data.get("buyer_id"),
+                data["created_at"],
+                archived_at,
+                json.dumps(data, ensure_ascii=False),
+                json.dumps([msg.to_dict() for msg in chats.get(data["id"], [])], ensure_ascii=False),
+            )
+            for data in deals
+        ]
+        if not rows:
+            return
+        async with self._write_lock:
+            await asyncio.to_thread(self._insert, rows)
+        self._generation += 1
+        self._cache.clear()
+
+    async def get(self, deal_id: str) -> Deal | None:
+        deals = await self._deals("id", deal_id)
+        return deals[0] if deals else None
+
+    async def get_by_public_id(self, public_id: str) -> Deal | None:
+        deals = await self._deals("public_id", public_id.upper())
+        return deals[0] if deals else None
+
+    async def stored(self, deal_ids: Iterable[str]) -> Dict[str, Deal]:
+        # Archived copies of the given deals, for those that have one.
+        return await asyncio.to_thread(self._stored, list(deal_ids))
+
+    async def user_deals_before(
+        self,
+        user_id: int,
+        before: tuple[str, str] | None,
+        limit: int,
+        *,
+        statuses: Iterable[str] = (),
+        role: str | None = None,
+        is_p2p: bool | None = None,
+    ) -> List[Deal]:
+        # One page of the user's deals newest first, below ``before`` =
+        # ``(created_at isoformat, id)``, with only the given ``statuses``,
+        # ``role`` ("seller" or "buyer") and kind; not cached, the cursor
+        # moves on.
+        created_at, deal_id = before if before is not None else ("\uffff", "")
+        condition = "(created_at, id) < (?, ?)"
+        params: list[Any] = [created_at, deal_id]
+        statuses = list(statuses)
+        if statuses:
+            condition += f" AND json_extract(data, '$.status') IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        if is_p2p is not None:
+            condition += " AND COALESCE(json_extract(data, '$.is_p2p'), 0) = ?"
+            params.append(int(is_p2p))
+        # Each side is limited on its own index walk before the merge.
+        order = "ORDER BY created_at DESC, id DESC LIMIT ?"
+        sides: list[str] = []
+        args: list[Any] = []
+        if role != "buyer":
+            sides.append(f"SELECT created_at, id, data FROM deals WHERE seller_id = ? AND {condition} {order}")
+            args.extend((user_id, *params, limit))
+        if role == "buyer":
+            sides.append(f"SELECT created_at, id, data FROM deals WHERE buyer_id = ? AND {condition} {order}")
+            args.extend((user_id, *params, limit))
+        elif role is None:
+            # Deals a user bought from themselves come with the seller side.
+            sides.append(
+                "SELECT created_at, id, data FROM deals WHERE buyer_id = ? AND seller_id IS NOT ? "
+                f"AND {condition} {order}"
+            )
+            args.extend((user_id, user_id, *params, limit))
+        union = " UNION ALL ".join(f"SELECT * FROM ({side})" for side in sides)
+        deals, _ = await asyncio.to_thread(
+            self._load_deals, f"SELECT data FROM ({union}) {order}", (*args, limit)
+        )
+        return deals
+
+    async def user_status_counts(self, user_id: int) -> Dict[str, int]:
+        return await self._cached(("counts", user_id), self._status_counts, user_id)
+
+    async def chat(self, deal_id: str) -> List[ChatMessage] | None:
+        return await self._cached(("chat", deal_id), self._chat, deal_id)
+
+    def close(self) -> None:
+        with self._reader_guard:
+            self._reader.close()
+        with self._writer_guard:
+            self._writer.close()
+
+    async def _deals(self, column: str, value: Any) -> List[Deal]:
+        return await self._cached(
+            (column, value), self._load_deals, f"SELECT data FROM deals WHERE {column} = ?", (value,)
+        )
+
+    async def _cached(
+        self, key: tuple[str, Any], load: Callable[..., tuple[_T | None, int]], *args: Any
+    ) -> _T | None:
+        # ``load`` runs in a worker thread and returns the value and its size;
+        # None is not cached.
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        generation = self._generation
+        value, size = await asyncio.to_thread(load, *args)
+        if value is not None and generation == self._generation:
+            self._cache.put(key, value, size)
+        return value
+
+    def _query(self, sql: str, params: Iterable[Any]) -> List[tuple[Any, ...]]:
+        with self._reader_guard:
+            return self._reader.execute(sql, tuple(params)).fetchall()
+
+    def _load_deals(self, sql: str, params: Iterable[Any]) -> tuple[List[Deal], int]:
+        rows = self._query(sql, params)
+        deals = [Deal.from_dict(json.loads(data)) for (data,) in rows]
+        return deals, sum(len(data) for (data,) in rows)
+
+    def _stored(self, ids: List[str]) -> Dict[str, Deal]:
+        found: Dict[str, Deal] = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            rows = self._query(
+                f"SELECT id, data FROM deals WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for deal_id, data in rows:
+                found[deal_id] = Deal.from_dict(json.loads(data))
+        return found
+
+    def _status_counts(self, user_id: int) -> tuple[Dict[str, int], int]:
+        rows = self._query(
+            "SELECT json_extract(data, '$.status'), COUNT(*) FROM deals WHERE seller_id = ? "
+            "GROUP BY 1 "
+            "UNION ALL SELECT json_extract(data, '$.status'), COUNT(*) FROM deals "
+            "WHERE buyer_id = ? AND seller_id IS NOT ? GROUP BY 1",
+            (user_id, user_id, user_id),
+        )
+        counts: Dict[str, int] = {}
+        for status, count in rows:
+            counts[status] = counts.get(status, 0) + count
+        return counts, 64 * len(counts)
+
+    def _chat(self, deal_id: str) -> tuple[List[ChatMessage] | None, int]:
+        rows = self._query("SELECT chat FROM deals WHERE id = ?", (deal_id,))
+        if not rows or rows[0][0] is None:
+            return None, 0
+        return [ChatMessage.from_dict(item) for item in json.loads(rows[0][0])], len(rows[0][0])
+
+    def _insert(self, rows: List[tuple[Any, ...]]) -> None:
+        with self._writer_guard:
+            self._insert_locked(rows)
+
+    def _insert_locked(self, rows: List[tuple[Any, ...]]) -> None:
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            self._writer.executemany(
+                "INSERT OR REPLACE INTO deals "
+                "(id, public_id, seller_id, buyer_id, created_at, archived_at, data, chat) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
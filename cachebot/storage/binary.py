@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import struct
+import types
+from dataclasses import MISSING, fields
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterable, List, Mapping, Union, get_args, get_origin, get_type_hints
+
+from cachebot.models.advert import Advert
+from cachebot.models.balance_event import BalanceEvent
+from cachebot.models.chat import ChatMessage
+from cachebot.models.deal import Deal
+from cachebot.models.dispute import Dispute
+from cachebot.models.review import Review
+from cachebot.models.topup import Topup
+from cachebot.models.user import MerchantApplication, UserProfile
+from cachebot.storage.repository import StateRepository
+from cachebot.storage.state import SECTIONS, ChangeTracker, StorageState, collector_paused, decode_state
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CBSTATE\x01"
+_FRAME = struct.Struct(">HQ")
+_LENGTH = struct.Struct(">Q")
+
+
+class _Field:
+    """How one dataclass field is turned into a column and back."""
+
+    __slots__ = ("name", "kind", "type")
+
+    def __init__(self, name: str, hint: Any) -> None:
+        self.name = name
+        base = hint
+        if get_origin(hint) in (Union, types.UnionType):
+            options = [arg for arg in get_args(hint) if arg is not type(None)]
+            base = options[0] if len(options) == 1 else hint
+        self.type = base
+        if base is Decimal:
+            self.kind = "decimal"
+        elif base is datetime:
+            self.kind = "datetime"
+        elif isinstance(base, type) and issubclass(base, Enum):
+            self.kind = "enum"
+        elif base in (int, str, bool):
+            self.kind = "plain"
+        elif get_origin(base) is list and hasattr(get_args(base)[0], "from_dict"):
+            self.kind = "models"
+            self.type = get_args(base)[0]
+        else:
+            self.kind = "copy"
+
+    def converter(self) -> Callable[[Any], Any] | None:
+        # Turns a JSON value of the column back into the model value.
+        if self.kind == "decimal":
+            return Decimal
+        if self.kind == "datetime":
+            return datetime.fromisoformat
+        if self.kind == "enum":
+            return self.type
+        if self.kind == "models":
+            from_dict = self.type.from_dict
+            return lambda items: [from_dict(item) for item in items]
+        return None
+
+    def to_row(self, value: Any) -> Any:
+        # Row values must stay valid after the model changes, so mutable
+        # containers are copied and nested models are encoded right away.
+        if value is None:
+            return None
+        if self.kind == "models":
+            return [item.to_dict() for item in value]
+        if self.kind == "copy":
+            return json.loads(json.dumps(value))
+        return value
+
+
+class _Model:
+    """Columnar codec for a slots dataclass built positionally from its fields."""
+
+    def __init__(self, cls: type) -> None:
+        hints = get_type_hints(cls)
+        self.cls = cls
+        self.fields = [_Field(item.name, hints[item.name]) for item in fields(cls)]
+
+    def row(self, item: Any) -> tuple:
+        return tuple(spec.to_row(getattr(item, spec.name)) for spec in self.fields)
+
+    def encode(self, rows: List[tuple]) -> tuple[list, List[bytes]]:
+        columns = list(zip(*rows)) if rows else [() for _ in self.fields]
+        header: list = []
+        parts: List[bytes] = []
+        for spec, column in zip(self.fields, columns):
+            encoding, blobs = _encode_column(spec, column)
+            header.append([spec.name, encoding, [len(blob) for blob in blobs]])
+            parts.extend(blobs)
+        return header, parts
+
+    def decode(self, header: list, data: memoryview, count: int) -> tuple[List[Any], List[tuple]]:
+        offset = 0
+        values: List[List[Any]] = []
+        rows: List[List[Any]] = []
+        for spec, (name, encoding, sizes) in zip(self.fields, header):
+            if name != spec.name:
+                raise ValueError(f"Snapshot column {name} does not match {self.cls.__name__}.{spec.name}")
+            blobs = []
+            for size in sizes:
+                blobs.append(data[offset : offset + size])
+                offset += size
+            model_column, row_column = _decode_column(spec, encoding, blobs, count)
+            values.append(model_column)
+            rows.append(row_column)
+        # Fields added to the model after the snapshot was written.
+        for spec, item in zip(self.fields[len(header) :], fields(self.cls)[len(header) :]):
+            if item.default is not MISSING:
+                column = [item.default] * count
+            else:
+                column = [item.default_factory() for _ in range(count)]
+            values.append(column)
+            rows.append([spec.to_row(value) for value in column])
+        items = list(map(self.cls, *values)) if count else []
+        return items, list(zip(*rows)) if count else []
+
+
+def _encode_column(spec: _Field, column: Iterable[Any]) -> tuple[str, List[bytes]]:
+    if spec.kind == "decimal":
+        column = [None if value is None else str(value) for value in column]
+    elif spec.kind == "datetime":
+        column = [None if value is None else value.isoformat() for value in column]
+    elif spec.kind == "enum":
+        column = [None if value is None else value.value for value in column]
+    else:
+        column = list(column)
+    if spec.kind in ("plain", "decimal", "enum"):
+        # Dictionary encoding for repetitive columns (statuses, rates, banks):
+        # smaller on disk and every distinct value is built once on load.
+        distinct = list(dict.fromkeys(column))
+        if len(distinct) * 2 <= len(column) and len(distinct) < 2**32:
+            lookup = {value: index for index, value in enumerate(distinct)}
+            # Codes are little-endian uint32 whatever the host's layout.
+            index = struct.pack(f"<{len(column)}I", *map(lookup.__getitem__, column))
+            return "dict", [json.dumps(distinct).encode(), index]
+    return "json", [json.dumps(column).encode()]
+
+
+def _decode_column(
+    spec: _Field,
+    encoding: str,
+    blobs: List[memoryview],
+    count: int,
+) -> tuple[List[Any], List[Any]]:
+    convert = spec.converter()
+    if encoding == "dict":
+        distinct = json.loads(bytes(blobs[0]))
+        if convert is not None:
+            distinct = _converted(convert, distinct)
+        index = struct.unpack(f"<{count}I", blobs[1])
+        column = list(map(distinct.__getitem__, index))
+        return column, column
+    data = bytes(blobs[0])
+    raw = json.loads(data)
+    if len(raw) != count:
+        raise ValueError(f"Column {spec.name} has {len(raw)} values, expected {count}")
+    if spec.kind == "copy":
+        # Parsed twice so that models and encoded rows never share containers.
+        return json.loads(data), raw
+    if convert is None:
+        return raw, raw
+    column = _converted(convert, raw)
+    return column, raw if spec.kind == "models" else column
+
+
+def _converted(convert: Callable[[Any], Any], values: List[Any]) -> List[Any]:
+    if None in values:
+        return [None if value is None else convert(value) for value in values]
+    return list(map(convert, values))
+
+
+# Sections stored column by column; the rest are small and stay JSON.
+_MODELS: Dict[str, _Model] = {
+    "deals": _Model(Deal),
+    "balance_events": _Model(BalanceEvent),
+    "applications": _Model(MerchantApplication),
+    "reviews": _Model(Review),
+    "disputes": _Model(Dispute),
+    "adverts": _Model(Advert),
+    "topups": _Model(Topup),
+    "profiles": _Model(UserProfile),
+    "chats": _Model(ChatMessage),
+}
+
+
+def _chat_row(messages: List[ChatMessage]) -> tuple:
+    row = _MODELS["chats"].row
+    return tuple(row(message) for message in messages)
+
+
+ROW_ENCODERS: Dict[str, Callable[[Any], Any]] = {
+    name: (_chat_row if name == "chats" else model.row) for name, model in _MODELS.items()
+}
+
+
+def _encode_section(name: str, part: Any) -> bytes:
+    section = SECTIONS[name]
+    model = _MODELS.get(name)
+    if model is None:
+        if section.kind == "list":
+            value = part[1]
+        elif section.kind == "map":
+            value = dict(zip(*part))
+        else:
+            value = part
+        return b"J" + json.dumps(value).encode()
+    keys, rows = part
+    meta: Dict[str, Any] = {}
+    if name == "chats":
+        meta["keys"] = keys
+        meta["counts"] = [len(messages) for messages in rows]
+        rows = [message for messages in rows for message in messages]
+    elif section.kind == "map":
+        meta["keys"] = keys
+    meta["count"] = len(rows)
+    meta["columns"], blobs = model.encode(rows)
+    header = json.dumps(meta).encode()
+    return b"".join((b"C", _LENGTH.pack(len(header)), header, *blobs))
+
+
+def _decode_section(name: str, payload: memoryview) -> tuple[Any, Any]:
+    # Returns the state value and the encoded records for the change tracker.
+    section = SECTIONS[name]
+    if payload[:1] == b"J":
+        raw = json.loads(bytes(payload[1:]))
+        return section.decode(raw), raw
+    (size,) = _LENGTH.unpack_from(payload, 1)
+    start = 1 + _LENGTH.size
+    meta = json.loads(bytes(payload[start : start + size]))
+    items, rows = _MODELS[name].decode(meta["columns"], payload[start + size :], meta["count"])
+    if section.kind == "list":
+        return items, rows
+    if name == "chats":
+        value: Dict[Any, Any] = {}
+        seed: Dict[str, Any] = {}
+        offset = 0
+        for key, count in zip(meta["keys"], meta["counts"]):
+            value[key] = items[offset : offset + count]
+            seed[key] = tuple(rows[offset : offset + count])
+            offset += count
+        return value, seed
+    keys = meta["keys"]
+    return dict(zip(map(int, keys), items)), dict(zip(keys, rows))
+
+
+def read_snapshot(handle: IO[bytes]) -> tuple[StorageState, dict[str, Any]]:
+    if handle.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary state snapshot")
+    values: Dict[str, Any] = {}
+    seed: Dict[str, Any] = {}
+    while True:
+        head = handle.read(_FRAME.size)
+        if not head:
+            break
+        name_size, payload_size = _FRAME.unpack(head)
+        name = handle.read(name_size).decode()
+        payload = memoryview(handle.read(payload_size))
+        if name in SECTIONS:
+            values[name], seed[name] = _decode_section(name, payload)
+    state = decode_state({})
+    for name, value in values.items():
+        setattr(state, name, value)
+    return state, seed
+
+
+class _BinarySnapshotEncoder:
+    """Writer-thread side: keeps encoded frames of clean sections."""
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self._names = tuple(names)
+        self._frames: Dict[str, bytes] = {}
+
+    def update(self, parts: Mapping[str, Any]) -> None:
+        for name, part in parts.items():
+            payload = _encode_section(name, part)
+            encoded_name = name.encode()
+            self._frames[name] = _FRAME.pack(len(encoded_name), len(payload)) + encoded_name + payload
+
+    def write(self, handle: IO[bytes]) -> None:
+        handle.write(MAGIC)
+        for name in self._names:
+            frame = self._frames.get(name)
+            if frame is not None:
+                handle.write(frame)
+
+
+class BinaryStateRepository(StateRepository):
+    """Keeps the state in a compact columnar snapshot (``state.bin``).
+
+    Entity sections are stored column by column with dictionary-encoded
+    repetitive values and rebuilt with positional constructors, which skips
+    the per-record ``from_dict`` work of the JSON format.  A ``state.json``
+    found on first start is converted once.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        legacy_path: Path | None = None,
+        commit_window: float = 0.0,
+    ) -> None:
+        self._legacy_path = legacy_path
+        super().__init__(path, commit_window)
+        self._snapshot_encoder = _BinarySnapshotEncoder(self._sections)
+        if not self._path.exists():
+            self._write_snapshot(self._stale_parts_locked())
+
+    def _load(self) -> tuple[StorageState, ChangeTracker]:
+        if self._path.exists():
+            with collector_paused(), self._path.open("rb") as handle:
+                state, seed = read_snapshot(handle)
+            return state, ChangeTracker(state, seed, ROW_ENCODERS)
+        raw: dict[str, Any] = {}
+        legacy = self._legacy_path
+        if legacy is not None and legacy.exists():
+            logger.info("Converting %s into %s", legacy, self._path)
+            raw = json.loads(legacy.read_text(encoding="utf-8"))
+        state = decode_state(raw)
+        seed = {name: raw.get(name) for name in SECTIONS}
+        for name, encoder in ROW_ENCODERS.items():
+            value = getattr(state, name)
+            if SECTIONS[name].kind == "list":
+                seed[name] = [encoder(item) for item in value]
+            else:
+                seed[name] = {str(key): encoder(item) for key, item in value.items()}
+        return state, ChangeTracker(state, seed, ROW_ENCODERS)
+
+    def _write_snapshot(self, parts: Mapping[str, Any]) -> None:
+        self._snapshot_encoder.update(parts)
+        tmp = self._path.with_suffix(".tmp")
+        with tmp.open("wb") as handle:
+            self._snapshot_encoder.write(handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        tmp.replace(self._path)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from cachebot import metrics
+from cachebot.storage.state import DELETED, Section
+
+# ``reader(section, field, value)`` returns stored rows as ``(key, json)``;
+# ``field`` is None for a lookup by key.
+Reader = Callable[[str, Optional[str], Any], List[tuple[str, str]]]
+
+
+class ColdCache:
+    """LRU of decoded cold rows shared by all lazy sections.
+
+    Entries are weighed by the length of their stored JSON, a cheap stand-in
+    for the memory the decoded records take.
+    """
+
+    def __init__(self, budget: int, metric: str = "storage.cold_cache") -> None:
+        self._budget = budget
+        self._entries: OrderedDict[tuple[Any, ...], tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        self._hits = metrics.counter(f"{metric}_hits")
+        self._misses = metrics.counter(f"{metric}_misses")
+
+    def get(self, key: tuple[Any, ...]) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses.inc()
+            return None
+        self._entries.move_to_end(key)
+        self._hits.inc()
+        return entry[0]
+
+    def put(self, key: tuple[Any, ...], value: Any, size: int) -> None:
+        self.discard(key)
+        if size > self._budget:
+            return
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self._budget:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+
+    def discard(self, key: tuple[Any, ...]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+
+class ColdSection:
+    """Lookups over the records of a section that may exist only on disk.
+
+    ``hot`` arguments are the records the caller keeps in memory; they win
+    over stored rows with the same key.  Without a reader every record is hot
+    and lookups only look at ``hot``.
+    """
+
+    def __init__(
+        self,
+        section: Section,
+        reader: Reader | None = None,
+        cache: ColdCache | None = None,
+    ) -> None:
+        self._section = section
+        self._reader = reader
+        self._cache = cache
+        # Rows deleted in memory whose removal may not be committed yet.
+        self._deleted: set[str] = set()
+
+    def get(self, key: str) -> Any | None:
+        rows = self._rows(None, key)
+        return rows[0][1] if rows else None
+
+    def select(self, field: str, value: Any, hot: Iterable[Any] = ()) -> List[Any]:
+        # Stored rows come first: they are older than anything kept in memory.
+        hot_keys: set[str] = set()
+        matches: List[Any] = []
+        for item in hot:
+            hot_keys.add(self._section.key_of(item))
+            if getattr(item, field) == value:
+                matches.append(item)
+        stored = [item for key, item in self._rows(field, value) if key not in hot_keys]
+        return stored + matches
+
+    def select_many(
+        self, field: str, values: Iterable[Any], hot: Iterable[Any] = ()
+    ) -> Dict[Any, List[Any]]:
+        # ``select`` for several values with a single pass over ``hot``.
+        wanted = set(values)
+        hot_keys: set[str] = set()
+        hot_matches: Dict[Any, List[Any]] = {}
+        for item in hot:
+            hot_keys.add(self._section.key_of(item))
+            value = getattr(item, field)
+            if value in wanted:
+                hot_matches.setdefault(value, []).append(item)
+        result: Dict[Any, List[Any]] = {}
+        for value in wanted:
+            stored = [item for key, item in self._rows(field, value) if key not in hot_keys]
+            matches = stored + hot_matches.get(value, [])
+            if matches:
+                result[value] = matches
+        return result
+
+    def changed(self, diff: Iterable[tuple[str | None, Any]]) -> None:
+        # Called with every diff of the section before it is written.
+        name = self._section.name
+        for key, encoded in diff:
+            if key is None:
+                continue
+            if encoded is DELETED:
+                self._deleted.add(key)
+            else:
+                self._deleted.discard(key)
+            if self._cache is not None:
+                self._cache.discard((name, None, key))
+
+    def _rows(self, field: str | None, value: Any) -> List[tuple[str, Any]]:
+        if self._reader is None or self._cache is None:
+            return []
+        name = self._section.name
+        rows = self._cache.get((name, field, value))
+        if rows is None:
+            stored = self._reader(name, field, value)
+            rows = [(key, self._section.decode_item(json.loads(data))) for key, data in stored]
+            self._cache.put((name, field, value), rows, sum(len(data) for _, data in stored))
+        if not self._deleted:
+            return rows
+        return [row for row in rows if row[0] not in self._deleted]
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, List
+
+
+@dataclass(slots=True)
+class InboxEvent:
+    key: str
+    payload: dict[str, Any]
+    received_at: datetime
+    attempts: int = 0
+
+
+class WebhookInbox:
+    """SQLite journal of accepted webhook events.
+
+    An event is written once under its key and stays pending until it is
+    marked processed or dead; processed rows are kept for a while so that a
+    late replay of the same event is still recognised.  A failed event waits
+    until its ``retry_at`` and is skipped by ``pending`` meanwhile, so it does
+    not hold back newer events.  Every call that touches the database runs
+    in a worker thread.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Reads and writes have their own connection.  Each is used under its
+        # own lock, which ``close`` takes too, so a read or write still running
+        # in a worker thread after its caller was cancelled is never cut off.
+        self._reader_guard = threading.Lock()
+        self._writer_guard = threading.Lock()
+        self._reader = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                received_at TEXT NOT NULL,
+                processed_at TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                retry_at TEXT,
+                dead_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_pending ON events (processed_at, seq);
+            """
+        )
+        for column in ("retry_at", "dead_at"):
+            try:
+                self._reader.execute(f"ALTER TABLE events ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                pass
+        self._writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=FULL")
+        self._write_lock = asyncio.Lock()
+        self._queued: List[tuple[tuple[str, str, str], asyncio.Future[bool]]] = []
+        self._flusher: asyncio.Task[None] | None = None
+
+    async def add(self, key: str, payload: dict[str, Any]) -> bool:
+        # False when an event with this key is already in the inbox.  Events
+        # arriving while a write is in flight are committed together with the
+        # next one, so concurrent webhooks share a single fsync.
+        row = (key, json.dumps(payload, ensure_ascii=False), datetime.now(timezone.utc).isoformat())
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        self._queued.append((row, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        while self._queued:
+            batch, self._queued = self._queued, []
+            try:
+                async with self._write_lock:
+                    added = await asyncio.to_thread(self._insert, [row for row, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, added):
+                if not future.done():
+                    future.set_result(result)
+
+    async def pending(self, limit: int, now: datetime) -> List[InboxEvent]:
+        # Events due at ``now`` in arrival order; dead and backing-off ones are skipped.
+        rows = await self._read(
+            "SELECT key, payload, received_at, attempts FROM events "
+            "WHERE processed_at IS NULL AND dead_at IS NULL "
+            "AND (retry_at IS NULL OR retry_at <= ?) ORDER BY seq LIMIT ?",
+            (now.isoformat(), limit),
+        )
+        return [
+            InboxEvent(key, json.loads(payload), datetime.fromisoformat(received_at), attempts)
+            for key, payload, received_at, attempts in rows
+        ]
+
+    async def next_retry_at(self) -> datetime | None:
+        ((retry_at,),) = await self._read(
+            "SELECT MIN(retry_at) FROM events WHERE processed_at IS NULL AND dead_at IS NULL",
+            (),
+        )
+        return datetime.fromisoformat(retry_at) if retry_at else None
+
+    async def pending_count(self) -> int:
+        ((count,),) = await self._read(
+            "SELECT COUNT(*) FROM events WHERE processed_at IS NULL AND dead_at IS NULL", ()
+        )
+        return count
+
+    async def dead_count(self) -> int:
+        ((count,),) = await self._read(
+            "SELECT COUNT(*) FROM events WHERE processed_at IS NULL AND dead_at IS NOT NULL", ()
+        )
+        return count
+
+    async def recent_keys(self, limit: int) -> List[str]:
+        rows = await self._read("SELECT key FROM events ORDER BY seq DESC LIMIT ?", (limit,))
+        return [key for (key,) in reversed(rows)]
+
+    async def mark_processed(self, keys: Iterable[str]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        rows = [(now, key) for key in keys]
+        if not rows:
+            return
+        async with self._write_lock:
+            await asyncio.to_thread(
+                self._execute_many,
+                "UPDATE events SET processed_at = ?, error = NULL WHERE key = ?",
+                rows,
+            )
+
+    async def note_failure(self, key: str, error: str, retry_at: datetime) -> None:
+        async with self._write_lock:
+            await asyncio.to_thread(
+                self._execute_many,
+                "UPDATE events SET attempts = attempts + 1, error = ?, retry_at = ? WHERE key = ?",
+                [(error, retry_at.isoformat(), key)],
+            )
+
+    async def mark_dead(self, key: str, error: str) -> None:
+        # The event stays unprocessed for an operator but is no longer retried.
+        now = datetime.now(timezone.utc).isoformat()
+        async with self._write_lock:
+            await asyncio.to_thread(
+                self._execute_many,
+                "UPDATE events SET attempts = attempts + 1, error = ?, dead_at = ? WHERE key = ?",
+                [(error, now, key)],
+            )
+
+    async def prune(self, before: datetime) -> None:
+        async with self._write_lock:
+            await asyncio.to_thread(
+                self._execute_many,
+                "DELETE FROM events WHERE processed_at IS NOT NULL AND processed_at < ?",
+                [(before.isoformat(),)],
+            )
+
+    def close(self) -> None:
+        with self._reader_guard:
+            self._reader.close()
+        with self._writer_guard:
+            self._writer.close()
+
+    async def _read(self, sql: str, params: tuple[Any, ...]) -> List[tuple[Any, ...]]:
+        return await asyncio.to_thread(self._fetch, sql, params)
+
+    def _fetch(self, sql: str, params: tuple[Any, ...]) -> List[tuple[Any, ...]]:
+        with self._reader_guard:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _insert(self, rows: List[tuple[str, str, str]]) -> List[bool]:
+        with self._writer_guard:
+            return self._insert_locked(rows)
+
+    def _insert_locked(self, rows: List[tuple[str, str, str]]) -> List[bool]:
+        added: List[bool] = []
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            for row in rows:
+                cursor = self._writer.execute(
+                    "INSERT OR IGNORE INTO events (key, payload, received_at) VALUES (?, ?, ?)",
+                    row,
+                )
+                added.append(cursor.rowcount == 1)
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
+        return added
+
+    def _execute_many(self, sql: str, rows: List[tuple[Any, ...]]) -> None:
+        with self._writer_guard:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(sql, rows)
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Mapping
+
+from cachebot.storage.repository import StateRepository
+from cachebot.storage.state import DELETED, SECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStateRepository(StateRepository):
+    """Keeps ``state.json`` as a snapshot and appends every mutation to a journal.
+
+    Each commit is a single JSON line ``{"ops": [...]}`` holding only the records
+    that differ from what is already on disk, so the cost of a write follows the
+    size of the change.  ``compact`` folds the journal back into the snapshot.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        commit_window: float = 0.0,
+        sections: Iterable[str] | None = None,
+    ) -> None:
+        self._journal_path = path.with_suffix(".journal")
+        super().__init__(path, commit_window, sections)
+        self._journal = self._journal_path.open("a", encoding="utf-8")
+        self._journal_bytes = self._journal_path.stat().st_size
+
+    @property
+    def journal_bytes(self) -> int:
+        return self._journal_bytes
+
+    async def compact(self, min_bytes: int = 1) -> bool:
+        async with self._lock:
+            self._flush_locked()
+            done = self._in_writer(partial(self._compact, self._stale_parts_locked(), min_bytes))
+        return await done
+
+    def close(self) -> None:
+        super().close()
+        self._journal.close()
+
+    def _prepare_locked(
+        self,
+        sections: Iterable[str],
+        touched: Mapping[str, Iterable[str]],
+    ) -> Callable[[], None] | None:
+        ops: list[dict[str, Any]] = []
+        for name, diff in self._diff_locked(sections, touched):
+            for key, encoded in diff:
+                if key is None:
+                    ops.append({"s": name, "v": encoded})
+                elif encoded is DELETED:
+                    ops.append({"s": name, "k": key, "d": 1})
+                else:
+                    ops.append({"s": name, "k": key, "v": encoded})
+        if not ops:
+            return None
+        return partial(self._append, ops)
+
+    def _append(self, ops: list[dict[str, Any]]) -> None:
+        line = json.dumps({"ops": ops}, separators=(",", ":"), ensure_ascii=False) + "\n"
+        self._journal.write(line)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_bytes += len(line.encode("utf-8"))
+
+    def _compact(self, parts: Mapping[str, Any], min_bytes: int) -> bool:
+        if self._journal_bytes < min_bytes:
+            self._snapshot_encoder.update(parts)
+            return False
+        self._write_snapshot(parts)
+        self._journal.close()
+        self._journal = self._journal_path.open("w", encoding="utf-8")
+        self._journal_bytes = 0
+        return True
+
+    def _load_raw(self) -> dict[str, Any]:
+        raw = self._read_snapshot()
+        if self._journal_path.exists():
+            self._replay(raw)
+        return raw
+
+    def _replay(self, raw: dict[str, Any]) -> None:
+        expanded: Dict[str, Dict[str, Any]] = {}
+        valid_bytes = 0
+        commits = 0
+        with self._journal_path.open("rb") as handle:
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                for op in record.get("ops", []):
+                    _apply(raw, expanded, op)
+                valid_bytes += len(line)
+                commits += 1
+        for name, items in expanded.items():
+            raw[name] = list(items.values()) if SECTIONS[name].kind == "list" else items
+        if valid_bytes != self._journal_path.stat().st_size:
+            logger.warning("Dropping torn tail of %s after %s commits", self._journal_path, commits)
+            with self._journal_path.open("r+b") as handle:
+                handle.truncate(valid_bytes)
+        if commits:
+            logger.info("Replayed %s journal commits from %s", commits, self._journal_path)
+
+
+def _apply(raw: dict[str, Any], expanded: Dict[str, Dict[str, Any]], op: dict[str, Any]) -> None:
+    name = op.get("s")
+    section = SECTIONS.get(name)
+    if not section:
+        return
+    if section.kind == "value":
+        raw[name] = op.get("v")
+        return
+    items = expanded.get(name)
+    if items is None:
+        current = raw.get(name)
+        if section.kind == "list":
+            items = {section.raw_key_of(item): item for item in current or []}
+        else:
+            items = dict(current or {})
+        expanded[name] = items
+    if op.get("d"):
+        items.pop(op["k"], None)
+    else:
+        items[op["k"]] = op["v"]
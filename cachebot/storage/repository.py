@@ -2,160 +2,117 @@ from __future__ import annotations
 
 import asyncio
 import json
-from dataclasses import dataclass
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from decimal import Decimal
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Mapping
 
+from cachebot import metrics
 from cachebot.models.advert import Advert
 from cachebot.models.balance_event import BalanceEvent
 from cachebot.models.chat import ChatMessage
 from cachebot.models.deal import Deal
 from cachebot.models.dispute import Dispute
+from cachebot.models.payout import Payout
 from cachebot.models.review import Review
 from cachebot.models.user import MerchantApplication, UserProfile
 from cachebot.models.topup import Topup
-
-
-@dataclass(slots=True)
-class RateSettings:
-    usd_rate: Decimal
-    fee_percent: Decimal
-    buyer_fee_percent: Decimal
-    withdraw_fee_percent: Decimal
-    transfer_fee_percent: Decimal = Decimal("2.0")
-
-    def to_dict(self) -> dict[str, str]:
-        return {
-            "usd_rate": str(self.usd_rate),
-            "fee_percent": str(self.fee_percent),
-            "buyer_fee_percent": str(self.buyer_fee_percent),
-            "withdraw_fee_percent": str(self.withdraw_fee_percent),
-            "transfer_fee_percent": str(self.transfer_fee_percent),
-        }
-
-    @classmethod
-    def from_dict(cls, data: dict[str, str]) -> "RateSettings":
-        fee_percent = Decimal(data["fee_percent"])
-        buyer_fee_percent = Decimal(data.get("buyer_fee_percent", fee_percent))
-        return cls(
-            usd_rate=Decimal(data["usd_rate"]),
-            fee_percent=fee_percent,
-            buyer_fee_percent=buyer_fee_percent,
-            withdraw_fee_percent=Decimal(data.get("withdraw_fee_percent", "2.5")),
-            transfer_fee_percent=Decimal(data.get("transfer_fee_percent", "2.0")),
-        )
-
-
-@dataclass(slots=True)
-class StorageState:
-    deals: List[Deal]
-    balances: Dict[int, Decimal]
-    balance_events: List[BalanceEvent]
-    settings: Optional[RateSettings]
-    user_roles: Dict[int, str]
-    applications: List[MerchantApplication]
-    profiles: Dict[int, UserProfile]
-    reviews: List[Review]
-    disputes: List[Dispute]
-    adverts: List[Advert]
-    topups: List[Topup]
-    chats: Dict[str, List[ChatMessage]]
-    deal_sequence: int
-    advert_sequence: int
-    merchant_since: Dict[int, str]
-    p2p_trading_enabled: Dict[int, bool]
-    admins: List[int]
-    moderators: List[int]
-    user_warnings: Dict[int, int]
-    user_bans: List[int]
-    user_deal_blocks: List[int]
-    user_ban_until: Dict[int, str]
-    user_deal_block_until: Dict[int, str]
-    admin_actions: List[dict]
+from cachebot.storage.cold import ColdSection
+from cachebot.storage.state import (
+    SECTIONS,
+    ChangeTracker,
+    RateSettings,
+    StorageState,
+    decode_state,
+)
 
 
 class StateRepository:
-    def __init__(self, path: Path) -> None:
+    def __init__(
+        self,
+        path: Path,
+        commit_window: float = 0.0,
+        sections: Iterable[str] | None = None,
+    ) -> None:
         self._path = path
+        # Sections stored in this file; the rest stay at their defaults.
+        self._sections = tuple(sections) if sections is not None else tuple(SECTIONS)
         self._lock = asyncio.Lock()
+        # Group commit: updates made within ``commit_window`` seconds of each
+        # other are written together and acknowledged by one shared future.
+        self._commit_window = commit_window
+        self._commit: asyncio.Future[None] | None = None
+        self._flusher: asyncio.Task[None] | None = None
+        self._pending_sections: Dict[str, None] = {}
+        # Kept in order: keys written by key land in the file in that order.
+        self._pending_touched: Dict[str, Dict[str, None]] = {}
+        self._pending_updates = 0
+        # Live containers of the sections written by key (``_update_keys``).
+        self._live: Dict[str, Any] = {}
+        self._batch_size = metrics.histogram("storage.commit_batch_size", metrics.SIZE_BUCKETS)
+        self._flush_latency = metrics.histogram("storage.flush_ms")
+        self._prepare_latency = metrics.histogram("storage.prepare_ms")
+        # Serialization and fsync run here; a single worker keeps writes in
+        # the order they were prepared.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-writer")
+        self._snapshot_encoder = _SnapshotEncoder(self._sections)
+        self._stale_sections: set[str] = set(self._sections)
         self._path.parent.mkdir(parents=True, exist_ok=True)
-        self._state = self._load()
+        self._state, self._tracker = self._load()
 
     def snapshot(self) -> StorageState:
         return self._state
 
+    def cold(self, name: str) -> ColdSection:
+        # Records of ``name`` that are not part of ``snapshot()``; every record
+        # is kept in memory here, so lookups only look at what callers hold.
+        return ColdSection(SECTIONS[name])
+
     async def replace_state(self, state: StorageState) -> None:
         async with self._lock:
+            self._use_whole_locked(self._sections)
             self._state = state
-            self._write_locked()
+            commit = self._enqueue_locked(self._sections, {})
+        await asyncio.shield(commit)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._flush_locked()
+        await self._in_writer(_noop)
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
 
     async def persist_deals_and_balances(
         self,
-        deals: List[Deal],
+        deals: Mapping[str, Deal],
         balances: Dict[int, Decimal],
-        deal_sequence: int | None = None,
-        balance_events: List[BalanceEvent] | None = None,
+        deal_sequence: int,
+        balance_events: List[BalanceEvent],
+        payouts: Mapping[str, Payout],
+        *,
+        changed: Mapping[str, Iterable[str]],
     ) -> None:
-        async with self._lock:
-            sequence = self._state.deal_sequence if deal_sequence is None else deal_sequence
-            self._state = StorageState(
-                deals=deals,
-                balances=balances,
-                balance_events=balance_events or self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        # The deal service's own containers; ``changed`` holds the keys written
+        # since the last call, by section, and the other records are skipped.
+        sections = {
+            "deals": deals,
+            "balances": balances,
+            "balance_events": balance_events,
+            "payouts": payouts,
+        }
+        await self._update_keys(
+            changed,
+            deal_sequence=deal_sequence,
+            **{name: sections[name] for name in changed},
+        )
 
     async def persist_settings(self, settings: RateSettings) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        await self._update(settings=settings)
 
     async def persist_user_data(
         self,
@@ -171,124 +128,31 @@ class StateRepository:
         user_ban_until: Dict[int, str],
         user_deal_block_until: Dict[int, str],
     ) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=roles,
-                applications=applications,
-                profiles=profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=admins,
-                moderators=moderators,
-                user_warnings=user_warnings,
-                user_bans=user_bans,
-                user_deal_blocks=user_deal_blocks,
-                user_ban_until=user_ban_until,
-                user_deal_block_until=user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        await self._update(
+            user_roles=roles,
+            applications=applications,
+            profiles=profiles,
+            merchant_since=merchant_since,
+            moderators=moderators,
+            admins=admins,
+            user_warnings=user_warnings,
+            user_bans=user_bans,
+            user_deal_blocks=user_deal_blocks,
+            user_ban_until=user_ban_until,
+            user_deal_block_until=user_deal_block_until,
+        )
+
+    async def persist_profiles(self, profiles: Dict[int, UserProfile]) -> None:
+        await self._update(profiles=profiles)
 
     async def persist_admin_actions(self, actions: List[dict]) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=actions,
-            )
-            self._write_locked()
+        await self._update(admin_actions=actions)
 
     async def persist_reviews(self, reviews: List[Review]) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        await self._update(reviews=reviews)
 
     async def persist_disputes(self, disputes: List[Dispute]) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        await self._update(disputes=disputes)
 
     async def persist_adverts(
         self,
@@ -296,236 +160,220 @@ class StateRepository:
         advert_sequence: int,
         p2p_trading_enabled: Dict[int, bool],
     ) -> None:
-        async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=adverts,
-                topups=self._state.topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
+        await self._update(
+            adverts=adverts,
+            advert_sequence=advert_sequence,
+            p2p_trading_enabled=p2p_trading_enabled,
+        )
 
     async def persist_topups(self, topups: List[Topup]) -> None:
+        await self._update(topups=topups)
+
+    async def persist_chats(
+        self,
+        chats: Dict[str, List[ChatMessage]],
+        *,
+        changed: Iterable[str] = (),
+    ) -> None:
+        # ``changed`` lists deal ids whose message lists were appended to in place.
+        await self._update({"chats": changed}, chats=chats)
+
+    async def _update(
+        self,
+        touched: Mapping[str, Iterable[str]] | None = None,
+        **sections: Any,
+    ) -> None:
         async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=topups,
-                chats=self._state.chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
-
-    async def persist_chats(self, chats: Dict[str, List[ChatMessage]]) -> None:
+            self._use_whole_locked(sections)
+            self._state = replace(self._state, **sections)
+            commit = self._enqueue_locked(sections.keys(), touched or {})
+        await asyncio.shield(commit)
+
+    async def _update_keys(
+        self,
+        changed: Mapping[str, Iterable[str]],
+        **sections: Any,
+    ) -> None:
+        # For sections kept by one service in live containers (see
+        # ``ChangeTracker.diff_keys``): only the ``changed`` keys are diffed,
+        # and ``snapshot()`` keeps the value they were loaded with.
         async with self._lock:
-            self._state = StorageState(
-                deals=self._state.deals,
-                balances=self._state.balances,
-                balance_events=self._state.balance_events,
-                settings=self._state.settings,
-                user_roles=self._state.user_roles,
-                applications=self._state.applications,
-                profiles=self._state.profiles,
-                reviews=self._state.reviews,
-                disputes=self._state.disputes,
-                adverts=self._state.adverts,
-                topups=self._state.topups,
-                chats=chats,
-                deal_sequence=self._state.deal_sequence,
-                advert_sequence=self._state.advert_sequence,
-                merchant_since=self._state.merchant_since,
-                p2p_trading_enabled=self._state.p2p_trading_enabled,
-                admins=self._state.admins,
-                moderators=self._state.moderators,
-                user_warnings=self._state.user_warnings,
-                user_bans=self._state.user_bans,
-                user_deal_blocks=self._state.user_deal_blocks,
-                user_ban_until=self._state.user_ban_until,
-                user_deal_block_until=self._state.user_deal_block_until,
-                admin_actions=self._state.admin_actions,
-            )
-            self._write_locked()
-
-    def _write_locked(self) -> None:
-        payload = {
-            "deals": [deal.to_dict() for deal in self._state.deals],
-            "balances": {str(uid): str(amount) for uid, amount in self._state.balances.items()},
-            "balance_events": [event.to_dict() for event in self._state.balance_events],
-            "settings": self._state.settings.to_dict() if self._state.settings else None,
-            "user_roles": {str(uid): role for uid, role in self._state.user_roles.items()},
-            "applications": [app.to_dict() for app in self._state.applications],
-            "profiles": {
-                str(uid): profile.to_dict() for uid, profile in self._state.profiles.items()
-            },
-            "reviews": [review.to_dict() for review in self._state.reviews],
-            "disputes": [dispute.to_dict() for dispute in self._state.disputes],
-            "adverts": [advert.to_dict() for advert in self._state.adverts],
-            "topups": [topup.to_dict() for topup in self._state.topups],
-            "chats": {
-                deal_id: [msg.to_dict() for msg in messages]
-                for deal_id, messages in self._state.chats.items()
-            },
-            "deal_sequence": self._state.deal_sequence,
-            "advert_sequence": self._state.advert_sequence,
-            "merchant_since": self._state.merchant_since,
-            "p2p_trading_enabled": {
-                str(uid): enabled for uid, enabled in self._state.p2p_trading_enabled.items()
-            },
-            "admins": list(self._state.admins),
-            "moderators": list(self._state.moderators),
-            "user_warnings": {str(uid): count for uid, count in self._state.user_warnings.items()},
-            "user_bans": list(self._state.user_bans),
-            "user_deal_blocks": list(self._state.user_deal_blocks),
-            "user_ban_until": {
-                str(uid): value for uid, value in self._state.user_ban_until.items()
-            },
-            "user_deal_block_until": {
-                str(uid): value for uid, value in self._state.user_deal_block_until.items()
-            },
-            "admin_actions": list(self._state.admin_actions),
-        }
+            if any(name in self._pending_sections and name not in self._live for name in sections):
+                # One commit diffs a section either whole or by key.
+                self._flush_locked()
+            self._live.update(sections)
+            commit = self._enqueue_locked(sections.keys(), changed)
+        await asyncio.shield(commit)
+
+    def _use_whole_locked(self, sections: Iterable[str]) -> None:
+        names = [name for name in sections if name in self._live]
+        if not names:
+            return
+        if any(name in self._pending_sections for name in names):
+            self._flush_locked()
+        for name in names:
+            del self._live[name]
+
+    def _enqueue_locked(
+        self,
+        sections: Iterable[str],
+        touched: Mapping[str, Iterable[str]],
+    ) -> asyncio.Future[None]:
+        for name in sections:
+            self._pending_sections[name] = None
+        for name, keys in touched.items():
+            self._pending_touched.setdefault(name, {}).update(dict.fromkeys(keys))
+        self._pending_updates += 1
+        if self._commit is None:
+            self._commit = asyncio.get_running_loop().create_future()
+            self._flusher = asyncio.create_task(self._flush_later())
+        return self._commit
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._commit_window)
+        async with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        commit = self._commit
+        if commit is None:
+            return
+        sections = list(self._pending_sections)
+        touched = self._pending_touched
+        self._batch_size.observe(self._pending_updates)
+        self._commit = None
+        self._pending_sections = {}
+        self._pending_touched = {}
+        self._pending_updates = 0
+        started = time.perf_counter()
+        try:
+            job = self._prepare_locked(sections, touched) or _noop
+        except Exception as exc:
+            commit.set_exception(exc)
+            return
+        self._prepare_latency.observe((time.perf_counter() - started) * 1000)
+        done = self._in_writer(job)
+        done.add_done_callback(partial(self._committed, commit, started))
+
+    def _committed(
+        self,
+        commit: asyncio.Future[None],
+        started: float,
+        done: asyncio.Future[None],
+    ) -> None:
+        self._flush_latency.observe((time.perf_counter() - started) * 1000)
+        error = done.exception()
+        if error is not None:
+            commit.set_exception(error)
+        else:
+            commit.set_result(None)
+
+    def _in_writer(self, job: Callable[[], None]) -> asyncio.Future[None]:
+        return asyncio.get_running_loop().run_in_executor(self._writer, job)
+
+    def _prepare_locked(
+        self,
+        sections: Iterable[str],
+        touched: Mapping[str, Iterable[str]],
+    ) -> Callable[[], None] | None:
+        # Runs on the event loop: brings the encoded cache up to date and
+        # returns the blocking part of the write for the writer thread.
+        self._diff_locked(sections, touched)
+        parts = self._stale_parts_locked()
+        return partial(self._write_snapshot, parts) if parts else None
+
+    def _diff_locked(
+        self,
+        sections: Iterable[str],
+        touched: Mapping[str, Iterable[str]],
+    ) -> list[tuple[str, list[tuple[str | None, Any]]]]:
+        changes = []
+        for name in sections:
+            keys = touched.get(name, ())
+            if name in self._live:
+                diff = self._tracker.diff_keys(name, self._live[name], keys)
+            else:
+                diff = self._tracker.diff(name, getattr(self._state, name), keys)
+            if diff:
+                self._stale_sections.add(name)
+                changes.append((name, diff))
+        return changes
+
+    def _stale_parts_locked(self) -> dict[str, Any]:
+        # Sections whose snapshot text is out of date; clean ones are reused
+        # by the writer as already-encoded fragments.
+        parts = {name: self._tracker.items(name) for name in self._stale_sections}
+        self._stale_sections = set()
+        return parts
+
+    def _write_snapshot(self, parts: Mapping[str, Any]) -> None:
+        self._snapshot_encoder.update(parts)
         tmp = self._path.with_suffix(".tmp")
-        tmp.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        with tmp.open("w", encoding="utf-8") as handle:
+            handle.write(self._snapshot_encoder.render())
+            handle.flush()
+            os.fsync(handle.fileno())
         tmp.replace(self._path)
 
-    def _load(self) -> StorageState:
+    def _read_snapshot(self) -> dict[str, Any]:
         if not self._path.exists():
-            return StorageState(
-                deals=[],
-                balances={},
-                balance_events=[],
-                settings=None,
-                user_roles={},
-                applications=[],
-                profiles={},
-                reviews=[],
-                disputes=[],
-                adverts=[],
-                topups=[],
-                chats={},
-                deal_sequence=0,
-                advert_sequence=0,
-                merchant_since={},
-                p2p_trading_enabled={},
-                admins=[],
-                moderators=[],
-                user_warnings={},
-                user_bans=[],
-                user_deal_blocks=[],
-                user_ban_until={},
-                user_deal_block_until={},
-                admin_actions=[],
-            )
-        raw = json.loads(self._path.read_text(encoding="utf-8"))
-        deals = [Deal.from_dict(item) for item in raw.get("deals", [])]
-        balances = {
-            int(uid): Decimal(amount) for uid, amount in (raw.get("balances") or {}).items()
-        }
-        balance_events = [
-            BalanceEvent.from_dict(item) for item in (raw.get("balance_events") or [])
-        ]
-        settings = None
-        if raw.get("settings"):
-            settings = RateSettings.from_dict(raw["settings"])
-        roles = {int(uid): role for uid, role in (raw.get("user_roles") or {}).items()}
-        applications = [
-            MerchantApplication.from_dict(item) for item in raw.get("applications", [])
-        ]
-        profiles = {
-            int(uid): UserProfile.from_dict(data)
-            for uid, data in (raw.get("profiles") or {}).items()
-        }
-        reviews = [Review.from_dict(item) for item in raw.get("reviews", [])]
-        disputes = [Dispute.from_dict(item) for item in raw.get("disputes", [])]
-        adverts = [Advert.from_dict(item) for item in raw.get("adverts", [])]
-        topups = [Topup.from_dict(item) for item in raw.get("topups", [])]
-        chats_raw = raw.get("chats") or {}
-        chats = {
-            str(deal_id): [ChatMessage.from_dict(item) for item in messages]
-            for deal_id, messages in chats_raw.items()
-        }
-        merchant_since = {
-            int(uid): value for uid, value in (raw.get("merchant_since") or {}).items()
-        }
-        p2p_trading_enabled = {
-            int(uid): bool(value) for uid, value in (raw.get("p2p_trading_enabled") or {}).items()
-        }
-        admins = [int(uid) for uid in (raw.get("admins") or [])]
-        moderators = [int(uid) for uid in (raw.get("moderators") or [])]
-        user_warnings = {
-            int(uid): int(count) for uid, count in (raw.get("user_warnings") or {}).items()
-        }
-        user_bans = [int(uid) for uid in (raw.get("user_bans") or [])]
-        user_deal_blocks = [int(uid) for uid in (raw.get("user_deal_blocks") or [])]
-        user_ban_until = {
-            int(uid): value for uid, value in (raw.get("user_ban_until") or {}).items()
-        }
-        user_deal_block_until = {
-            int(uid): value for uid, value in (raw.get("user_deal_block_until") or {}).items()
-        }
-        admin_actions = list(raw.get("admin_actions") or [])
-        return StorageState(
-            deals=deals,
-            balances=balances,
-            balance_events=balance_events,
-            settings=settings,
-            user_roles=roles,
-            applications=applications,
-            profiles=profiles,
-            reviews=reviews,
-            disputes=disputes,
-            adverts=adverts,
-            topups=topups,
-            chats=chats,
-            deal_sequence=int(raw.get("deal_sequence") or 0),
-            advert_sequence=int(raw.get("advert_sequence") or 0),
-            merchant_since=merchant_since,
-            p2p_trading_enabled=p2p_trading_enabled,
-            admins=admins,
-            moderators=moderators,
-            user_warnings=user_warnings,
-            user_bans=user_bans,
-            user_deal_blocks=user_deal_blocks,
-            user_ban_until=user_ban_until,
-            user_deal_block_until=user_deal_block_until,
-            admin_actions=admin_actions,
+            return {}
+        return json.loads(self._path.read_text(encoding="utf-8"))
+
+    def _load(self) -> tuple[StorageState, ChangeTracker]:
+        raw = self._load_raw()
+        state = decode_state(raw)
+        return state, ChangeTracker(state, raw)
+
+    def _load_raw(self) -> dict[str, Any]:
+        return self._read_snapshot()
+
+
+def _noop() -> None:
+    return None
+
+
+class _SnapshotEncoder:
+    """Builds ``state.json`` text on the writer thread.
+
+    The JSON text of every record and every section is cached; a record is
+    encoded again only when the tracker handed over a new encoded object for
+    it, and sections that were not handed over at all are spliced in as is.
+    """
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self._names = tuple(names)
+        self._records: Dict[str, Dict[str, tuple[Any, str]]] = {}
+        self._sections: Dict[str, str] = {}
+
+    def update(self, parts: Mapping[str, Any]) -> None:
+        for name, part in parts.items():
+            self._sections[name] = self._encode_section(name, part)
+
+    def render(self) -> str:
+        body = ",\n".join(
+            f'  "{name}": {self._sections.get(name, "null")}' for name in self._names
         )
+        return "{\n" + body + "\n}"
+
+    def _encode_section(self, name: str, part: Any) -> str:
+        kind = SECTIONS[name].kind
+        if kind == "value":
+            return json.dumps(part)
+        previous = self._records.get(name, {})
+        records: Dict[str, tuple[Any, str]] = {}
+        for key, encoded in zip(*part):
+            cached = previous.get(key)
+            if cached is None or cached[0] is not encoded:
+                text = json.dumps(encoded)
+                if kind == "map":
+                    text = f"{json.dumps(key)}: {text}"
+                cached = (encoded, text)
+            records[key] = cached
+        self._records[name] = records
+        if not records:
+            return "[]" if kind == "list" else "{}"
+        lines = ",\n    ".join(text for _, text in records.values())
+        if kind == "list":
+            return f"[\n    {lines}\n  ]"
+        return f"{{\n    {lines}\n  }}"
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Mapping
+
+from cachebot.storage.journal import JournalStateRepository
+from cachebot.storage.repository import StateRepository
+from cachebot.storage.state import SECTIONS, StorageState, collector_paused, encode_state
+
+logger = logging.getLogger(__name__)
+
+# Every persist_* call touches exactly one shard, so a call is still written
+# atomically; balance_events and payouts stay next to deals and balances for
+# that reason.
+SHARDS: Dict[str, tuple[str, ...]] = {
+    "deals": ("deals", "balances", "balance_events", "deal_sequence", "payouts"),
+    "users": (
+        "user_roles",
+        "applications",
+        "profiles",
+        "merchant_since",
+        "admins",
+        "moderators",
+        "user_warnings",
+        "user_bans",
+        "user_deal_blocks",
+        "user_ban_until",
+        "user_deal_block_until",
+        "admin_actions",
+    ),
+    "adverts": ("adverts", "advert_sequence", "p2p_trading_enabled"),
+    "chats": ("chats",),
+    "disputes": ("disputes", "reviews"),
+    "topups": ("topups",),
+    "settings": ("settings",),
+}
+
+_OWNER: Dict[str, str] = {
+    section: shard for shard, sections in SHARDS.items() for section in sections
+}
+assert _OWNER.keys() == SECTIONS.keys(), "every state section must belong to one shard"
+
+
+class ShardedStateRepository(StateRepository):
+    """Splits the state into per-domain files under ``<state>/``.
+
+    Each shard is a complete repository with its own file, lock, commit batch
+    and writer thread, so e.g. chat messages never wait for a deal write.  The
+    base class machinery is not used here; only the persist API is shared.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        commit_window: float = 0.0,
+        shard_class: type[StateRepository] = StateRepository,
+    ) -> None:
+        self._path = path
+        self._directory = path.with_suffix("")
+        with collector_paused():
+            if not self._directory.exists() and path.exists():
+                self._split_legacy(shard_class)
+            self._directory.mkdir(parents=True, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=len(SHARDS)) as pool:
+                futures = {
+                    name: pool.submit(
+                        shard_class, self._directory / f"{name}.json", commit_window, sections
+                    )
+                    for name, sections in SHARDS.items()
+                }
+            self._shards: Dict[str, StateRepository] = {
+                name: future.result() for name, future in futures.items()
+            }
+
+    def snapshot(self) -> StorageState:
+        return StorageState(
+            **{
+                name: getattr(self._shards[_OWNER[name]].snapshot(), name)
+                for name in SECTIONS
+            }
+        )
+
+    async def replace_state(self, state: StorageState) -> None:
+        await asyncio.gather(*(shard.replace_state(state) for shard in self._shards.values()))
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(shard.flush() for shard in self._shards.values()))
+
+    async def compact(self, min_bytes: int = 1) -> bool:
+        results = await asyncio.gather(
+            *(
+                shard.compact(min_bytes)
+                for shard in self._shards.values()
+                if isinstance(shard, JournalStateRepository)
+            )
+        )
+        return any(results)
+
+    def close(self) -> None:
+        for shard in self._shards.values():
+            shard.close()
+
+    async def _update(
+        self,
+        touched: Mapping[str, Iterable[str]] | None = None,
+        **sections: Any,
+    ) -> None:
+        await asyncio.gather(
+            *(
+                self._shards[shard]._update(touched, **values)
+                for shard, values in self._by_owner(sections).items()
+            )
+        )
+
+    async def _update_keys(
+        self,
+        changed: Mapping[str, Iterable[str]],
+        **sections: Any,
+    ) -> None:
+        await asyncio.gather(
+            *(
+                self._shards[shard]._update_keys(changed, **values)
+                for shard, values in self._by_owner(sections).items()
+            )
+        )
+
+    @staticmethod
+    def _by_owner(sections: Mapping[str, Any]) -> Dict[str, Dict[str, Any]]:
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for name, value in sections.items():
+            grouped.setdefault(_OWNER[name], {})[name] = value
+        return grouped
+
+    def _split_legacy(self, shard_class: type[StateRepository]) -> None:
+        legacy = shard_class(self._path)
+        try:
+            raw = encode_state(legacy.snapshot())
+        finally:
+            legacy.close()
+        staging = self._directory.with_name(self._directory.name + ".tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for name, sections in SHARDS.items():
+            with (staging / f"{name}.json").open("w", encoding="utf-8") as handle:
+                handle.write(json.dumps({section: raw[section] for section in sections}))
+                handle.flush()
+                os.fsync(handle.fileno())
+        staging.replace(self._directory)
+        logger.info("Split %s into shards under %s", self._path, self._directory)
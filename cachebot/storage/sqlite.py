@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping
+
+from cachebot.storage.cold import ColdCache, ColdSection
+from cachebot.storage.repository import StateRepository
+from cachebot.storage.state import (
+    DELETED,
+    SECTIONS,
+    StorageState,
+    decode_state,
+    empty_state,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+# Fields copied out of the JSON payload into real columns so they can be
+# indexed and queried without decoding every row.
+_COLUMNS: Dict[str, tuple[tuple[str, str], ...]] = {
+    "deals": (
+        ("seller_id", "INTEGER"),
+        ("buyer_id", "INTEGER"),
+        ("status", "TEXT"),
+        ("advert_id", "TEXT"),
+        ("created_at", "TEXT"),
+    ),
+    "balance_events": (("user_id", "INTEGER"), ("created_at", "TEXT")),
+    "adverts": (("owner_id", "INTEGER"), ("active", "INTEGER")),
+    "disputes": (("deal_id", "TEXT"), ("resolved", "INTEGER")),
+    "reviews": (("deal_id", "TEXT"), ("to_user_id", "INTEGER")),
+    "topups": (("user_id", "INTEGER"),),
+}
+
+# Sections left on disk when lazy loading is on, with the condition for rows
+# that are still loaded at startup (``None``: none of them).
+_COLD: Dict[str, str | None] = {
+    "chats": None,
+    "balance_events": None,
+    "disputes": "resolved = 0",
+}
+
+
+def _table_sql(name: str) -> list[str]:
+    columns = _COLUMNS.get(name, ())
+    extra = "".join(f", {column} {kind}" for column, kind in columns)
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {name} "
+        f"(key TEXT PRIMARY KEY, data TEXT NOT NULL{extra})"
+    ]
+    for column, _ in columns:
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS idx_{name}_{column} ON {name} ({column})"
+        )
+    return statements
+
+
+def _upsert_sql(name: str) -> str:
+    columns = ["key", "data", *(column for column, _ in _COLUMNS.get(name, ()))]
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    placeholders = ", ".join("?" for _ in columns)
+    return (
+        f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({placeholders}) "
+        f"ON CONFLICT(key) DO UPDATE SET {updates}"
+    )
+
+
+def _row(name: str, key: str, encoded: Any) -> tuple[Any, ...]:
+    data = json.dumps(encoded, ensure_ascii=False, separators=(",", ":"))
+    columns = _COLUMNS.get(name, ())
+    return (key, data, *(encoded.get(column) for column, _ in columns))
+
+
+class SqliteStateRepository(StateRepository):
+    """Stores every section in its own SQLite table and upserts changed rows only.
+
+    Collections become ``key``/``data`` tables (plus a few indexed columns), the
+    small whole-value sections live in ``meta``.  On first start an existing
+    ``state.json`` next to the database is imported once.
+
+    With ``lazy`` the history sections in ``_COLD`` are not loaded at startup:
+    the snapshot holds only their hot rows and the rest is read on demand
+    through ``cold()``, cached up to ``cold_cache_bytes``.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        legacy_path: Path | None = None,
+        commit_window: float = 0.0,
+        *,
+        lazy: bool = False,
+        cold_cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self._legacy_path = legacy_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Opened here, used afterwards only from the writer thread.
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        # Cold reads happen on the event loop through their own connection, so
+        # they see committed rows only and never wait for the writer.
+        self._reader: sqlite3.Connection | None = None
+        self._cold: Dict[str, ColdSection] = {}
+        if lazy:
+            cache = ColdCache(cold_cache_bytes)
+            self._cold = {
+                name: ColdSection(SECTIONS[name], self._read_cold, cache) for name in _COLD
+            }
+        super().__init__(path, commit_window)
+
+    def cold(self, name: str) -> ColdSection:
+        section = self._cold.get(name)
+        return section if section is not None else super().cold(name)
+
+    def close(self) -> None:
+        super().close()
+        self._conn.close()
+        if self._reader is not None:
+            self._reader.close()
+
+    def _prepare_locked(
+        self,
+        sections: Iterable[str],
+        touched: Mapping[str, Iterable[str]],
+    ) -> Callable[[], None] | None:
+        changes = self._diff_locked(sections, touched)
+        if not changes:
+            return None
+        for name, diff in changes:
+            if name in self._cold:
+                self._cold[name].changed(diff)
+        return partial(self._apply, changes)
+
+    def _apply(self, changes: list[tuple[str, list[tuple[str | None, Any]]]]) -> None:
+        with _transaction(self._conn):
+            for name, diff in changes:
+                upserts: list[tuple[Any, ...]] = []
+                deletes: list[tuple[str]] = []
+                for key, encoded in diff:
+                    if key is None:
+                        self._conn.execute(
+                            "INSERT INTO meta (name, data) VALUES (?, ?) "
+                            "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                            (name, json.dumps(encoded, ensure_ascii=False)),
+                        )
+                    elif encoded is DELETED:
+                        deletes.append((key,))
+                    else:
+                        upserts.append(_row(name, key, encoded))
+                if upserts:
+                    self._conn.executemany(_upsert_sql(name), upserts)
+                if deletes:
+                    self._conn.executemany(f"DELETE FROM {name} WHERE key = ?", deletes)
+
+    def _load_raw(self) -> dict[str, Any]:
+        self._create_schema()
+        version = self._conn.execute(
+            "SELECT data FROM meta WHERE name = 'schema_version'"
+        ).fetchone()
+        if version is None:
+            self._migrate_legacy()
+        raw: dict[str, Any] = {}
+        for name, data in self._conn.execute("SELECT name, data FROM meta"):
+            raw[name] = json.loads(data)
+        for name, section in SECTIONS.items():
+            if section.kind == "value":
+                continue
+            if name in self._cold:
+                condition = _COLD[name]
+                if condition is None:
+                    continue
+                rows = self._conn.execute(
+                    f"SELECT key, data FROM {name} WHERE {condition} ORDER BY rowid"
+                )
+            else:
+                rows = self._conn.execute(f"SELECT key, data FROM {name} ORDER BY rowid")
+            if section.kind == "list":
+                raw[name] = [json.loads(data) for _, data in rows]
+            else:
+                raw[name] = {key: json.loads(data) for key, data in rows}
+        return raw
+
+    def _read_cold(self, name: str, field: str | None, value: Any) -> list[tuple[str, str]]:
+        if self._reader is None:
+            self._reader = sqlite3.connect(self._path, isolation_level=None)
+        if field is None:
+            column = "key"
+        elif field in dict(_COLUMNS.get(name, ())):
+            column = field
+        else:
+            column = f"json_extract(data, '$.{field}')"
+        return self._reader.execute(
+            f"SELECT key, data FROM {name} WHERE {column} = ? ORDER BY rowid", (value,)
+        ).fetchall()
+
+    def _create_schema(self) -> None:
+        with _transaction(self._conn):
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            for name, section in SECTIONS.items():
+                if section.kind != "value":
+                    for statement in _table_sql(name):
+                        self._conn.execute(statement)
+
+    def _migrate_legacy(self) -> None:
+        legacy = self._legacy_path
+        if legacy is not None and legacy.exists():
+            raw = json.loads(legacy.read_text(encoding="utf-8"))
+            state = decode_state(raw)
+            logger.info("Importing %s into %s", legacy, self._path)
+        else:
+            state = empty_state()
+        import_state(self._conn, state)
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def import_state(conn: sqlite3.Connection, state: StorageState) -> None:
+    """Writes ``state`` into an empty database in a single transaction."""
+    with _transaction(conn):
+        for name, section in SECTIONS.items():
+            value = getattr(state, name)
+            if section.kind == "value":
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, data) VALUES (?, ?)",
+                    (name, json.dumps(section.encode(value), ensure_ascii=False)),
+                )
+                continue
+            conn.executemany(
+                _upsert_sql(name),
+                (
+                    _row(name, key, section.encode_item(item))
+                    for key, item in section.keyed(value).items()
+                ),
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (name, data) VALUES ('schema_version', ?)",
+            (str(SCHEMA_VERSION),),
+        )
@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import gc
+import operator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
+
+from cachebot.models.advert import Advert
+from cachebot.models.balance_event import BalanceEvent
+from cachebot.models.chat import ChatMessage
+from cachebot.models.deal import Deal
+from cachebot.models.dispute import Dispute
+from cachebot.models.payout import Payout
+from cachebot.models.review import Review
+from cachebot.models.user import MerchantApplication, UserProfile
+from cachebot.models.topup import Topup
+
+
+@dataclass(slots=True)
+class RateSettings:
+    usd_rate: Decimal
+    fee_percent: Decimal
+    buyer_fee_percent: Decimal
+    withdraw_fee_percent: Decimal
+    transfer_fee_percent: Decimal = Decimal("2.0")
+
+    def to_dict(self) -> dict[str, str]:
+        return {
+            "usd_rate": str(self.usd_rate),
+            "fee_percent": str(self.fee_percent),
+            "buyer_fee_percent": str(self.buyer_fee_percent),
+            "withdraw_fee_percent": str(self.withdraw_fee_percent),
+            "transfer_fee_percent": str(self.transfer_fee_percent),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, str]) -> "RateSettings":
+        fee_percent = Decimal(data["fee_percent"])
+        buyer_fee_percent = Decimal(data.get("buyer_fee_percent", fee_percent))
+        return cls(
+            usd_rate=Decimal(data["usd_rate"]),
+            fee_percent=fee_percent,
+            buyer_fee_percent=buyer_fee_percent,
+            withdraw_fee_percent=Decimal(data.get("withdraw_fee_percent", "2.5")),
+            transfer_fee_percent=Decimal(data.get("transfer_fee_percent", "2.0")),
+        )
+
+
+@dataclass(slots=True)
+class StorageState:
+    deals: List[Deal]
+    balances: Dict[int, Decimal]
+    balance_events: List[BalanceEvent]
+    settings: Optional[RateSettings]
+    user_roles: Dict[int, str]
+    applications: List[MerchantApplication]
+    profiles: Dict[int, UserProfile]
+    reviews: List[Review]
+    disputes: List[Dispute]
+    adverts: List[Advert]
+    topups: List[Topup]
+    payouts: List[Payout]
+    chats: Dict[str, List[ChatMessage]]
+    deal_sequence: int
+    advert_sequence: int
+    merchant_since: Dict[int, str]
+    p2p_trading_enabled: Dict[int, bool]
+    admins: List[int]
+    moderators: List[int]
+    user_warnings: Dict[int, int]
+    user_bans: List[int]
+    user_deal_blocks: List[int]
+    user_ban_until: Dict[int, str]
+    user_deal_block_until: Dict[int, str]
+    admin_actions: List[dict]
+
+
+# Section kinds:
+#   "list"  - list of entities addressed by ``key_fields``
+#   "map"   - dict keyed by user id / deal id, stored with string keys
+#   "value" - small value that is always written as a whole
+@dataclass(frozen=True, slots=True)
+class Section:
+    name: str
+    kind: str
+    encode_item: Callable[[Any], Any]
+    decode_item: Callable[[Any], Any]
+    key_fields: tuple[str, ...] = ()
+    int_keys: bool = True
+    by_value: bool = False
+    default: Callable[[], Any] = list
+
+    def key_of(self, item: Any) -> str:
+        if len(self.key_fields) == 1:
+            return str(getattr(item, self.key_fields[0]))
+        return ":".join(str(getattr(item, name)) for name in self.key_fields)
+
+    def raw_key_of(self, raw: dict[str, Any]) -> str:
+        return ":".join(str(raw[name]) for name in self.key_fields)
+
+    def keyed(self, value: Any) -> Dict[str, Any]:
+        if self.kind == "list":
+            if len(self.key_fields) == 1:
+                field = self.key_fields[0]
+                return {str(getattr(item, field)): item for item in value}
+            return {self.key_of(item): item for item in value}
+        return {str(key): item for key, item in value.items()}
+
+    def encode(self, value: Any) -> Any:
+        if self.kind == "list":
+            return [self.encode_item(item) for item in value]
+        if self.kind == "map":
+            return {str(key): self.encode_item(item) for key, item in value.items()}
+        return self.encode_item(value)
+
+    def decode(self, raw: Any) -> Any:
+        if self.kind == "list":
+            return [self.decode_item(item) for item in (raw or [])]
+        if self.kind == "map":
+            return {
+                (int(key) if self.int_keys else str(key)): self.decode_item(item)
+                for key, item in (raw or {}).items()
+            }
+        return self.decode_item(raw)
+
+
+def _same(value: Any) -> Any:
+    return value
+
+
+def _int_list(value: Any) -> List[int]:
+    return [int(uid) for uid in (value or [])]
+
+
+def _optional_settings(raw: Any) -> RateSettings | None:
+    return RateSettings.from_dict(raw) if raw else None
+
+
+def _to_dict(item: Any) -> Any:
+    return item.to_dict()
+
+
+SECTIONS: Dict[str, Section] = {
+    section.name: section
+    for section in (
+        Section("deals", "list", _to_dict, Deal.from_dict, ("id",)),
+        Section("balances", "map", str, Decimal, by_value=True, default=dict),
+        Section("balance_events", "list", _to_dict, BalanceEvent.from_dict, ("id",)),
+        Section(
+            "settings",
+            "value",
+            lambda settings: settings.to_dict() if settings else None,
+            _optional_settings,
+            default=lambda: None,
+        ),
+        Section("user_roles", "map", _same, _same, by_value=True, default=dict),
+        Section("applications", "list", _to_dict, MerchantApplication.from_dict, ("id",)),
+        Section("profiles", "map", _to_dict, UserProfile.from_dict, default=dict),
+        Section("reviews", "list", _to_dict, Review.from_dict, ("deal_id", "from_user_id")),
+        Section("disputes", "list", _to_dict, Dispute.from_dict, ("id",)),
+        Section("adverts", "list", _to_dict, Advert.from_dict, ("id",)),
+        Section("topups", "list", _to_dict, Topup.from_dict, ("invoice_id",)),
+        Section("payouts", "list", _to_dict, Payout.from_dict, ("id",)),
+        Section(
+            "chats",
+            "map",
+            lambda messages: [msg.to_dict() for msg in messages],
+            lambda items: [ChatMessage.from_dict(item) for item in items],
+            int_keys=False,
+            default=dict,
+        ),
+        Section("deal_sequence", "value", _same, lambda raw: int(raw or 0), default=int),
+        Section("advert_sequence", "value", _same, lambda raw: int(raw or 0), default=int),
+        Section("merchant_since", "map", _same, _same, by_value=True, default=dict),
+        Section("p2p_trading_enabled", "map", _same, bool, by_value=True, default=dict),
+        Section("admins", "value", list, _int_list),
+        Section("moderators", "value", list, _int_list),
+        Section("user_warnings", "map", _same, int, by_value=True, default=dict),
+        Section("user_bans", "value", list, _int_list),
+        Section("user_deal_blocks", "value", list, _int_list),
+        Section("user_ban_until", "map", _same, _same, by_value=True, default=dict),
+        Section("user_deal_block_until", "map", _same, _same, by_value=True, default=dict),
+        Section("admin_actions", "value", list, lambda raw: list(raw or [])),
+    )
+}
+
+
+def empty_state() -> StorageState:
+    return StorageState(**{name: section.default() for name, section in SECTIONS.items()})
+
+
+def encode_state(state: StorageState, sections: Iterable[str] | None = None) -> dict[str, Any]:
+    names = SECTIONS.keys() if sections is None else sections
+    return {name: SECTIONS[name].encode(getattr(state, name)) for name in names}
+
+
+def decode_state(raw: dict[str, Any]) -> StorageState:
+    return StorageState(
+        **{name: section.decode(raw.get(name)) for name, section in SECTIONS.items()}
+    )
+
+
+@contextmanager
+def collector_paused() -> Iterator[None]:
+    """Keeps the cyclic collector off while the state is loaded at start.
+
+    Loading allocates millions of long-lived objects and collector passes in
+    the middle of it would only rescan them.  Not for use on a running loop:
+    the pass it postpones lands on whatever runs next.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+DELETED = object()
+_MISSING = object()
+
+
+class ChangeTracker:
+    """Remembers what has been persisted and reports per-record differences.
+
+    Services replace entities instead of mutating them (deals and chat lists are
+    the exception and are passed explicitly as ``touched`` keys), so identity is
+    enough to spot changed records; plain-value maps are compared by value.
+    The encoded form of every record is cached, so only changed records are
+    encoded again and a full payload can be assembled without touching models.
+    """
+
+    def __init__(
+        self,
+        state: StorageState,
+        raw: dict[str, Any],
+        encoders: Mapping[str, Callable[[Any], Any]] | None = None,
+    ) -> None:
+        # ``raw`` holds the already encoded records in the same shape and order
+        # as the state; ``encoders`` replace ``encode_item`` for some sections.
+        encoders = encoders or {}
+        self._encode: Dict[str, Callable[[Any], Any]] = {
+            name: encoders.get(name, section.encode_item) for name, section in SECTIONS.items()
+        }
+        self._known: Dict[str, Any] = {}
+        self._encoded: Dict[str, Any] = {}
+        # Last seen (keys, items) of every collection, in order: lets ``diff``
+        # skip the per-record scan when a section only grew at the end.
+        self._seen: Dict[str, tuple[List[Any] | None, List[Any]]] = {}
+        for name, section in SECTIONS.items():
+            value = getattr(state, name)
+            if section.kind == "value":
+                self._known[name] = self._encoded[name] = section.encode(value)
+                continue
+            self._known[name] = section.keyed(value)
+            # ``decode_state`` keeps the order of the raw payload, so raw records
+            # line up with the decoded ones.
+            if section.kind == "list":
+                keys = [section.key_of(item) for item in value]
+                encoded = raw.get(name) or []
+            else:
+                keys = [str(key) for key in value]
+                encoded = (raw.get(name) or {}).values()
+            self._encoded[name] = dict(zip(keys, encoded))
+            self._seen[name] = self._sequence(section, value)
+
+    def diff(
+        self,
+        name: str,
+        value: Any,
+        touched: Iterable[str] = (),
+    ) -> List[tuple[str | None, Any]]:
+        # Returns ``(key, encoded)`` for upserts, ``(key, DELETED)`` for removals
+        # and ``(None, encoded)`` when a "value" section changed.
+        section = SECTIONS[name]
+        if section.kind == "value":
+            encoded = section.encode(value)
+            if self._known[name] == encoded:
+                return []
+            self._known[name] = self._encoded[name] = encoded
+            return [(None, encoded)]
+        keys, items = self._sequence(section, value)
+        changes = self._appended(name, keys, items, touched)
+        if changes is None:
+            changes = self._rescan(name, section.keyed(value), touched)
+        self._seen[name] = (keys, items)
+        return changes
+
+    def diff_keys(
+        self,
+        name: str,
+        value: Any,
+        keys: Iterable[str],
+    ) -> List[tuple[str | None, Any]]:
+        # Like ``diff`` but only ``keys`` are looked at: ``value`` is a mapping
+        # by key (ints for int-keyed maps) or a list with the changed records
+        # at its end, as in an append-only ledger.
+        section = SECTIONS[name]
+        if section.kind == "value":
+            return self.diff(name, value)
+        # The next full ``diff`` can no longer trust the last seen sequence.
+        self._seen.pop(name, None)
+        # Kept in order: new records join the encoded cache in this order.
+        wanted = list(dict.fromkeys(str(key) for key in keys))
+        if isinstance(value, Mapping):
+            int_keys = section.kind == "map" and section.int_keys
+            found = {key: value.get(int(key) if int_keys else key, _MISSING) for key in wanted}
+        else:
+            found = {}
+            remaining = set(wanted)
+            for item in reversed(value):
+                if not remaining:
+                    break
+                key = section.key_of(item)
+                if key in remaining:
+                    remaining.discard(key)
+                    found[key] = item
+        known: Dict[str, Any] = self._known[name]
+        cache: Dict[str, Any] = self._encoded[name]
+        changes: List[tuple[str | None, Any]] = []
+        for key in wanted:
+            item = found.get(key, _MISSING)
+            if item is _MISSING:
+                known.pop(key, None)
+                cache.pop(key, None)
+                changes.append((key, DELETED))
+                continue
+            previous = known.get(key, _MISSING)
+            if section.by_value and previous is not _MISSING and previous == item:
+                continue
+            known[key] = item
+            encoded = cache[key] = self._encode[name](item)
+            changes.append((key, encoded))
+        return changes
+
+    def _appended(
+        self,
+        name: str,
+        keys: List[Any] | None,
+        items: List[Any],
+        touched: Iterable[str],
+    ) -> List[tuple[str | None, Any]] | None:
+        # Fast path: every record seen last time is still there, as the very
+        # same object and at the same position, so only the tail is new.
+        if name not in self._seen:
+            return None
+        seen_keys, seen_items = self._seen[name]
+        count = len(seen_items)
+        if len(items) < count or not all(map(operator.is_, seen_items, items)):
+            return None
+        if keys is not None and not all(map(operator.eq, seen_keys, keys)):
+            return None
+        section = SECTIONS[name]
+        known: Dict[str, Any] = self._known[name]
+        cache: Dict[str, Any] = self._encoded[name]
+        changes: List[tuple[str | None, Any]] = []
+        tail = items[count:]
+        if keys is None:
+            tail_keys = [section.key_of(item) for item in tail]
+        else:
+            tail_keys = [str(key) for key in keys[count:]]
+        for key, item in zip(tail_keys, tail):
+            known[key] = item
+            encoded = cache[key] = self._encode[name](item)
+            changes.append((key, encoded))
+        for key in set(touched).difference(tail_keys):
+            item = known.get(key, _MISSING)
+            if item is not _MISSING:
+                encoded = cache[key] = self._encode[name](item)
+                changes.append((key, encoded))
+            else:
+                # Touched but never held in memory: a record removed from disk.
+                changes.append((key, DELETED))
+        return changes
+
+    def _rescan(
+        self,
+        name: str,
+        current: Dict[str, Any],
+        touched: Iterable[str],
+    ) -> List[tuple[str | None, Any]]:
+        section = SECTIONS[name]
+        known: Dict[str, Any] = self._known[name]
+        cache: Dict[str, Any] = self._encoded[name]
+        forced = set(touched)
+        changes: List[tuple[str | None, Any]] = []
+        for key, item in current.items():
+            if key not in forced:
+                previous = known.get(key, _MISSING)
+                if previous is item:
+                    continue
+                if section.by_value and previous is not _MISSING and previous == item:
+                    continue
+            encoded = cache[key] = self._encode[name](item)
+            changes.append((key, encoded))
+        for key in known.keys() - current.keys():
+            del cache[key]
+            changes.append((key, DELETED))
+        for key in forced - current.keys() - known.keys():
+            changes.append((key, DELETED))
+        self._known[name] = current
+        return changes
+
+    @staticmethod
+    def _sequence(section: Section, value: Any) -> tuple[List[Any] | None, List[Any]]:
+        if section.kind == "list":
+            return None, list(value)
+        return list(value.keys()), list(value.values())
+
+    def items(self, name: str) -> Any:
+        # ``(keys, encoded)`` lists around shared encoded records: safe to hand
+        # to another thread while the cache keeps changing.
+        if SECTIONS[name].kind == "value":
+            return self._encoded[name]
+        cache = self._encoded[name]
+        return list(cache.keys()), list(cache.values())
@@ -462,6 +462,11 @@
     pendingRead: {},
     systemNotifications: [],
     dealStatusMap: {},
+    syncCursor: null,
+    dealsNextCursor: null,
+    dealsLoadedUntil: null,
+    dealsTotal: null,
+    dealsLoading: false,
     lastQuickBadgeCount: 0,
     activeChatDealId: null,
     activeDealId: null,
@@ -488,6 +493,9 @@
     dealRefreshTimer: null,
     livePollTimer: null,
     livePollInFlight: false,
+    eventSource: null,
+    eventStreamOpen: false,
+    syncApplying: Promise.resolve(),
     balancePollTimer: null,
     balancePollInFlight: false,
     reviewsTargetUserId: null,
@@ -2210,6 +2218,10 @@
   const loadBalance = async () => {
     const payload = await fetchJson("/api/balance");
     if (!payload?.ok) return;
+    applyBalance(payload);
+  };
+
+  const applyBalance = (payload) => {
     const available = Number(payload.balance ?? 0);
     const reserved = Number(payload.reserved ?? 0);
     state.balance = available;
@@ -2464,14 +2476,18 @@
   });
 
   const renderDealsPage = () => {
-    const deals = state.deals || [];
+    const deals = listedDeals();
     const page = state.dealsPage || 0;
     const perPage = 5;
-    const totalPages = Math.max(1, Math.ceil(deals.length / perPage));
+    const total = Math.max(state.dealsTotal ?? 0, deals.length);
+    const totalPages = Math.max(1, Math.ceil(total / perPage));
     const safePage = Math.max(0, Math.min(page, totalPages - 1));
     state.dealsPage = safePage;
     const start = safePage * perPage;
     const chunk = deals.slice(start, start + perPage);
+    if (chunk.length < perPage && state.dealsNextCursor) {
+      loadMoreDeals(start + perPage).then((loaded) => loaded && renderDealsPage());
+    }
     dealsList.innerHTML = "";
     if (!deals.length) {
       dealsList.innerHTML = "<div class=\"deal-empty\">Сделок пока нет.</div>";
@@ -2566,10 +2582,149 @@
     state.merchantMyAds = payload.ads || [];
   };
 
+  const DEALS_BATCH = 50;
+  const ACTIVE_DEAL_STATUSES = "open,pending,reserved,paid,dispute";
+
+  const byNewest = (a, b) => (a.created_at < b.created_at ? 1 : a.created_at > b.created_at ? -1 : 0);
+
+  const mergeDeals = (deals, more) => {
+    const merged = new Map(deals.map((deal) => [deal.id, deal]));
+    more.forEach((deal) => {
+      if (!(merged.get(deal.id)?.version > deal.version)) {
+        merged.set(deal.id, deal);
+      }
+    });
+    return [...merged.values()].sort(byNewest);
+  };
+
+  // The history is read page by page: the newest deals first and older ones
+  // as the list is turned. Unfinished deals are all loaded up front for the
+  // quick panel and chat badges, but listed only once the pages reach them.
+  const listedDeals = () => {
+    const deals = state.deals || [];
+    if (!state.dealsNextCursor) return deals;
+    return deals.filter((deal) => deal.created_at >= state.dealsLoadedUntil);
+  };
+
+  const fetchDealPage = async (query, cursor) => {
+    const suffix = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+    return fetchJson(`/api/my-deals?${query}${suffix}`);
+  };
+
+  const loadMoreDeals = async (count) => {
+    if (state.dealsLoading) return false;
+    state.dealsLoading = true;
+    try {
+      let loaded = false;
+      while (listedDeals().length < count && state.dealsNextCursor) {
+        const payload = await fetchDealPage(`limit=${DEALS_BATCH}`, state.dealsNextCursor);
+        if (!payload?.ok) break;
+        const deals = payload.deals || [];
+        state.dealsNextCursor = payload.next_cursor || null;
+        if (deals.length) state.dealsLoadedUntil = deals[deals.length - 1].created_at;
+        state.deals = mergeDeals(state.deals || [], deals);
+        loaded = true;
+      }
+      return loaded;
+    } finally {
+      state.dealsLoading = false;
+    }
+  };
+
+  const loadActiveDeals = async () => {
+    const deals = [];
+    let cursor = null;
+    do {
+      const payload = await fetchDealPage(`status=${ACTIVE_DEAL_STATUSES}&limit=100`, cursor);
+      if (!payload?.ok) return null;
+      deals.push(...(payload.deals || []));
+      cursor = payload.next_cursor;
+    } while (cursor);
+    return deals;
+  };
+
+  const applyDealSummary = (summary) => {
+    state.dealsTotal = summary.deals_total ?? null;
+    if (!summary.deal_stats) return;
+    state.profileStats = {
+      ...summary.deal_stats,
+      reviews_count: state.profileStats?.reviews_count ?? 0,
+    };
+    applyProfileStats(state.profileStats);
+  };
+
   const loadDeals = async () => {
-    const payload = await fetchJson("/api/my-deals");
-    if (!payload?.ok) return;
-    const deals = payload.deals || [];
+    // The cursor is taken first, so /api/sync from it repeats rather than
+    // misses a change made while the pages are read.
+    const sync = await fetchJson("/api/sync");
+    if (!sync?.ok) return;
+    const [first, active, summary] = await Promise.all([
+      fetchDealPage(`limit=${DEALS_BATCH}`),
+      loadActiveDeals(),
+      fetchJson("/api/summary"),
+    ]);
+    if (!first?.ok || !active) return;
+    const deals = first.deals || [];
+    state.syncCursor = sync.cursor || null;
+    state.dealsNextCursor = first.next_cursor || null;
+    state.dealsLoadedUntil = deals.length ? deals[deals.length - 1].created_at : null;
+    if (summary?.ok) applyDealSummary(summary);
+    await applyDeals(mergeDeals(deals, active));
+  };
+
+  // Live updates: only what changed since the last answer is fetched and
+  // merged into the loaded list; a full reload happens when there is no cursor.
+  const syncDeals = async () => {
+    if (!state.syncCursor) {
+      await loadDeals();
+      await loadBalance();
+      return;
+    }
+    const payload = await fetchJson(`/api/sync?since=${encodeURIComponent(state.syncCursor)}`);
+    if (!payload?.ok) {
+      state.syncCursor = null;
+      return;
+    }
+    await applySync(payload);
+  };
+
+  const applySync = async (payload) => {
+    if (Number(payload.cursor) > Number(state.syncCursor || 0)) {
+      state.syncCursor = payload.cursor;
+    }
+    if (payload.balance) {
+      applyBalance(payload.balance);
+    }
+    if (payload.support) {
+      state.supportPollAt = Date.now();
+      await refreshSupportBadge();
+    }
+    if (payload.summary) {
+      applyDealSummary(payload.summary);
+    }
+    const current = new Map((state.deals || []).map((deal) => [deal.id, deal]));
+    // The poll and the stream may deliver the same change twice, in any order.
+    const changed = (payload.deals || []).filter(
+      (deal) => !(current.get(deal.id)?.version > deal.version)
+    );
+    const removed = new Set(payload.removed || []);
+    const heads = new Map((payload.chats || []).map((item) => [item.deal_id, item]));
+    if (!changed.length && !removed.size && !heads.size) return;
+    const changedIds = new Set(changed.map((deal) => deal.id));
+    const deals = (state.deals || [])
+      .filter((deal) => !removed.has(deal.id) && !changedIds.has(deal.id))
+      .map((deal) => {
+        const head = heads.get(deal.id);
+        return head
+          ? { ...deal, chat_last_at: head.chat_last_at, chat_last_sender_id: head.chat_last_sender_id }
+          : deal;
+      })
+      .concat(changed)
+      .sort(byNewest);
+    await applyDeals(deals);
+  };
+
+  const applyDeals = async (deals) => {
     const previousStatusMap = state.dealStatusMap || {};
     const nextStatusMap = {};
     deals.forEach((deal) => {
@@ -2655,33 +2810,10 @@
       persistChatSeen();
     }
     await loadMerchantMyAds();
-    dealsCount.textContent = `${deals.length + (state.merchantMyAds?.length || 0)}`;
-    const desiredPage = state.dealsPage ?? 0;
+    dealsCount.textContent = `${(state.dealsTotal ?? deals.length) + (state.merchantMyAds?.length || 0)}`;
     state.deals = deals;
-    const totalPages = Math.max(1, Math.ceil(deals.length / 5));
-    state.dealsPage = Math.max(0, Math.min(desiredPage, totalPages - 1));
     syncUnreadDeals(deals);
     updateQuickDealsButton(deals);
-    const totalDeals = deals.length;
-    const successDeals = deals.filter((deal) => deal.status === "completed").length;
-    const failedDeals = deals.filter(
-      (deal) => deal.status === "canceled" || deal.status === "expired"
-    ).length;
-    const successPercent = totalDeals ? Math.round((successDeals / totalDeals) * 100) : 0;
-    const failPercent = totalDeals ? Math.round((failedDeals / totalDeals) * 100) : 0;
-    const currentStats = state.profileStats || {
-      total_deals: 0,
-      success_percent: 0,
-      fail_percent: 0,
-      reviews_count: 0,
-    };
-    state.profileStats = {
-      total_deals: totalDeals,
-      success_percent: successPercent,
-      fail_percent: failPercent,
-      reviews_count: currentStats.reviews_count ?? 0,
-    };
-    applyProfileStats(state.profileStats);
     renderDealsPage();
   };
 
@@ -6495,10 +6627,29 @@
     }
   };
 
+  // Loaded chats stay in memory and later calls only fetch the messages
+  // after the last one; ``full`` reloads the whole chat.
   const loadChatMessages = async (dealId, options = {}) => {
-    const payload = await fetchJson(`/api/deals/${dealId}/chat`);
-    if (!payload?.ok) return;
-    const messages = payload.messages || [];
+    state.chatCache = state.chatCache || {};
+    const cached = options.full ? null : state.chatCache[dealId];
+    const lastId = cached?.length ? cached[cached.length - 1].id : null;
+    let messages;
+    if (lastId) {
+      const payload = await fetchJson(
+        `/api/deals/${dealId}/chat?after=${encodeURIComponent(lastId)}&limit=200`
+      );
+      if (!payload?.ok) {
+        // The message is gone (chat cleared): start over on the next call.
+        delete state.chatCache[dealId];
+        return cached;
+      }
+      messages = payload.messages?.length ? cached.concat(payload.messages) : cached;
+    } else {
+      const payload = await fetchJson(`/api/deals/${dealId}/chat`);
+      if (!payload?.ok) return;
+      messages = payload.messages || [];
+    }
+    state.chatCache[dealId] = messages;
     // Avoid re-rendering the whole chat if nothing changed; it causes scroll jitter on iOS.
     const last = messages.length ? messages[messages.length - 1] : null;
     const sig = `${messages.length}|${last?.id || last?.message_id || last?.created_at || ""}`;
@@ -6600,7 +6751,11 @@
     const hasSavedScroll = Boolean(state.chatScrollPos?.[deal.id]);
     state.chatOpeningPreferSavedScroll = hasSavedScroll;
     state.chatForceBottomOnce = !hasSavedScroll;
-    const messages = await loadChatMessages(deal.id, { keepPosition: false, skipIfUnchanged: false });
+    const messages = await loadChatMessages(deal.id, {
+      keepPosition: false,
+      skipIfUnchanged: false,
+      full: true,
+    });
     const lastMessage = Array.isArray(messages) && messages.length ? messages[messages.length - 1] : null;
     if (lastMessage?.created_at) {
       markChatRead(deal.id, lastMessage.created_at);
@@ -6751,14 +6906,50 @@
     }, 2000);
   };
 
+  // While the event stream is open it delivers deal, chat, balance and
+  // support changes; the /api/sync poll only runs when it is not.
+  const startEventStream = () => {
+    if (!window.EventSource || state.eventSource || !state.syncCursor) return;
+    refreshInitData();
+    if (!state.initData) return;
+    const source = new EventSource(
+      `/api/events?initData=${encodeURIComponent(state.initData)}&since=${encodeURIComponent(
+        state.syncCursor
+      )}`
+    );
+    state.eventSource = source;
+    source.addEventListener("open", () => {
+      state.eventStreamOpen = true;
+    });
+    source.addEventListener("sync", (event) => {
+      let payload = null;
+      try {
+        payload = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+      state.syncApplying = state.syncApplying.then(() => applySync(payload)).catch(() => {});
+    });
+    source.addEventListener("error", () => {
+      state.eventStreamOpen = false;
+      // The browser reconnects by itself unless the server refused the stream.
+      if (source.readyState === EventSource.CLOSED) {
+        source.close();
+        state.eventSource = null;
+      }
+    });
+  };
+
   const startLivePolling = () => {
     if (state.livePollTimer) return;
     state.livePollTimer = window.setInterval(async () => {
       if (state.livePollInFlight) return;
       state.livePollInFlight = true;
       try {
-        await loadDeals();
-        await loadBalance();
+        if (!state.eventStreamOpen) {
+          await syncDeals();
+          startEventStream();
+        }
         if (state.isMerchant && Date.now() - (state.merchantPollAt || 0) > 2000) {
           state.merchantPollAt = Date.now();
           await loadMerchantAds();
@@ -6781,7 +6972,12 @@
             // ignore disputes refresh errors
           }
         }
-        if (Date.now() - (state.supportPollAt || 0) > 3000) {
+        // Moderators also follow tickets of other users, which the stream
+        // does not carry.
+        if (
+          (!state.eventStreamOpen || state.supportCanManage) &&
+          Date.now() - (state.supportPollAt || 0) > 3000
+        ) {
           state.supportPollAt = Date.now();
           await refreshSupportBadge();
         }
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import binascii
 import hashlib
 import hmac
 import json
@@ -9,17 +12,22 @@ import time
 from datetime import datetime, timezone, timedelta
 from contextlib import suppress
 from pathlib import Path
-from typing import Any
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator
 from urllib.parse import parse_qsl, unquote, quote, quote_plus
 from decimal import Decimal, InvalidOperation, ROUND_UP
 
 from aiohttp import web
 
+from cachebot import metrics
 from cachebot.deps import AppDeps
-from cachebot.services.scheduler import handle_paid_invoice
+from cachebot.services.deal_index import DealCursor
+from cachebot.services.deals import DealFilter
+from cachebot.services.notifier import Notifier
 from cachebot.models.advert import AdvertSide
 from cachebot.models.deal import DealStatus
 from cachebot.models.dispute import EvidenceItem
+from cachebot.models.payout import Payout
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, WebAppInfo
 from PIL import Image, ImageChops, ImageDraw
 from cachebot.constants import BANK_OPTIONS
@@ -30,10 +38,17 @@ SUPPORT_CLOSE_REQUEST_PREFIX = "__close_request__:"
 SUPPORT_CLOSE_RESPONSE_PREFIX = "__close_response__:"
 
 
-def create_app(bot, deps: AppDeps) -> web.Application:
+def create_app(bot, deps: AppDeps, notifier: Notifier) -> web.Application:
     app = web.Application(client_max_size=50 * 1024 * 1024)
     app["bot"] = bot
+    app["notifier"] = notifier
     app["deps"] = deps
+    app["init_data_keys"] = _init_data_keys(
+        deps.config.telegram_bot_tokens or (deps.config.telegram_bot_token,)
+    )
+    app["init_data_cache"] = _InitDataCache()
+    app["event_streams"] = {}
+    app.on_shutdown.append(_close_event_streams)
     app.router.add_post(deps.config.webhook_path, _crypto_pay_handler)
     app.router.add_get("/app", _webapp_index)
     app.router.add_get("/app/", _webapp_index)
@@ -49,10 +64,14 @@ def create_app(bot, deps: AppDeps) -> web.Application:
     app.router.add_get("/api/balance/history", _api_balance_history)
     app.router.add_post("/api/balance/topup", _api_balance_topup)
     app.router.add_post("/api/balance/withdraw", _api_balance_withdraw)
+    app.router.add_get("/api/payouts", _api_payouts)
+    app.router.add_get("/api/payouts/{payout_id}", _api_payout_detail)
     app.router.add_post("/api/balance/transfer", _api_balance_transfer)
     app.router.add_get("/api/users/lookup", _api_users_lookup)
     app.router.add_get("/api/users/search", _api_users_search)
     app.router.add_get("/api/my-deals", _api_my_deals)
+    app.router.add_get("/api/sync", _api_sync)
+    app.router.add_get("/api/events", _api_events)
     app.router.add_post("/api/deals", _api_create_deal)
     app.router.add_get("/api/deals/{deal_id}", _api_deal_detail)
     app.router.add_post("/api/deals/{deal_id}/cancel", _api_deal_cancel)
@@ -116,6 +135,7 @@ def create_app(bot, deps: AppDeps) -> web.Application:
     app.router.add_get("/api/admin/deals/search", _api_admin_deals_search)
     app.router.add_post("/api/admin/users/{user_id}/moderation", _api_admin_user_moderation)
     app.router.add_get("/api/admin/actions", _api_admin_actions)
+    app.router.add_get("/api/admin/metrics", _api_admin_metrics)
     app.router.add_get("/api/support/tickets", _api_support_tickets)
     app.router.add_post("/api/support/tickets", _api_support_create_ticket)
     app.router.add_get("/api/support/tickets/{ticket_id}", _api_support_ticket_detail)
@@ -137,8 +157,10 @@ def create_app(bot, deps: AppDeps) -> web.Application:
 
 
 async def _crypto_pay_handler(request: web.Request) -> web.Response:
+    # Only verifies and records the event: Crypto Pay repeats webhooks that
+    # are answered slowly, so the work itself is left to the inbox consumer.
+    started = time.perf_counter()
     deps: AppDeps = request.app["deps"]
-    bot = request.app["bot"]
     secret = deps.config.crypto_pay_webhook_secret
     raw_body = await request.read()
     if secret:
@@ -160,28 +182,12 @@ async def _crypto_pay_handler(request: web.Request) -> web.Response:
     invoice_id = invoice.get("invoice_id")
     status = (invoice.get("status") or "").lower()
     if invoice_id and status.startswith("paid"):
-        handled = False
         try:
-            deal = await deps.deal_service.mark_invoice_paid(str(invoice_id))
-            await handle_paid_invoice(deal, deps.kb_client, bot)
-            handled = True
-        except LookupError:
-            handled = False
+            await deps.webhook_consumer.accept(str(invoice_id), status, invoice)
         except Exception as exc:  # pragma: no cover
-            logger.exception("Failed to handle paid invoice %s: %s", invoice_id, exc)
+            logger.exception("Failed to record paid invoice %s: %s", invoice_id, exc)
             raise web.HTTPInternalServerError()
-        if not handled:
-            topup = await deps.topup_service.pop_paid(str(invoice_id))
-            if topup:
-                await deps.deal_service.deposit_balance(topup.user_id, topup.amount, kind="topup")
-                amount_str = f"{topup.amount.quantize(Decimal('0.01')):f}"
-                await bot.send_message(
-                    topup.user_id,
-                    "✅ Пополнение успешно.\n"
-                    f"Сумма: {amount_str} USDT\n"
-                    "Хороших сделок!",
-                )
-
+    metrics.histogram("webhook.crypto_pay_ms").observe((time.perf_counter() - started) * 1000)
     return web.json_response({"ok": True})
 
 
@@ -288,12 +294,7 @@ async def _api_profile(request: web.Request) -> web.Response:
     profile = await deps.user_service.profile_of(user_id)
     role = await deps.user_service.role_of(user_id)
     merchant_since = await deps.user_service.merchant_since_of(user_id)
-    deals = await deps.deal_service.list_user_deals(user_id)
-    total_deals = len(deals)
-    success_deals = sum(1 for deal in deals if deal.status == DealStatus.COMPLETED)
-    failed_deals = sum(1 for deal in deals if deal.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
-    success_percent = round((success_deals / total_deals) * 100) if total_deals else 0
-    fail_percent = round((failed_deals / total_deals) * 100) if total_deals else 0
+    counts = await deps.deal_service.user_deal_counts(user_id)
     reviews = await deps.review_service.list_for_user(user_id)
     moderation = await deps.user_service.moderation_status(user_id)
     include_private = _is_admin(user_id, deps)
@@ -304,12 +305,7 @@ async def _api_profile(request: web.Request) -> web.Response:
         "is_admin": _is_admin(user_id, deps),
         "merchant_since": merchant_since.isoformat() if merchant_since else None,
         "moderation": moderation,
-        "stats": {
-            "total_deals": total_deals,
-            "success_percent": success_percent,
-            "fail_percent": fail_percent,
-            "reviews_count": len(reviews),
-        },
+        "stats": {**_deal_stats(counts), "reviews_count": len(reviews)},
     }
     return web.json_response({"ok": True, "data": payload})
 
@@ -339,17 +335,16 @@ async def _api_profile_stats(request: web.Request) -> web.Response:
         elif event.kind == "withdraw":
             withdraw_total += abs(event.amount)
 
-    deals = await deps.deal_service.list_user_deals(user_id)
+    filters = None
+    if scope != "deals_all":
+        filters = DealFilter(created_from=range_from, created_to=range_to + timedelta(microseconds=1))
     buy_sum = Decimal("0")
     sell_sum = Decimal("0")
     completed = 0
     canceled = 0
     expired = 0
     total = 0
-    for deal in deals:
-        if scope != "deals_all":
-            if deal.created_at < range_from or deal.created_at > range_to:
-                continue
+    async for deal in deps.deal_service.iter_user_deals(user_id, filters):
         total += 1
         if deal.buyer_id == user_id:
             buy_sum += deal.usdt_amount
@@ -393,24 +388,14 @@ async def _api_public_profile(request: web.Request) -> web.Response:
         raise web.HTTPNotFound(text="Пользователь не найден")
     role = await deps.user_service.role_of(target_id)
     merchant_since = await deps.user_service.merchant_since_of(target_id)
-    deals = await deps.deal_service.list_user_deals(target_id)
-    total_deals = len(deals)
-    success_deals = sum(1 for deal in deals if deal.status == DealStatus.COMPLETED)
-    failed_deals = sum(1 for deal in deals if deal.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
-    success_percent = round((success_deals / total_deals) * 100) if total_deals else 0
-    fail_percent = round((failed_deals / total_deals) * 100) if total_deals else 0
+    counts = await deps.deal_service.user_deal_counts(target_id)
     reviews = await deps.review_service.list_for_user(target_id)
     payload = {
         "profile": _profile_payload(profile, request=request, include_private=False),
         "role": role.value if role else None,
         "is_admin": _is_admin(target_id, deps),
         "merchant_since": merchant_since.isoformat() if merchant_since else None,
-        "stats": {
-            "total_deals": total_deals,
-            "success_percent": success_percent,
-            "fail_percent": fail_percent,
-            "reviews_count": len(reviews),
-        },
+        "stats": {**_deal_stats(counts), "reviews_count": len(reviews)},
     }
     return web.json_response({"ok": True, "data": payload})
 
@@ -484,6 +469,10 @@ async def _api_avatar(request: web.Request) -> web.Response:
 async def _api_balance(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
+    return web.json_response({"ok": True, **await _balance_payload(deps, user_id)})
+
+
+async def _balance_payload(deps: AppDeps, user_id: int) -> dict[str, str]:
     balance = await deps.deal_service.balance_of(user_id)
     reserved = await deps.deal_service.reserved_of(user_id)
     reserved_ads = await deps.advert_service.reserved_of(user_id)
@@ -492,9 +481,7 @@ async def _api_balance(request: web.Request) -> web.Response:
         fee_multiplier = rate_snapshot.fee_multiplier
         reserved += reserved_ads + (reserved_ads * fee_multiplier)
     total = balance + reserved
-    return web.json_response(
-        {"ok": True, "balance": str(balance), "reserved": str(reserved), "total": str(total)}
-    )
+    return {"balance": str(balance), "reserved": str(reserved), "total": str(total)}
 
 
 async def _api_balance_history(request: web.Request) -> web.Response:
@@ -535,18 +522,19 @@ async def _api_balance_topup(request: web.Request) -> web.Response:
     )
     await deps.topup_service.create(user_id=user_id, amount=amount, invoice_id=invoice.invoice_id)
     amount_str = f"{amount.quantize(Decimal('0.01')):f}"
-    bot = request.app.get("bot")
-    if bot:
+    notifier = request.app.get("notifier")
+    if notifier:
         markup = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text="💳 Оплатить", url=invoice.pay_url)]
             ]
         )
-        await bot.send_message(
+        notifier.send_message(
             user_id,
             f"Новое пополнение на {amount_str} USDT.\n"
             "Нажмите на кнопку ниже для оплаты счета.",
             reply_markup=markup,
+            critical=True,
         )
     return web.json_response({"ok": True, "invoice_id": invoice.invoice_id, "pay_url": invoice.pay_url})
 
@@ -610,14 +598,9 @@ async def _api_balance_withdraw(request: web.Request) -> web.Response:
     if balance < total:
         raise web.HTTPBadRequest(text="Недостаточно средств")
     try:
-        await deps.deal_service.withdraw_balance(user_id, total)
+        payout = await deps.payout_service.request(user_id, amount, fee)
     except Exception as exc:
         raise web.HTTPBadRequest(text=f"Не удалось списать средства: {exc}")
-    try:
-        await deps.crypto_pay.transfer(user_id=user_id, amount=amount, currency="USDT")
-    except Exception as exc:
-        await deps.deal_service.deposit_balance(user_id, total, kind="refund", record_event=False)
-        raise web.HTTPBadRequest(text=f"Перевод не выполнен: {exc}")
     return web.json_response(
         {
             "ok": True,
@@ -625,10 +608,42 @@ async def _api_balance_withdraw(request: web.Request) -> web.Response:
             "fee": str(fee),
             "total": str(total),
             "username": user.get("username") or "",
+            "payout": _payout_payload(payout),
         }
     )
 
 
+async def _api_payouts(request: web.Request) -> web.Response:
+    deps: AppDeps = request.app["deps"]
+    _, user_id = await _require_user(request)
+    payouts = await deps.deal_service.payouts_of(user_id)
+    return web.json_response({"ok": True, "items": [_payout_payload(item) for item in payouts]})
+
+
+async def _api_payout_detail(request: web.Request) -> web.Response:
+    deps: AppDeps = request.app["deps"]
+    _, user_id = await _require_user(request)
+    payout = await deps.deal_service.get_payout(request.match_info["payout_id"])
+    if payout is None or payout.user_id != user_id:
+        raise web.HTTPNotFound(text="Вывод не найден")
+    return web.json_response({"ok": True, "payout": _payout_payload(payout)})
+
+
+def _payout_payload(payout: Payout) -> dict[str, Any]:
+    return {
+        "id": payout.id,
+        "status": payout.status.value,
+        "amount": str(payout.amount),
+        "fee": str(payout.fee),
+        "total": str(payout.total),
+        "currency": payout.currency,
+        "attempts": payout.attempts,
+        "error": payout.error,
+        "created_at": payout.created_at.isoformat(),
+        "updated_at": payout.updated_at.isoformat(),
+    }
+
+
 async def _api_balance_transfer(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
@@ -679,10 +694,10 @@ async def _api_balance_transfer(request: web.Request) -> web.Response:
         or sender_profile.username
         or str(user_id)
     )
-    bot = request.app.get("bot")
-    if bot:
+    notifier = request.app.get("notifier")
+    if notifier:
         text = f"💸 Пользователь {sender_name} отправил вам {credit_amount:.2f} USDT."
-        await bot.send_message(recipient_id, text)
+        notifier.send_message(recipient_id, text, critical=True)
     return web.json_response(
         {
             "ok": True,
@@ -696,27 +711,243 @@ async def _api_balance_transfer(request: web.Request) -> web.Response:
 async def _api_summary(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
-    deals = await deps.deal_service.list_user_deals(user_id)
+    return web.json_response({"ok": True, **await _summary_payload(deps, user_id)})
+
+
+async def _summary_payload(deps: AppDeps, user_id: int) -> dict[str, Any]:
+    counts = await deps.deal_service.user_deal_counts(user_id)
     balance = await deps.deal_service.balance_of(user_id)
+    return {
+        "deals_total": sum(counts.values()),
+        "deals_active": sum(
+            count for status, count in counts.items() if status.value in {"open", "reserved", "paid", "dispute"}
+        ),
+        "deal_stats": _deal_stats(counts),
+        "balance": str(balance),
+    }
+
+
+def _deal_stats(counts: dict[DealStatus, int]) -> dict[str, int]:
+    total = sum(counts.values())
+    success = counts.get(DealStatus.COMPLETED, 0)
+    failed = counts.get(DealStatus.CANCELED, 0) + counts.get(DealStatus.EXPIRED, 0)
+    return {
+        "total_deals": total,
+        "success_percent": round((success / total) * 100) if total else 0,
+        "fail_percent": round((failed / total) * 100) if total else 0,
+    }
+
+
+async def _api_my_deals(request: web.Request) -> web.Response:
+    deps: AppDeps = request.app["deps"]
+    _, user_id = await _require_user(request)
+    # Newest first, continued with the opaque ``next_cursor``.
+    try:
+        limit = int(request.query.get("limit") or MY_DEALS_PAGE)
+    except ValueError:
+        raise web.HTTPBadRequest(text="Некорректный limit")
+    limit = max(1, min(limit, MY_DEALS_PAGE_MAX))
+    cursor = _decode_deal_cursor(request.query.get("cursor"))
+    filters = _deal_filter(request.query)
+    deals, next_cursor = await deps.deal_service.user_deals_page(
+        user_id, limit=limit, cursor=cursor, filters=filters
+    )
+    payload = await _deal_payloads(deps, deals, user_id, with_actions=True, request=request)
     return web.json_response(
         {
             "ok": True,
-            "deals_total": len(deals),
-            "deals_active": sum(1 for deal in deals if deal.status.value in {"open", "reserved", "paid", "dispute"}),
-            "balance": str(balance),
+            "deals": payload,
+            "next_cursor": _encode_deal_cursor(next_cursor) if next_cursor else None,
         }
     )
 
 
-async def _api_my_deals(request: web.Request) -> web.Response:
+async def _api_sync(request: web.Request) -> web.Response:
+    # What changed for the user since ``since`` (the ``cursor`` of the
+    # previous answer, or of one without ``since`` taken before loading).
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
-    deals = await deps.deal_service.list_user_deals(user_id)
-    deals.sort(key=lambda deal: deal.created_at, reverse=True)
-    payload = []
-    for deal in deals:
-        payload.append(await _deal_payload(deps, deal, user_id, with_actions=True, request=request))
-    return web.json_response({"ok": True, "deals": payload})
+    cursor = deps.change_feed.version
+    raw_since = request.query.get("since")
+    if not raw_since:
+        return web.json_response({"ok": True, "cursor": str(cursor)})
+    since = _parse_since(raw_since, cursor)
+    return web.json_response(await _sync_payload(request, deps, user_id, since, cursor))
+
+
+EVENT_STREAMS_PER_USER = 5
+
+
+async def _api_events(request: web.Request) -> web.StreamResponse:
+    # Server-sent events: the answer of /api/sync is pushed as a ``sync``
+    # event as soon as something of the user changes, and a comment every
+    # ``events_heartbeat`` seconds keeps proxies from closing the stream.
+    # Changes made while an event is being built come with the next one.
+    deps: AppDeps = request.app["deps"]
+    _, user_id = await _require_user(request)
+    feed = deps.change_feed
+    raw_since = request.query.get("since") or request.headers.get("Last-Event-ID")
+    since = _parse_since(raw_since, feed.version) if raw_since else feed.version
+    streams: dict[int, set[asyncio.Task]] = request.app["event_streams"]
+    user_streams = streams.setdefault(user_id, set())
+    if len(user_streams) >= EVENT_STREAMS_PER_USER:
+        raise web.HTTPTooManyRequests(text="Слишком много подключений")
+    task = asyncio.current_task()
+    user_streams.add(task)
+    connections = metrics.gauge("events.connections")
+    connections.set(connections.value + 1)
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+    try:
+        await response.prepare(request)
+        await response.write(b"retry: 3000\n\n")
+        while True:
+            if not await feed.wait(user_id, since, deps.config.events_heartbeat):
+                await response.write(b": ping\n\n")
+                continue
+            cursor = feed.version
+            payload = await _sync_payload(request, deps, user_id, since, cursor)
+            await response.write(f"id: {cursor}\nevent: sync\ndata: {json.dumps(payload)}\n\n".encode())
+            since = cursor
+    except ConnectionResetError:
+        pass
+    finally:
+        connections.set(connections.value - 1)
+        user_streams.discard(task)
+        if not user_streams and streams.get(user_id) is user_streams:
+            del streams[user_id]
+    return response
+
+
+async def _close_event_streams(app: web.Application) -> None:
+    # Open streams never finish by themselves and would hold the shutdown.
+    for tasks in list(app["event_streams"].values()):
+        for task in list(tasks):
+            task.cancel()
+
+
+def _parse_since(raw: str, cursor: int) -> int:
+    try:
+        since = int(raw)
+    except ValueError:
+        raise web.HTTPBadRequest(text="Некорректный since")
+    if since < 0 or since > cursor:
+        raise web.HTTPBadRequest(text="Некорректный since")
+    return since
+
+
+async def _sync_payload(
+    request: web.Request, deps: AppDeps, user_id: int, since: int, cursor: int
+) -> dict[str, Any]:
+    # Deals, chat heads of deals that did not change otherwise, the balance,
+    # the summary and whether support tickets changed.
+    changes = deps.change_feed.changes(user_id, since)
+    removed: list[str] = []
+    if changes is not None:
+        deals = []
+        for deal in await deps.deal_service.get_deals(changes.deal_ids):
+            if user_id in (deal.seller_id, deal.buyer_id):
+                deals.append(deal)
+            else:
+                # The user is no longer part of it (an offer taken back).
+                removed.append(deal.id)
+        changed_ids = set(changes.deal_ids)
+        chat_deals = await deps.deal_service.get_deals(
+            deal_id for deal_id in changes.chat_deal_ids if deal_id not in changed_ids
+        )
+        chat_deals = [deal for deal in chat_deals if user_id in (deal.seller_id, deal.buyer_id)]
+        balance_changed = changes.balance
+        support_changed = bool(changes.support_ticket_ids)
+        chat_since = None
+    else:
+        # The cursor predates this run: compare with the stored versions.
+        working = await deps.deal_service.working_deals_of(user_id)
+        deals = [deal for deal in working if deal.version > since]
+        chat_deals = [deal for deal in working if deal.version <= since]
+        balance_changed = support_changed = True
+        chat_since = datetime.fromtimestamp(since / 1_000_000, timezone.utc)
+    response: dict[str, Any] = {"ok": True, "cursor": str(cursor)}
+    response["deals"] = await _deal_payloads(deps, deals, user_id, with_actions=True, request=request)
+    response["removed"] = removed
+    heads = await deps.chat_service.latest_messages_for_user(
+        [deal.id for deal in chat_deals], user_id, include_all=user_id in deps.config.admin_ids
+    )
+    response["chats"] = [
+        {
+            "deal_id": deal_id,
+            "chat_last_at": message.created_at.isoformat(),
+            "chat_last_sender_id": message.sender_id,
+        }
+        for deal_id, message in heads.items()
+        if chat_since is None or message.created_at > chat_since
+    ]
+    if deals or balance_changed:
+        # Reservations follow the deals.
+        response["balance"] = await _balance_payload(deps, user_id)
+    if deals:
+        response["summary"] = await _summary_payload(deps, user_id)
+    if support_changed:
+        response["support"] = True
+    return response
+
+
+MY_DEALS_PAGE = 20
+MY_DEALS_PAGE_MAX = 100
+
+
+def _encode_deal_cursor(cursor: DealCursor) -> str:
+    created_at, deal_id = cursor
+    raw = f"{created_at.isoformat()}|{deal_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_deal_cursor(value: str | None) -> DealCursor | None:
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        created_at, deal_id = raw.split("|", 1)
+        cursor = datetime.fromisoformat(created_at), deal_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise web.HTTPBadRequest(text="Некорректный cursor")
+    if cursor[0].tzinfo is None:
+        raise web.HTTPBadRequest(text="Некорректный cursor")
+    return cursor
+
+
+def _deal_filter(query: Any) -> DealFilter:
+    statuses = set()
+    for value in (query.get("status") or "").split(","):
+        value = value.strip().lower()
+        if not value:
+            continue
+        try:
+            statuses.add(DealStatus(value))
+        except ValueError:
+            raise web.HTTPBadRequest(text="Некорректный статус")
+    role = (query.get("role") or "").strip().lower() or None
+    if role not in {None, "seller", "buyer"}:
+        raise web.HTTPBadRequest(text="Некорректная роль")
+    p2p = (query.get("p2p") or "").strip().lower()
+    if p2p not in {"", "0", "1", "true", "false"}:
+        raise web.HTTPBadRequest(text="Некорректный p2p")
+    created_from = _parse_date_param(query.get("from"))
+    created_to = _parse_date_param(query.get("to"))
+    if (query.get("from") and not created_from) or (query.get("to") and not created_to):
+        raise web.HTTPBadRequest(text="Некорректная дата")
+    return DealFilter(
+        statuses=frozenset(statuses),
+        role=role,
+        is_p2p=None if not p2p else p2p in {"1", "true"},
+        created_from=created_from,
+        # ``to`` is the last day included.
+        created_to=created_to + timedelta(days=1) if created_to else None,
+    )
 
 
 async def _api_create_deal(request: web.Request) -> web.Response:
@@ -816,22 +1047,24 @@ async def _api_deal_cancel(request: web.Request) -> web.Response:
 
 async def _api_deal_accept(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
-    bot = request.app["bot"]
+    notifier: Notifier = request.app["notifier"]
     _, user_id = await _require_user(request)
     deal_id = request.match_info["deal_id"]
     try:
         deal = await deps.deal_service.accept_p2p_offer(deal_id, user_id)
     except (PermissionError, ValueError) as exc:
         raise web.HTTPBadRequest(text=str(exc))
-    await bot.send_message(
+    notifier.send_message(
         deal.seller_id,
         f"✅ Сделка {deal.hashtag} закреплена за тобой.\n"
         "Оплата подтверждена, можно продолжать сделку.",
+        critical=True,
     )
     if deal.buyer_id:
-        await bot.send_message(
+        notifier.send_message(
             deal.buyer_id,
             f"✅ Сделка {deal.hashtag} создана.\nОплата подтверждена, можно продолжать сделку.",
+            critical=True,
         )
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
     return web.json_response({"ok": True, "deal": payload})
@@ -839,7 +1072,7 @@ async def _api_deal_accept(request: web.Request) -> web.Response:
 
 async def _api_deal_decline(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
-    bot = request.app["bot"]
+    notifier: Notifier = request.app["notifier"]
     _, user_id = await _require_user(request)
     deal_id = request.match_info["deal_id"]
     try:
@@ -851,9 +1084,10 @@ async def _api_deal_decline(request: web.Request) -> web.Response:
             await deps.advert_service.restore_volume(deal.advert_id, base_usdt)
     initiator_id = deal.offer_initiator_id
     if initiator_id and initiator_id != user_id:
-        await bot.send_message(
+        notifier.send_message(
             initiator_id,
             f"❌ Предложение по сделке {deal.hashtag} отклонено.",
+            critical=True,
         )
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
     return web.json_response({"ok": True, "deal": payload})
@@ -908,11 +1142,11 @@ async def _api_deal_seller_ready(request: web.Request) -> web.Response:
         recipient_id=deal.buyer_id,
     )
     if deal.buyer_id:
-        with suppress(Exception):
-            await request.app["bot"].send_message(
-                deal.buyer_id,
-                "Продавец готов отправить QR.\nНажмите «Готов сканировать».",
-            )
+        request.app["notifier"].send_message(
+            deal.buyer_id,
+            "Продавец готов отправить QR.\nНажмите «Готов сканировать».",
+            critical=True,
+        )
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
     return web.json_response({"ok": True, "deal": payload})
 
@@ -1060,13 +1294,13 @@ async def _api_deal_open_dispute(request: web.Request) -> web.Response:
     other_id = None
     if deal.seller_id and deal.buyer_id:
         other_id = deal.buyer_id if user_id == deal.seller_id else deal.seller_id
-    with suppress(Exception):
-        if other_id:
-            await request.app["bot"].send_message(
-                other_id,
-                f"Спор по сделке #{deal.public_id} открыт.\n"
-                "Если хотите внести уточнение, перейдите к сделке.",
-            )
+    if other_id:
+        request.app["notifier"].send_message(
+            other_id,
+            f"Спор по сделке #{deal.public_id} открыт.\n"
+            "Если хотите внести уточнение, перейдите к сделке.",
+            critical=True,
+        )
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
     return web.json_response({"ok": True, "deal": payload})
 
@@ -1105,12 +1339,12 @@ async def _api_deal_upload_qr(request: web.Request) -> web.Response:
     )
     if deal.buyer_id:
         deal_label = f"#{deal.public_id}" if getattr(deal, "public_id", None) else deal_id
-        with suppress(Exception):
-            await request.app["bot"].send_photo(
-                deal.buyer_id,
-                FSInputFile(str(file_path)),
-                caption=f"QR по сделке {deal_label}.",
-            )
+        request.app["notifier"].send_photo(
+            deal.buyer_id,
+            FSInputFile(str(file_path)),
+            caption=f"QR по сделке {deal_label}.",
+            critical=True,
+        )
     payload = {
         **msg.to_dict(),
         "file_url": _chat_file_url(request, msg),
@@ -1178,12 +1412,12 @@ async def _api_deal_upload_qr_text(request: web.Request) -> web.Response:
     )
     if deal.buyer_id:
         deal_label = f"#{deal.public_id}" if getattr(deal, "public_id", None) else deal_id
-        with suppress(Exception):
-            await request.app["bot"].send_photo(
-                deal.buyer_id,
-                FSInputFile(str(file_path)),
-                caption=f"QR по сделке {deal_label}.",
-            )
+        request.app["notifier"].send_photo(
+            deal.buyer_id,
+            FSInputFile(str(file_path)),
+            caption=f"QR по сделке {deal_label}.",
+            critical=True,
+        )
     payload = {
         **msg.to_dict(),
         "file_url": _chat_file_url(request, msg),
@@ -1234,16 +1468,23 @@ async def _api_deal_qr_request_new(request: web.Request) -> web.Response:
         system=True,
     )
     if deal.seller_id:
-        with suppress(Exception):
-            await request.app["bot"].send_message(
-                deal.seller_id,
-                f"⚠️ Покупатель запросил новый QR по сделке #{deal.public_id}.\nПрикрепите QR заново в приложении.",
-            )
+        request.app["notifier"].send_message(
+            deal.seller_id,
+            f"⚠️ Покупатель запросил новый QR по сделке #{deal.public_id}.\nПрикрепите QR заново в приложении.",
+            critical=True,
+        )
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
     return web.json_response({"ok": True, "deal": payload})
 
 
+CHAT_PAGE = 50
+CHAT_PAGE_MAX = 200
+
+
 async def _api_deal_chat_list(request: web.Request) -> web.Response:
+    # Without parameters the whole chat is returned.  ``after``/``before``
+    # (message ids) and ``limit`` give a page next to a known message, or the
+    # latest messages with ``limit`` alone, plus ``has_more``.
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
     deal_id = request.match_info["deal_id"]
@@ -1255,20 +1496,34 @@ async def _api_deal_chat_list(request: web.Request) -> web.Response:
         if not dispute or not await _has_dispute_access(user_id, deps):
             raise web.HTTPForbidden(text="Нет доступа")
     include_all = user_id in deps.config.admin_ids
-    messages = await deps.chat_service.list_messages_for_user(
-        deal_id, user_id, include_all=include_all
-    )
-    admin_ids = set(deps.config.admin_ids or [])
-    sender_profiles: dict[int, dict[str, Any] | None] = {}
-    for msg in messages:
-        if msg.system:
-            continue
-        if msg.sender_id not in sender_profiles:
-            profile = await deps.user_service.profile_of(msg.sender_id)
-            sender_profiles[msg.sender_id] = _profile_payload(
-                profile, request=request, include_private=False
+    after = request.query.get("after")
+    before = request.query.get("before")
+    response: dict[str, Any] = {"ok": True}
+    if after or before or "limit" in request.query:
+        if after and before:
+            raise web.HTTPBadRequest(text="Укажите только after или before")
+        try:
+            limit = int(request.query.get("limit") or CHAT_PAGE)
+        except ValueError:
+            raise web.HTTPBadRequest(text="Некорректный limit")
+        limit = max(1, min(limit, CHAT_PAGE_MAX))
+        try:
+            messages, response["has_more"] = await deps.chat_service.page_messages_for_user(
+                deal_id, user_id, include_all=include_all, after=after, before=before, limit=limit
             )
-    dispute_any = await deps.dispute_service.dispute_any_for_deal(deal_id)
+        except LookupError:
+            raise web.HTTPBadRequest(text="Сообщение не найдено")
+    else:
+        messages = await deps.chat_service.list_messages_for_user(
+            deal_id, user_id, include_all=include_all
+        )
+    admin_ids = set(deps.config.admin_ids or [])
+    profiles = await deps.user_service.profiles_of(msg.sender_id for msg in messages if not msg.system)
+    sender_profiles = {
+        sender_id: _profile_payload(profile, request=request, include_private=False)
+        for sender_id, profile in profiles.items()
+    }
+    dispute_any = await deps.dispute_service.dispute_any_for_deal(deal_id) if messages else None
     payload = []
     for msg in messages:
         is_admin = bool(msg.sender_id in admin_ids)
@@ -1295,7 +1550,8 @@ async def _api_deal_chat_list(request: web.Request) -> web.Response:
                 "file_url": _chat_file_url(request, msg) if msg.file_path else None,
             }
         )
-    return web.json_response({"ok": True, "messages": payload})
+    response["messages"] = payload
+    return web.json_response(response)
 
 
 async def _api_deal_chat_send(request: web.Request) -> web.Response:
@@ -1324,12 +1580,11 @@ async def _api_deal_chat_send(request: web.Request) -> web.Response:
     is_moderator = user_id in set(deps.config.admin_ids or []) or await deps.user_service.is_moderator(user_id)
     dispute_any = await deps.dispute_service.dispute_any_for_deal(deal_id)
     if is_moderator and dispute_any and deal.status.value == "dispute":
-        with suppress(Exception):
-            notice = f"⚠️ Модератор написал в чате сделки #{deal.public_id}.\nОткройте приложение."
-            if deal.seller_id and deal.seller_id != user_id:
-                await request.app["bot"].send_message(deal.seller_id, notice)
-            if deal.buyer_id and deal.buyer_id != user_id:
-                await request.app["bot"].send_message(deal.buyer_id, notice)
+        notice = f"⚠️ Модератор написал в чате сделки #{deal.public_id}.\nОткройте приложение."
+        if deal.seller_id and deal.seller_id != user_id:
+            request.app["notifier"].send_message(deal.seller_id, notice)
+        if deal.buyer_id and deal.buyer_id != user_id:
+            request.app["notifier"].send_message(deal.buyer_id, notice)
     profile = await deps.user_service.profile_of(user_id)
     data = _profile_payload(profile, request=request, include_private=False) or {}
     name = data.get("display_name") or data.get("full_name") or data.get("username") or user_id
@@ -1386,12 +1641,11 @@ async def _api_deal_chat_send_file(request: web.Request) -> web.Response:
     is_moderator = user_id in set(deps.config.admin_ids or []) or await deps.user_service.is_moderator(user_id)
     dispute_any = await deps.dispute_service.dispute_any_for_deal(deal_id)
     if is_moderator and dispute_any and deal.status.value == "dispute":
-        with suppress(Exception):
-            notice = f"⚠️ Модератор отправил файл в чате сделки #{deal.public_id}.\nОткройте приложение."
-            if deal.seller_id and deal.seller_id != user_id:
-                await request.app["bot"].send_message(deal.seller_id, notice)
-            if deal.buyer_id and deal.buyer_id != user_id:
-                await request.app["bot"].send_message(deal.buyer_id, notice)
+        notice = f"⚠️ Модератор отправил файл в чате сделки #{deal.public_id}.\nОткройте приложение."
+        if deal.seller_id and deal.seller_id != user_id:
+            request.app["notifier"].send_message(deal.seller_id, notice)
+        if deal.buyer_id and deal.buyer_id != user_id:
+            request.app["notifier"].send_message(deal.buyer_id, notice)
     profile = await deps.user_service.profile_of(user_id)
     data = _profile_payload(profile, request=request, include_private=False) or {}
     name = data.get("display_name") or data.get("full_name") or data.get("username") or user_id
@@ -1560,12 +1814,9 @@ async def _api_p2p_create_ad(request: web.Request) -> web.Response:
         raise
     if is_merchant:
         ad = await deps.advert_service.update_ad(ad.id, active=True)
-        bot = request.app.get("bot")
-        if bot:
-            try:
-                await bot.send_message(user_id, "✅ Сделка создана и ожидает мерчанта.")
-            except Exception:
-                pass
+        notifier = request.app.get("notifier")
+        if notifier:
+            notifier.send_message(user_id, "✅ Сделка создана и ожидает мерчанта.")
     payload = await _ad_payload(deps, ad, include_owner=False, request=request)
     return web.json_response({"ok": True, "ad": payload})
 
@@ -1612,9 +1863,9 @@ async def _api_merchant_take(request: web.Request) -> web.Response:
     max_active = 4
     owner_active = await deps.deal_service.active_count(ad.owner_id)
     if owner_active >= max_active:
-        bot = request.app.get("bot")
-        if bot:
-            await bot.send_message(
+        notifier = request.app.get("notifier")
+        if notifier:
+            notifier.send_message(
                 user_id,
                 "Пользователь занят, попробуйте через 5 минут.",
             )
@@ -1669,8 +1920,8 @@ async def _api_merchant_take(request: web.Request) -> web.Response:
     except Exception as exc:
         raise web.HTTPBadRequest(text=f"Не удалось создать предложение: {exc}")
     payload = await _deal_payload(deps, deal, user_id, with_actions=True, request=request)
-    bot = request.app.get("bot")
-    if bot:
+    notifier = request.app.get("notifier")
+    if notifier:
         try:
             merchant_profile = await deps.user_service.profile_of(user_id)
             merchant_name = (
@@ -1679,9 +1930,10 @@ async def _api_merchant_take(request: web.Request) -> web.Response:
                 or merchant_profile.username
                 or str(user_id)
             )
-            await bot.send_message(
+            notifier.send_message(
                 ad.owner_id,
                 f"✅ Мерчант {merchant_name} взял вашу заявку. Сделка началась.",
+                critical=True,
             )
         except Exception:
             pass
@@ -1821,7 +2073,7 @@ async def _api_p2p_trading(request: web.Request) -> web.Response:
 
 async def _api_p2p_offer_ad(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
-    bot = request.app["bot"]
+    notifier: Notifier = request.app["notifier"]
     user, user_id = await _require_user(request)
     await _ensure_trade_allowed(deps, user_id)
     ad_id = request.match_info["ad_id"]
@@ -1867,7 +2119,7 @@ async def _api_p2p_offer_ad(request: web.Request) -> web.Response:
     other_id = buyer_id if buyer_id != user_id else seller_id
     other_active = await deps.deal_service.active_count(other_id)
     if other_active >= max_active:
-        await bot.send_message(
+        notifier.send_message(
             user_id,
             "Пользователь занят, попробуйте через 5 минут.",
         )
@@ -1912,8 +2164,8 @@ async def _api_p2p_offer_ad(request: web.Request) -> web.Response:
                 ]
             ]
         )
-        await bot.send_message(buyer_id, offer_text, reply_markup=markup)
-    await bot.send_message(
+        notifier.send_message(buyer_id, offer_text, reply_markup=markup, critical=True)
+    notifier.send_message(
         user_id,
         f"✅ Предложение отправлено.\nОжидаем принятия по сделке {deal.hashtag}.",
     )
@@ -2128,29 +2380,33 @@ async def _api_dispute_resolve(request: web.Request) -> web.Response:
         winner_role_label = "Продавца" if winner_is_seller else "Покупателя"
         if deal.seller_id:
             if seller_amount > 0:
-                await request.app["bot"].send_message(
+                request.app["notifier"].send_message(
                     deal.seller_id,
                     f"✅ Сделка #{deal.public_id} была закрыта в вашу пользу.\n"
                     f"На баланс было зачислено {seller_amount_text} USDT.",
+                    critical=True,
                 )
             else:
-                await request.app["bot"].send_message(
+                request.app["notifier"].send_message(
                     deal.seller_id,
                     f"Сделка #{deal.public_id} была закрыта в пользу {winner_role_label}.\n"
                     f"Средства отправлены обратно.",
+                    critical=True,
                 )
         if deal.buyer_id:
             if buyer_amount > 0:
-                await request.app["bot"].send_message(
+                request.app["notifier"].send_message(
                     deal.buyer_id,
                     f"✅ Сделка #{deal.public_id} была закрыта в вашу пользу.\n"
                     f"На баланс было зачислено {buyer_amount_text} USDT.",
+                    critical=True,
                 )
             else:
-                await request.app["bot"].send_message(
+                request.app["notifier"].send_message(
                     deal.buyer_id,
                     f"Сделка #{deal.public_id} была закрыта в пользу {winner_role_label}.\n"
                     f"Средства отправлены обратно.",
+                    critical=True,
                 )
     with suppress(Exception):
         await deps.chat_service.purge_chat(deal.id)
@@ -2589,13 +2845,13 @@ async def _api_admin_merchant_detail(request: web.Request) -> web.Response:
     if not profile:
         raise web.HTTPNotFound(text="Пользователь не найден")
     stats = await _merchant_stats(deps, target_id)
-    deals = await deps.deal_service.list_user_deals(target_id)
+    deals, _ = await deps.deal_service.user_deals_page(target_id, limit=20)
     deals_payload = [
         {
             "public_id": deal.public_id or deal.id,
             "status": deal.status.value if hasattr(deal.status, "value") else str(deal.status),
         }
-        for deal in deals[:20]
+        for deal in deals
     ]
     return web.json_response(
         {
@@ -2642,6 +2898,10 @@ async def _api_admin_user_search(request: web.Request) -> web.Response:
     return web.json_response({"ok": True, "user": payload})
 
 
+# Newest deals listed per user found by an admin search.
+ADMIN_SEARCH_DEALS = 100
+
+
 async def _api_admin_deals_search(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
@@ -2681,7 +2941,8 @@ async def _api_admin_deals_search(request: web.Request) -> web.Response:
             if uid in seen:
                 continue
             seen.add(uid)
-            deals.extend(await deps.deal_service.list_user_deals(uid))
+            page, _ = await deps.deal_service.user_deals_page(uid, limit=ADMIN_SEARCH_DEALS)
+            deals.extend(page)
 
     if not deals:
         return web.json_response({"ok": False, "deals": []})
@@ -2833,6 +3094,14 @@ async def _api_admin_user_moderation(request: web.Request) -> web.Response:
     )
 
 
+async def _api_admin_metrics(request: web.Request) -> web.Response:
+    deps: AppDeps = request.app["deps"]
+    _, user_id = await _require_user(request)
+    if not _is_admin(user_id, deps):
+        raise web.HTTPForbidden(text="Нет доступа")
+    return web.json_response({"ok": True, **metrics.snapshot()})
+
+
 async def _api_admin_actions(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
@@ -2923,7 +3192,7 @@ async def _api_support_tickets(request: web.Request) -> web.Response:
 async def _api_support_create_ticket(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
-    bot = request.app["bot"]
+    notifier: Notifier = request.app["notifier"]
     if await deps.support_service.has_open_ticket(user_id):
         raise web.HTTPBadRequest(text="У вас уже есть активный чат поддержки")
     try:
@@ -2939,14 +3208,11 @@ async def _api_support_create_ticket(request: web.Request) -> web.Response:
     ticket = await deps.support_service.create_ticket(
         user_id, subject, moderator_name, complaint_type, target_name
     )
-    try:
-        await bot.send_message(
-            user_id,
-            f"🆕 Открыт новый чат поддержки #{ticket.id}.\n"
-            "Ожидайте подключения модератора.",
-        )
-    except Exception:
-        logger.exception("Failed to notify user about support ticket %s", ticket.id)
+    notifier.send_message(
+        user_id,
+        f"🆕 Открыт новый чат поддержки #{ticket.id}.\n"
+        "Ожидайте подключения модератора.",
+    )
     return web.json_response({"ok": True, "ticket_id": ticket.id})
 
 
@@ -3116,7 +3382,7 @@ async def _api_support_ticket_message_file(request: web.Request) -> web.Response
 async def _api_support_ticket_assign(request: web.Request) -> web.Response:
     deps: AppDeps = request.app["deps"]
     _, user_id = await _require_user(request)
-    bot = request.app["bot"]
+    notifier: Notifier = request.app["notifier"]
     if not await _has_moderation_access(user_id, deps):
         raise web.HTTPForbidden(text="Нет доступа")
     ticket_id = int(request.match_info["ticket_id"])
@@ -3155,14 +3421,11 @@ async def _api_support_ticket_assign(request: web.Request) -> web.Response:
         )
     except Exception:
         logger.exception("Failed to log support open action for ticket %s", ticket.id)
-    try:
-        await bot.send_message(
-            ticket.user_id,
-            f"👮 Модератор {moderator_name} подключен к чату #{ticket.id}.\n"
-            "Ожидайте решения вопроса.",
-        )
-    except Exception:
-        logger.exception("Failed to notify user about moderator assignment for ticket %s", ticket.id)
+    notifier.send_message(
+        ticket.user_id,
+        f"👮 Модератор {moderator_name} подключен к чату #{ticket.id}.\n"
+        "Ожидайте решения вопроса.",
+    )
     return web.json_response({"ok": True})
 
 
@@ -3556,12 +3819,61 @@ async def _api_reviews_add(request: web.Request) -> web.Response:
     if comment:
         lines.append(f"Комментарий: {comment}")
     text = "\n".join(lines)
-    with suppress(Exception):
-        await request.app["bot"].send_message(target_id, text)
+    request.app["notifier"].send_message(target_id, text)
     return web.json_response({"ok": True, "review": review.to_dict()})
 
 
-def _validate_init_data(init_data: str, bot_token: str) -> dict[str, Any] | None:
+class _InitDataCache:
+    """Users of recently verified initData, keyed by a digest of the raw string.
+
+    The webapp sends the same initData with every request, so the signature
+    only has to be checked once per ``ttl``.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600.0) -> None:
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[bytes, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._hits = metrics.counter("auth.init_data_cache_hits")
+        self._misses = metrics.counter("auth.init_data_cache_misses")
+
+    def get(self, init_data: str) -> dict[str, Any] | None:
+        key = hashlib.sha256(init_data.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self._misses.inc()
+            return None
+        self._entries.move_to_end(key)
+        self._hits.inc()
+        return dict(entry[1])
+
+    def put(self, init_data: str, user: dict[str, Any]) -> None:
+        key = hashlib.sha256(init_data.encode()).digest()
+        self._entries[key] = (time.monotonic() + self._ttl, dict(user))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+def _init_data_keys(tokens: Iterable[str]) -> list[tuple[Any, ...]]:
+    # Keyed HMACs for every accepted signing scheme of every bot token, built
+    # once; validation copies them instead of deriving the keys per request.
+    keys = []
+    for token in tokens:
+        if not token:
+            continue
+        secrets = (
+            hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest(),
+            hashlib.sha256(token.encode()).digest(),
+            token.encode(),
+        )
+        keys.append(tuple(hmac.new(secret, digestmod=hashlib.sha256) for secret in secrets))
+    return keys
+
+
+def _validate_init_data(init_data: str, keys: Iterable[tuple[Any, ...]]) -> dict[str, Any] | None:
     try:
         pairs = parse_qsl(init_data, keep_blank_values=True)
     except Exception:
@@ -3571,62 +3883,13 @@ def _validate_init_data(init_data: str, bot_token: str) -> dict[str, Any] | None
     data.pop("signature", None)
     if not received_hash:
         return None
-    data_check_sorted = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
-    raw_pairs = [(k, v) for k, v in pairs if k not in {"hash", "signature"}]
-    data_check_raw = "\n".join(f"{k}={v}" for k, v in raw_pairs)
-    raw_items = []
-    for chunk in init_data.split("&"):
-        if not chunk:
-            continue
-        key, _, value = chunk.partition("=")
-        if key in {"hash", "signature"}:
-            continue
-        raw_items.append((key, value))
-    data_check_raw_unsorted = "\n".join(f"{k}={v}" for k, v in raw_items)
-    data_check_raw_sorted = "\n".join(f"{k}={v}" for k, v in sorted(raw_items))
-    webapp_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-
-    def _hashes(data_check: str) -> tuple[str, str, str]:
-        expected = hmac.new(webapp_key, data_check.encode(), hashlib.sha256).hexdigest()
-        legacy = hmac.new(hashlib.sha256(bot_token.encode()).digest(), data_check.encode(), hashlib.sha256).hexdigest()
-        legacy_plain = hmac.new(bot_token.encode(), data_check.encode(), hashlib.sha256).hexdigest()
-        return expected, legacy, legacy_plain
-
-    expected_hash, legacy_hash, legacy_plain = _hashes(data_check_sorted)
-    if not (
-        hmac.compare_digest(received_hash, expected_hash)
-        or hmac.compare_digest(received_hash, legacy_hash)
-        or hmac.compare_digest(received_hash, legacy_plain)
+    macs = [mac for token_keys in keys for mac in token_keys]
+    if not any(
+        hmac.compare_digest(received_hash, _sign(mac, data_check))
+        for data_check in _data_check_strings(init_data, pairs, data)
+        for mac in macs
     ):
-        raw_expected, raw_legacy, raw_plain = _hashes(data_check_raw)
-        raw_unsorted_expected, raw_unsorted_legacy, raw_unsorted_plain = _hashes(
-            data_check_raw_unsorted
-        )
-        raw_sorted_expected, raw_sorted_legacy, raw_sorted_plain = _hashes(data_check_raw_sorted)
-        encoded_pairs = [(k, quote(v, safe="-_.~")) for k, v in data.items()]
-        encoded_sorted = "\n".join(f"{k}={v}" for k, v in sorted(encoded_pairs))
-        encoded_plus_pairs = [(k, quote_plus(v, safe="-_.~")) for k, v in data.items()]
-        encoded_plus_sorted = "\n".join(f"{k}={v}" for k, v in sorted(encoded_plus_pairs))
-        encoded_expected, encoded_legacy, encoded_plain = _hashes(encoded_sorted)
-        encoded_plus_expected, encoded_plus_legacy, encoded_plus_plain = _hashes(encoded_plus_sorted)
-        if not (
-            hmac.compare_digest(received_hash, raw_expected)
-            or hmac.compare_digest(received_hash, raw_legacy)
-            or hmac.compare_digest(received_hash, raw_plain)
-            or hmac.compare_digest(received_hash, raw_unsorted_expected)
-            or hmac.compare_digest(received_hash, raw_unsorted_legacy)
-            or hmac.compare_digest(received_hash, raw_unsorted_plain)
-            or hmac.compare_digest(received_hash, raw_sorted_expected)
-            or hmac.compare_digest(received_hash, raw_sorted_legacy)
-            or hmac.compare_digest(received_hash, raw_sorted_plain)
-            or hmac.compare_digest(received_hash, encoded_expected)
-            or hmac.compare_digest(received_hash, encoded_legacy)
-            or hmac.compare_digest(received_hash, encoded_plain)
-            or hmac.compare_digest(received_hash, encoded_plus_expected)
-            or hmac.compare_digest(received_hash, encoded_plus_legacy)
-            or hmac.compare_digest(received_hash, encoded_plus_plain)
-        ):
-            return None
+        return None
     try:
         user_raw = data.get("user")
         return json.loads(user_raw) if user_raw else {}
@@ -3634,14 +3897,35 @@ def _validate_init_data(init_data: str, bot_token: str) -> dict[str, Any] | None
         return {}
 
 
-def _validate_init_data_any(init_data: str, tokens: Iterable[str]) -> dict[str, Any] | None:
-    for token in tokens:
-        if not token:
+def _sign(mac: Any, data_check: str) -> str:
+    mac = mac.copy()
+    mac.update(data_check.encode())
+    return mac.hexdigest()
+
+
+def _data_check_strings(
+    init_data: str,
+    pairs: list[tuple[str, str]],
+    data: dict[str, str],
+) -> Iterator[str]:
+    # Clients disagree on how the data-check string is built; the variants
+    # are produced lazily, most common first.
+    yield "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+    yield "\n".join(f"{k}={v}" for k, v in pairs if k not in {"hash", "signature"})
+    raw_items = []
+    for chunk in init_data.split("&"):
+        if not chunk:
             continue
-        user = _validate_init_data(init_data, token)
-        if user:
-            return user
-    return None
+        key, _, value = chunk.partition("=")
+        if key in {"hash", "signature"}:
+            continue
+        raw_items.append((key, value))
+    yield "\n".join(f"{k}={v}" for k, v in raw_items)
+    yield "\n".join(f"{k}={v}" for k, v in sorted(raw_items))
+    encoded_pairs = [(k, quote(v, safe="-_.~")) for k, v in data.items()]
+    yield "\n".join(f"{k}={v}" for k, v in sorted(encoded_pairs))
+    encoded_plus_pairs = [(k, quote_plus(v, safe="-_.~")) for k, v in data.items()]
+    yield "\n".join(f"{k}={v}" for k, v in sorted(encoded_plus_pairs))
 
 
 def _normalize_init_data(init_data: str) -> list[str]:
@@ -3708,11 +3992,14 @@ async def _require_user(request: web.Request) -> tuple[dict[str, Any], int]:
     init_data = request.headers.get("X-Telegram-Init-Data") or request.query.get("initData")
     if not init_data:
         raise web.HTTPUnauthorized(text="Missing initData")
-    user = _validate_init_data_any(init_data, deps.config.telegram_bot_tokens or (deps.config.telegram_bot_token,))
+    cache: _InitDataCache = request.app["init_data_cache"]
+    user = cache.get(init_data)
     if not user:
+        keys = request.app["init_data_keys"]
         for candidate in _normalize_init_data(init_data):
-            user = _validate_init_data_any(candidate, deps.config.telegram_bot_tokens or (deps.config.telegram_bot_token,))
+            user = _validate_init_data(candidate, keys)
             if user:
+                cache.put(init_data, user)
                 break
     if not user and deps.config.allow_unsafe_initdata:
         try:
@@ -4044,18 +4331,9 @@ def _is_admin(user_id: int, deps: AppDeps) -> bool:
 
 
 async def _user_stats(deps: AppDeps, user_id: int) -> dict[str, int]:
-    deals = await deps.deal_service.list_user_deals(user_id)
-    total = len(deals)
-    success = sum(1 for deal in deals if deal.status == DealStatus.COMPLETED)
-    failed = sum(1 for deal in deals if deal.status in {DealStatus.CANCELED, DealStatus.EXPIRED})
-    success_percent = round((success / total) * 100) if total else 0
+    counts = await deps.deal_service.user_deal_counts(user_id)
     reviews = await deps.review_service.list_for_user(user_id)
-    return {
-        "total_deals": total,
-        "success_percent": success_percent,
-        "fail_percent": round((failed / total) * 100) if total else 0,
-        "reviews_count": len(reviews),
-    }
+    return {**_deal_stats(counts), "reviews_count": len(reviews)}
 
 
 async def _role_label(user_id: int, deps: AppDeps) -> str:
@@ -4091,13 +4369,10 @@ def _parse_date_param(value: str | None) -> datetime | None:
 
 
 async def _merchant_stats(deps: AppDeps, user_id: int) -> dict[str, int]:
-    deals = await deps.deal_service.list_user_deals(user_id)
     total = 0
     completed = 0
     canceled = 0
-    for deal in deals:
-        if deal.buyer_id != user_id:
-            continue
+    async for deal in deps.deal_service.iter_user_deals(user_id, DealFilter(role="buyer")):
         total += 1
         if deal.status.value == "completed":
             completed += 1
@@ -4182,71 +4457,98 @@ async def _deal_payload(
     with_actions: bool = False,
     request: web.Request | None = None,
 ) -> dict[str, Any]:
-    role = "seller" if deal.seller_id == user_id else "buyer"
-    counterparty_id = deal.buyer_id if role == "seller" else deal.seller_id
-    counterparty = await deps.user_service.profile_of(counterparty_id) if counterparty_id else None
-    payload = {
-        "id": deal.id,
-        "public_id": deal.public_id,
-        "status": deal.status.value,
-        "qr_stage": deal.qr_stage.value,
-        "seller_id": deal.seller_id,
-        "buyer_id": deal.buyer_id,
-        "role": role,
-        "cash_rub": str(deal.usd_amount),
-        "usd_amount": str(deal.usd_amount),
-        "usdt_amount": str(deal.usdt_amount),
-        "rate": str(deal.rate),
-        "created_at": deal.created_at.isoformat(),
-        "atm_bank": deal.atm_bank,
-        "qr_bank_options": list(deal.qr_bank_options or []),
-        "qr_file_url": _deal_qr_url(request, deal) if request else None,
-        "counterparty": _profile_payload(counterparty, request=request, include_private=False),
-        "is_p2p": deal.is_p2p,
-        "buyer_cash_confirmed": deal.buyer_cash_confirmed,
-        "seller_cash_confirmed": deal.seller_cash_confirmed,
-        "offer_initiator_id": deal.offer_initiator_id,
-        "offer_expires_at": deal.offer_expires_at.isoformat() if deal.offer_expires_at else None,
-        "dispute_available_at": deal.dispute_available_at.isoformat()
-        if deal.dispute_available_at
-        else None,
+    payloads = await _deal_payloads(
+        deps, [deal], user_id, with_actions=with_actions, request=request
+    )
+    return payloads[0]
+
+
+async def _deal_payloads(
+    deps: AppDeps,
+    deals: list,
+    user_id: int,
+    *,
+    with_actions: bool = False,
+    request: web.Request | None = None,
+) -> list[dict[str, Any]]:
+    # Everything the payloads need from other services is fetched with one
+    # call per service, however many deals there are.
+    deal_ids = [deal.id for deal in deals]
+    counterparty_ids = {
+        deal.buyer_id if deal.seller_id == user_id else deal.seller_id for deal in deals
     }
-    reviewed = False
-    review_payload = None
+    profiles = await deps.user_service.profiles_of(
+        [counterparty_id for counterparty_id in counterparty_ids if counterparty_id]
+    )
     try:
-        review = await deps.review_service.review_for_deal(deal.id, prefer_from=user_id)
-        if review and review.from_user_id == user_id:
-            reviewed = True
-            review_payload = {
+        reviews = await deps.review_service.reviews_from(user_id, deal_ids)
+    except Exception:
+        reviews = {}
+    open_disputes = await deps.dispute_service.disputes_for_deals(
+        [deal.id for deal in deals if deal.status == DealStatus.DISPUTE]
+    )
+    disputes = await deps.dispute_service.disputes_any_for_deals(deal_ids)
+    last_chats = await deps.chat_service.latest_messages_for_user(
+        deal_ids, user_id, include_all=user_id in deps.config.admin_ids
+    )
+    payloads = []
+    for deal in deals:
+        role = "seller" if deal.seller_id == user_id else "buyer"
+        counterparty_id = deal.buyer_id if role == "seller" else deal.seller_id
+        counterparty = profiles.get(counterparty_id) if counterparty_id else None
+        payload = {
+            "id": deal.id,
+            "public_id": deal.public_id,
+            "version": deal.version,
+            "status": deal.status.value,
+            "qr_stage": deal.qr_stage.value,
+            "seller_id": deal.seller_id,
+            "buyer_id": deal.buyer_id,
+            "role": role,
+            "cash_rub": str(deal.usd_amount),
+            "usd_amount": str(deal.usd_amount),
+            "usdt_amount": str(deal.usdt_amount),
+            "rate": str(deal.rate),
+            "created_at": deal.created_at.isoformat(),
+            "atm_bank": deal.atm_bank,
+            "qr_bank_options": list(deal.qr_bank_options or []),
+            "qr_file_url": _deal_qr_url(request, deal) if request else None,
+            "counterparty": _profile_payload(counterparty, request=request, include_private=False),
+            "is_p2p": deal.is_p2p,
+            "buyer_cash_confirmed": deal.buyer_cash_confirmed,
+            "seller_cash_confirmed": deal.seller_cash_confirmed,
+            "offer_initiator_id": deal.offer_initiator_id,
+            "offer_expires_at": deal.offer_expires_at.isoformat() if deal.offer_expires_at else None,
+            "dispute_available_at": deal.dispute_available_at.isoformat()
+            if deal.dispute_available_at
+            else None,
+        }
+        review = reviews.get(deal.id)
+        payload["reviewed"] = review is not None
+        if review is not None:
+            payload["review"] = {
                 "rating": review.rating,
                 "comment": review.comment or "",
                 "created_at": review.created_at.isoformat(),
             }
-    except Exception:
-        reviewed = False
-    payload["reviewed"] = reviewed
-    if review_payload:
-        payload["review"] = review_payload
-    if deal.status == DealStatus.DISPUTE:
-        dispute = await deps.dispute_service.dispute_for_deal(deal.id)
-        payload["dispute_id"] = dispute.id if dispute else None
-    dispute_any = await deps.dispute_service.dispute_any_for_deal(deal.id)
-    if dispute_any and dispute_any.resolved:
-        payload["dispute_resolution"] = {
-            "seller_amount": dispute_any.seller_amount,
-            "buyer_amount": dispute_any.buyer_amount,
-            "resolved_by": dispute_any.resolved_by,
-            "resolved_at": dispute_any.resolved_at.isoformat() if dispute_any.resolved_at else None,
-        }
-    include_all = user_id in deps.config.admin_ids
-    last_chat = await deps.chat_service.latest_message_for_user(
-        deal.id, user_id, include_all=include_all
-    )
-    payload["chat_last_at"] = last_chat.created_at.isoformat() if last_chat else None
-    payload["chat_last_sender_id"] = last_chat.sender_id if last_chat else None
-    if with_actions:
-        payload["actions"] = _deal_actions(deal, user_id)
-    return payload
+        if deal.status == DealStatus.DISPUTE:
+            dispute = open_disputes.get(deal.id)
+            payload["dispute_id"] = dispute.id if dispute else None
+        dispute_any = disputes.get(deal.id)
+        if dispute_any and dispute_any.resolved:
+            payload["dispute_resolution"] = {
+                "seller_amount": dispute_any.seller_amount,
+                "buyer_amount": dispute_any.buyer_amount,
+                "resolved_by": dispute_any.resolved_by,
+                "resolved_at": dispute_any.resolved_at.isoformat() if dispute_any.resolved_at else None,
+            }
+        last_chat = last_chats.get(deal.id)
+        payload["chat_last_at"] = last_chat.created_at.isoformat() if last_chat else None
+        payload["chat_last_sender_id"] = last_chat.sender_id if last_chat else None
+        if with_actions:
+            payload["actions"] = _deal_actions(deal, user_id)
+        payloads.append(payload)
+    return payloads
 
 
 def _admin_deal_payload(deal) -> dict[str, Any]:
@@ -0,0 +1,93 @@
+"""Lookup latency of the ``DealService`` indexes, then an index check.
+
+    python -m scripts.bench_index --deals 500000
+
+The state is kept in memory and writes are dropped, so only the lookups are
+timed.  After the lookups a few transitions run and ``verify_indexes`` must
+pass.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import resource
+import time
+from decimal import Decimal
+
+from cachebot.services.deals import DealService
+from cachebot.storage import StorageState
+from cachebot.storage.cold import ColdSection
+from cachebot.storage.state import SECTIONS
+from scripts.benchdata import make_state, rate_provider
+
+
+class MemoryRepository:
+    def __init__(self, state: StorageState) -> None:
+        self._state = state
+
+    def snapshot(self) -> StorageState:
+        return self._state
+
+    def cold(self, name: str) -> ColdSection:
+        return ColdSection(SECTIONS[name])
+
+    async def persist_deals_and_balances(self, *args: object, **kwargs: object) -> None:
+        pass
+
+    async def persist_rates(self, *args: object, **kwargs: object) -> None:
+        pass
+
+
+async def run(deals: int, users: int, reps: int) -> None:
+    state = make_state(deals, users=users, events_per_deal=0, messages_per_deal=0)
+    repository = MemoryRepository(state)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    deal_service = DealService(repository, rate_provider(repository), 15)  # type: ignore[arg-type]
+    built = time.perf_counter() - started
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) // 1024
+    print(f"deals={deals} index build={built:.2f}s +{grown}MB")
+
+    rnd = random.Random(2)
+    user_ids = [rnd.randrange(users) for _ in range(reps)]
+    tokens = [state.deals[rnd.randrange(deals)].public_id.lower() for _ in range(reps)]
+    lookups = {
+        "user_deals_page": lambda number: deal_service.user_deals_page(user_ids[number], limit=20),
+        "active_count": lambda number: deal_service.active_count(user_ids[number]),
+        "reserved_of": lambda number: deal_service.reserved_of(user_ids[number]),
+        "get_deal_by_public_id": lambda number: deal_service.get_deal_by_public_id(tokens[number]),
+        "get_deal_by_token": lambda number: deal_service.get_deal_by_token(tokens[number]),
+        "list_dispute_deals": lambda number: deal_service.list_dispute_deals(),
+        "reserved_deals_with_invoices": lambda number: deal_service.reserved_deals_with_invoices(),
+    }
+    for name, lookup in lookups.items():
+        started = time.perf_counter()
+        for number in range(reps):
+            await lookup(number)
+        print(f"  {name:30} {(time.perf_counter() - started) / reps * 1000:9.3f}ms", flush=True)
+
+    deal = await deal_service.create_deal(1, Decimal("100"))
+    await deal_service.accept_deal(deal.id, 2)
+    await deal_service.attach_invoice(deal.id, "bench-invoice", "https://t.me/CryptoBot")
+    await deal_service.mark_invoice_paid("bench-invoice")
+    await deal_service.open_dispute(deal.id, 2)
+    await deal_service.resolve_dispute(deal.id, seller_amount=Decimal("0"), buyer_amount=Decimal("0"))
+    await deal_service.cleanup_expired()
+    started = time.perf_counter()
+    await deal_service.verify_indexes()
+    print(f"  verify_indexes ok in {time.perf_counter() - started:.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=500_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--reps", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.deals, args.users, args.reps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Startup load time and resident memory per backend.
+
+    python -m scripts.bench_load --deals 300000 --backends json,binary,sqlite
+
+Each backend is first opened once to import the JSON seed, then measured in a
+fresh interpreter so memory left over from generating the state is not counted.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from scripts.benchdata import BACKENDS, make_state, open_backend, write_state
+
+
+def rss_mb() -> int:
+    with open("/proc/self/status", encoding="ascii") as status:
+        for line in status:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def measure(kind: str, path: Path) -> None:
+    base = rss_mb()
+    started = time.perf_counter()
+    repository = open_backend(kind, path)
+    loaded = time.perf_counter() - started
+    gc.collect()
+    deals = len(repository.snapshot().deals)
+    print(f"{kind:8} load={loaded:6.2f}s rss=+{rss_mb() - base}MB deals={deals}", flush=True)
+    repository.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=300_000)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--measure", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure[0], Path(args.measure[1]))
+        return
+    state = make_state(args.deals)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {kind: write_state(Path(tmp) / kind, state) for kind in args.backends.split(",")}
+        del state
+        for kind, path in paths.items():
+            open_backend(kind, path).close()
+            subprocess.run(
+                [sys.executable, "-m", "scripts.bench_load", "--measure", kind, str(path)],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Notification throughput against a fake bot.
+
+    python -m scripts.bench_notifier --chats 300 --retry-after 0.5
+
+Each chat gets one message.  The fake bot takes ``--latency`` per call and,
+with ``--retry-after``, answers the first call with flood control.  Reports
+the time spent enqueueing, the time until everything was delivered, the
+most calls made within any one second and the calls made while the flood
+control answer was in force.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Any, List
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from cachebot.services.notifier import Notifier
+
+
+class _Bot:
+    def __init__(self, latency: float, retry_after: float) -> None:
+        self.latency = latency
+        self.retry_after = retry_after
+        self.sent: List[float] = []
+        self.refused_at: float | None = None
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        called = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        if self.retry_after and self.refused_at is None:
+            self.refused_at = time.perf_counter()
+            raise TelegramRetryAfter(
+                SendMessage(chat_id=chat_id, text=text), "Flood control", self.retry_after
+            )
+        self.sent.append(called)
+
+
+def busiest_second(times: List[float]) -> int:
+    times = sorted(times)
+    return max((bisect_left(times, start + 1.0) - index for index, start in enumerate(times)), default=0)
+
+
+async def run(args: argparse.Namespace) -> None:
+    bot = _Bot(args.latency, args.retry_after)
+    notifier = Notifier(bot, rate=args.rate)
+    notifier.start()
+    started = time.perf_counter()
+    for chat_id in range(args.chats):
+        notifier.send_message(chat_id, "✅ Платеж отправлен!", critical=True)
+    enqueued = time.perf_counter() - started
+    await notifier.close(timeout=600)
+    delivered = time.perf_counter() - started
+    line = (
+        f"chats={args.chats} latency={args.latency * 1000:.0f}ms: enqueue={enqueued * 1000:.1f}ms "
+        f"delivered={len(bot.sent)} in {delivered:.1f}s max_per_second={busiest_second(bot.sent)}"
+    )
+    if bot.refused_at is not None:
+        during = [sent for sent in bot.sent if 0 <= sent - bot.refused_at < args.retry_after]
+        line += f" calls_during_retry_after={len(during)}"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per bot call")
+    parser.add_argument("--rate", type=float, default=30.0)
+    parser.add_argument("--retry-after", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Write latency and ``storage.prepare_ms`` per changed section.
+
+    python -m scripts.bench_sections --deals 100000 --backends json,journal
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from cachebot import metrics
+from cachebot.services.chats import ChatService
+from cachebot.services.deals import DealService
+from scripts.benchdata import make_state, open_backend, percentile, rate_provider, write_state
+
+
+async def measure(kind: str, path: Path, samples: int) -> None:
+    repository = open_backend(kind, path)
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    chat_service = ChatService(repository)
+    deal_ids = [deal.id for deal in repository.snapshot().deals[:samples]]
+    actions: list[dict] = []
+
+    async def admin_action(number: int) -> None:
+        actions.append({"action": "bench", "number": number})
+        await repository.persist_admin_actions(actions)
+
+    operations = {
+        "deals": lambda number: deal_service.mark_dispute_notified(deal_ids[number]),
+        "balances": lambda number: deal_service.deposit_balance(number, Decimal("1")),
+        "chats": lambda number: chat_service.add_message(
+            deal_id=deal_ids[number], sender_id=1, text="ping", file_path=None, file_name=None
+        ),
+        "admin_actions": admin_action,
+        "settings": lambda number: repository.persist_settings(repository.snapshot().settings),
+    }
+    print(kind, flush=True)
+    try:
+        await admin_action(-1)  # the first write renders every section
+        prepare = metrics.histogram("storage.prepare_ms")
+        for name, operation in operations.items():
+            count, total = prepare.count, prepare.total
+            timings = []
+            for number in range(samples):
+                started = time.perf_counter()
+                await operation(number)
+                timings.append((time.perf_counter() - started) * 1000)
+            prepared = (prepare.total - total) / max(1, prepare.count - count)
+            print(
+                f"  {name:14} write p50={percentile(timings, 0.5):8.3f}ms "
+                f"prepare avg={prepared:8.3f}ms",
+                flush=True,
+            )
+    finally:
+        repository.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=100_000)
+    parser.add_argument("--backends", default="json,journal")
+    parser.add_argument("--samples", type=int, default=20)
+    args = parser.parse_args()
+    state = make_state(args.deals)
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.backends.split(","):
+            asyncio.run(measure(kind, write_state(Path(tmp) / kind, state), args.samples))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Crypto Pay webhook latency and inbox drain time.
+
+    python -m scripts.bench_webhooks --deals 20000 --backend sqlite --freeze
+
+Half of the paid invoices belong to reserved deals and half to top-ups; a
+third of the requests are replays.  Requests go to the real aiohttp app and
+are signed like Crypto Pay does.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import hmac
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+from cachebot.config import Config
+from cachebot.deps import AppDeps
+from cachebot.models.deal import DealStatus
+from cachebot.models.topup import Topup
+from cachebot.services.deals import DealService
+from cachebot.services.kb_client import KBClient
+from cachebot.services.topups import TopupService
+from cachebot.services.webhooks import WebhookConsumer
+from cachebot.storage import WebhookInbox
+from cachebot.webhook import create_app
+from scripts.benchdata import BACKENDS, make_state, open_backend, percentile, rate_provider, write_state
+
+SECRET = "bench-secret"
+
+
+class _Outbox:
+    def __init__(self) -> None:
+        self.sent = 0
+
+    def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        self.sent += 1
+
+    def send_photo(self, chat_id: int, photo: Any, **kwargs: Any) -> None:
+        self.sent += 1
+
+
+async def run(args: argparse.Namespace, directory: Path) -> None:
+    state = make_state(args.deals)
+    invoices = []
+    for number, deal in enumerate(state.deals[: args.invoices]):
+        deal.status = DealStatus.RESERVED
+        deal.invoice_id = f"D{number}"
+        invoices.append(deal.invoice_id)
+    for number in range(args.invoices):
+        state.topups.append(
+            Topup(
+                invoice_id=f"T{number}",
+                user_id=number,
+                amount=Decimal("5"),
+                created_at=datetime.now(timezone.utc),
+            )
+        )
+        invoices.append(f"T{number}")
+    repository = open_backend(args.backend, write_state(directory, state), commit_window=0.01)
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    topups = TopupService(repository)
+    inbox = WebhookInbox(directory / "inbox.sqlite3")
+    outbox = _Outbox()
+    consumer = WebhookConsumer(inbox, deal_service, topups, KBClient(None, None), outbox)
+    await consumer.start()
+    config = Config(
+        telegram_bot_token="bench",
+        crypto_pay_token=None,
+        admin_ids=set(),
+        owner_ids=set(),
+        crypto_pay_webhook_secret=SECRET,
+    )
+    # The webhook handler only uses the config and the consumer.
+    deps = AppDeps(
+        config=config,
+        deal_service=deal_service,
+        rate_provider=None,
+        crypto_pay=None,
+        kb_client=None,
+        user_service=None,
+        review_service=None,
+        dispute_service=None,
+        advert_service=None,
+        topup_service=topups,
+        chat_service=None,
+        support_service=None,
+        payout_service=None,
+        webhook_consumer=consumer,
+        change_feed=None,
+    )
+    if args.freeze:
+        gc.collect()
+        gc.freeze()
+    server = TestServer(create_app(None, deps, outbox))
+    await server.start_server()
+    url = str(server.make_url(config.webhook_path))
+
+    rnd = random.Random(3)
+    events = invoices + [rnd.choice(invoices) for _ in range(len(invoices) // 2)]
+    rnd.shuffle(events)
+    timings: list[float] = []
+    gate = asyncio.Semaphore(args.concurrency)
+    async with aiohttp.ClientSession() as session:
+
+        async def post(invoice_id: str) -> None:
+            body = json.dumps(
+                {"update_type": "invoice_paid", "payload": {"invoice_id": invoice_id, "status": "paid"}}
+            ).encode()
+            signature = hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+            async with gate:
+                started = time.perf_counter()
+                async with session.post(
+                    url, data=body, headers={"X-Crypto-Pay-Signature": signature}
+                ) as response:
+                    await response.read()
+                    if response.status != 200:
+                        raise RuntimeError(f"Webhook answered {response.status}")
+                timings.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(invoice_id) for invoice_id in events))
+        burst = time.perf_counter() - started
+    started = time.perf_counter()
+    while consumer.backlog():
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - started
+    print(
+        f"{args.backend} deals={args.deals} webhooks={len(events)} "
+        f"(replays {len(events) - len(invoices)}): p50={percentile(timings, 0.5):.1f}ms "
+        f"p99={percentile(timings, 0.99):.1f}ms max={max(timings):.1f}ms "
+        f"burst={burst:.2f}s drain={drained:.2f}s notifications={outbox.sent}"
+    )
+    await server.close()
+    await consumer.close()
+    inbox.close()
+    repository.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=20_000)
+    parser.add_argument("--backend", choices=BACKENDS, default="json")
+    parser.add_argument("--invoices", type=int, default=300, help="paid deals and top-ups, each")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--freeze", action="store_true", help="gc.freeze() the loaded state first")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, Path(tmp)))
+
+
+if __name__ == "__main__":
+    main()
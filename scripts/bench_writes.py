@@ -0,0 +1,55 @@
+"""Write latency of a balance deposit through ``DealService`` per backend.
+
+    python -m scripts.bench_writes --deals 100000 --backends json,journal,sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from cachebot.services.deals import DealService
+from scripts.benchdata import BACKENDS, make_state, open_backend, percentile, rate_provider, write_state
+
+
+async def measure(kind: str, path: Path, samples: int) -> str:
+    started = time.perf_counter()
+    repository = open_backend(kind, path)
+    loaded = time.perf_counter() - started
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    try:
+        # The first writes convert or render whole sections; they are not measured.
+        for number in range(20):
+            await deal_service.deposit_balance(number, Decimal("1"))
+        timings = []
+        for number in range(samples):
+            started = time.perf_counter()
+            await deal_service.deposit_balance(number % 50, Decimal("1"))
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        repository.close()
+    return (
+        f"{kind:8} open={loaded:6.2f}s deposit p50={percentile(timings, 0.5):8.3f}ms "
+        f"p99={percentile(timings, 0.99):8.3f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=100_000)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+    state = make_state(args.deals, users=5000)
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.backends.split(","):
+            path = write_state(Path(tmp) / kind, state)
+            print(asyncio.run(measure(kind, path, args.samples)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
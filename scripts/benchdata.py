@@ -0,0 +1,132 @@
+"""Synthetic state and backend setup shared by the ``bench_*`` scripts."""
+
+from __future__ import annotations
+
+import json
+import random
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from cachebot.models.balance_event import BalanceEvent
+from cachebot.models.chat import ChatMessage
+from cachebot.models.deal import Deal, DealStatus
+from cachebot.services.rate_provider import RateProvider
+from cachebot.storage import (
+    BinaryStateRepository,
+    JournalStateRepository,
+    ShardedStateRepository,
+    SqliteStateRepository,
+    StateRepository,
+    StorageState,
+)
+from cachebot.storage.state import empty_state, encode_state
+
+BACKENDS = ("json", "journal", "sqlite", "binary", "sharded")
+
+
+def make_state(
+    deals: int,
+    users: int = 2000,
+    events_per_deal: int = 1,
+    messages_per_deal: int = 2,
+    seed: int = 1,
+) -> StorageState:
+    state = empty_state()
+    now = datetime.now(timezone.utc)
+    rnd = random.Random(seed)
+    statuses = list(DealStatus)
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rnd.getrandbits(128)))
+
+    for number in range(deals):
+        created = now - timedelta(minutes=deals - number)
+        deal = Deal(
+            id=new_id(),
+            seller_id=rnd.randrange(users),
+            buyer_id=rnd.randrange(users),
+            usd_amount=Decimal("1000"),
+            rate=Decimal("95.5"),
+            fee_percent=Decimal("1.0"),
+            fee_amount=Decimal("0.104712041884816753926701571"),
+            usdt_amount=Decimal("10.575916230366492146596858"),
+            created_at=created,
+            expires_at=created,
+            status=rnd.choice(statuses),
+            public_id=f"C{number + 1:05d}",
+            is_p2p=True,
+        )
+        state.deals.append(deal)
+        for _ in range(events_per_deal):
+            state.balance_events.append(
+                BalanceEvent(
+                    id=new_id(),
+                    user_id=deal.buyer_id,
+                    amount=Decimal("10.5"),
+                    kind="deal",
+                    created_at=created,
+                    meta={"deal_id": deal.id, "public_id": deal.public_id},
+                )
+            )
+        if messages_per_deal:
+            state.chats[deal.id] = [
+                ChatMessage(
+                    id=new_id(),
+                    deal_id=deal.id,
+                    sender_id=deal.seller_id,
+                    text="hello there",
+                    file_path=None,
+                    file_name=None,
+                    created_at=created,
+                )
+                for _ in range(messages_per_deal)
+            ]
+    state.balances = dict.fromkeys(range(users), Decimal("100.5"))
+    state.deal_sequence = deals
+    return state
+
+
+def write_state(directory: Path, state: StorageState) -> Path:
+    """Writes ``state`` as a fresh ``state.json`` in an emptied ``directory``."""
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    path = directory / "state.json"
+    path.write_text(json.dumps(encode_state(state)), encoding="utf-8")
+    return path
+
+
+def open_backend(kind: str, path: Path, commit_window: float = 0.0) -> StateRepository:
+    # Same wiring as ``main.run_bot``; the non-JSON backends import ``path`` on first open.
+    if kind == "journal":
+        return JournalStateRepository(path, commit_window)
+    if kind == "sqlite":
+        return SqliteStateRepository(
+            path.with_suffix(".sqlite3"), legacy_path=path, commit_window=commit_window
+        )
+    if kind == "binary":
+        return BinaryStateRepository(
+            path.with_suffix(".bin"), legacy_path=path, commit_window=commit_window
+        )
+    if kind == "sharded":
+        return ShardedStateRepository(path, commit_window)
+    if kind == "json":
+        return StateRepository(path, commit_window)
+    raise ValueError(f"Unsupported backend: {kind}")
+
+
+def rate_provider(repository: StateRepository) -> RateProvider:
+    return RateProvider(
+        repository,
+        default_rate=Decimal("100"),
+        default_fee_percent=Decimal("1"),
+        default_withdraw_fee_percent=Decimal("1"),
+        default_transfer_fee_percent=Decimal("1"),
+    )
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
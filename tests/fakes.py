@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from dataclasses import replace
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+from cachebot.models.deal import Deal
+from cachebot.services.rate_provider import RateProvider
+from cachebot.storage import StateRepository
+from cachebot.storage.state import empty_state, encode_state
+
+
+class FakeCryptoPay:
+    """Crypto Pay API on a local port.
+
+    Answers ``getInvoices`` from ``invoices`` (id -> status) and performs
+    ``transfer`` once per spend_id into ``transfers``.  Each entry of
+    ``transfer_faults`` spoils one transfer call: an error name refuses it,
+    an ``(status, html)`` pair performs it and then answers with a proxy page.
+    Every call and how many overlapped is recorded.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.invoices: Dict[str, str] = {}
+        self.transfers: Dict[str, dict[str, Any]] = {}
+        self.transfer_faults: List[Any] = []
+        self.calls: List[tuple[str, dict[str, Any]]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner: web.AppRunner | None = None
+        self.api_base = ""
+
+    async def __aenter__(self) -> FakeCryptoPay:
+        app = web.Application()
+        app.router.add_post("/api/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.api_base = f"http://127.0.0.1:{port}/api/"
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def requested(self, method: str) -> List[dict[str, Any]]:
+        return [payload for name, payload in self.calls if name == method]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        payload = await request.json()
+        self.calls.append((method, payload))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if method == "transfer":
+            return self._transfer(payload)
+        if method != "getInvoices":
+            return _api_error(405, "METHOD_NOT_FOUND")
+        items = [
+            {
+                "invoice_id": int(invoice_id),
+                "status": self.invoices[invoice_id],
+                "amount": "10",
+                "asset": "USDT",
+                "pay_url": f"https://t.me/CryptoBot?start={invoice_id}",
+            }
+            for invoice_id in payload["invoice_ids"].split(",")
+            if invoice_id in self.invoices
+        ]
+        return web.json_response({"ok": True, "result": {"items": items}})
+
+    def _transfer(self, payload: dict[str, Any]) -> web.Response:
+        fault = self.transfer_faults.pop(0) if self.transfer_faults else None
+        if isinstance(fault, str):
+            return _api_error(400, fault)
+        spend_id = payload["spend_id"]
+        if spend_id in self.transfers:
+            return _api_error(400, "SPEND_ID_ALREADY_USED")
+        self.transfers[spend_id] = payload
+        if fault is not None:
+            status, html = fault
+            return web.Response(status=status, text=html, content_type="text/html")
+        return web.json_response({"ok": True, "result": {"transfer_id": len(self.transfers)}})
+
+
+def _api_error(code: int, name: str) -> web.Response:
+    return web.json_response({"ok": False, "error": {"code": code, "name": name}}, status=code)
+
+
+class FakeKB:
+    """KB balance API on a local port.
+
+    Credits are applied once per idempotency key.  ``lose_answers`` first
+    requests are applied but answered with 503, as when the reply is lost;
+    credits of ``refused`` users fail; ``batch_answer`` replaces the body of
+    batch replies (a string is sent as HTML).
+    """
+
+    def __init__(self) -> None:
+        self.applied: Dict[str, dict[str, Any]] = {}
+        self.requests: List[tuple[str, dict[str, Any]]] = []
+        self.lose_answers = 0
+        self.refused: set[int] = set()
+        self.batch_answer: Any = None
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    async def __aenter__(self) -> FakeKB:
+        app = web.Application()
+        app.router.add_post("/balances/credit", self._credit)
+        app.router.add_post("/balances/credit/batch", self._batch)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _apply(self, key: str, credit: dict[str, Any]) -> bool:
+        if credit["user_id"] in self.refused:
+            return False
+        self.applied.setdefault(key, credit)
+        return True
+
+    def _answer(self, body: Any) -> web.Response:
+        if self.lose_answers > 0:
+            self.lose_answers -= 1
+            return web.json_response({"ok": False}, status=503)
+        if isinstance(body, str):
+            return web.Response(text=body, content_type="text/html")
+        return web.json_response(body)
+
+    async def _credit(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.requests.append((request.path, payload))
+        if not self._apply(request.headers["Idempotency-Key"], payload):
+            return web.json_response({"ok": False, "error": "refused"}, status=400)
+        return self._answer({"ok": True})
+
+    async def _batch(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.requests.append((request.path, payload))
+        results = [
+            {"ok": self._apply(credit["idempotency_key"], credit)} for credit in payload["credits"]
+        ]
+        if self.batch_answer is not None:
+            return self._answer(self.batch_answer)
+        return self._answer({"results": results})
+
+
+class Notes:
+    """Notifier that keeps what was sent."""
+
+    def __init__(self) -> None:
+        self.sent: List[tuple[int, str]] = []
+
+    def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        self.sent.append((chat_id, text))
+
+
+def rate_provider(repository: StateRepository) -> RateProvider:
+    return RateProvider(
+        repository,
+        default_rate=Decimal("100"),
+        default_fee_percent=Decimal("1"),
+        default_withdraw_fee_percent=Decimal("1"),
+        default_transfer_fee_percent=Decimal("1"),
+    )
+
+
+def make_deal(number: int, **fields: Any) -> Deal:
+    created_at = fields.pop("created_at", None) or datetime.now(timezone.utc)
+    values: dict[str, Any] = {
+        "id": f"deal-{number}",
+        "seller_id": 1,
+        "buyer_id": 2,
+        "usd_amount": Decimal("1000"),
+        "rate": Decimal("100"),
+        "fee_percent": Decimal("1"),
+        "fee_amount": Decimal("0.1"),
+        "usdt_amount": Decimal("10.1"),
+        "created_at": created_at,
+        "expires_at": created_at,
+        "public_id": f"D{number:05d}",
+    }
+    values.update(fields)
+    return Deal(**values)
+
+
+def seeded_repository(path: Path, deals: List[Deal]) -> StateRepository:
+    state = replace(empty_state(), deals=deals)
+    path.write_text(json.dumps(encode_state(state)), encoding="utf-8")
+    return StateRepository(path)
@@ -0,0 +1,19 @@
+from cachebot.services.changes import ChangeFeed
+
+
+def test_a_dropped_feed_sends_its_readers_to_a_full_resync():
+    feed = ChangeFeed(max_users=2)
+    start = feed.version
+    feed.deal_changed("deal-1", [1])
+    feed.deal_changed("deal-2", [2])
+    seen = feed.version
+    feed.deal_changed("deal-2", [2])  # user 2 is now the most recent
+    feed.deal_changed("deal-3", [3])  # drops user 1
+
+    assert feed.changes(1, start) is None
+    assert feed.changed_since(1, start)
+    assert feed.changes(2, start) is None
+    assert feed.changes(2, seen).deal_ids == ["deal-2"]
+    assert feed.changes(3, seen).deal_ids == ["deal-3"]
+    assert feed.changes(1, seen).deal_ids == []
+    assert not feed.changed_since(1, seen)
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from cachebot.models.deal import DealStatus
+from cachebot.services.archiver import archive_finished_deals
+from cachebot.services.chats import ChatService
+from cachebot.services.deals import DealService
+from cachebot.storage.archive import DealArchive
+from tests.fakes import make_deal, rate_provider, seeded_repository
+
+
+def mixed_deals(count: int):
+    statuses = list(DealStatus)
+    old = datetime.now(timezone.utc) - timedelta(days=60)
+    return [
+        make_deal(
+            number,
+            seller_id=number % 7,
+            buyer_id=(number * 3) % 7 or None,
+            status=statuses[number % len(statuses)],
+            created_at=old + timedelta(minutes=number),
+            invoice_id=str(number) if number % 5 == 0 else None,
+            is_p2p=number % 3 == 0,
+        )
+        for number in range(count)
+    ]
+
+
+def test_indexes_follow_every_transition(tmp_path):
+    async def main():
+        deals = mixed_deals(200)
+        repository = seeded_repository(tmp_path / "state.json", deals)
+        archive = DealArchive(tmp_path / "archive.sqlite3")
+        deal_service = DealService(repository, rate_provider(repository), 15, archive=archive)
+        chat_service = ChatService(repository, archive)
+        try:
+            await deal_service.verify_indexes()
+
+            deal = await deal_service.create_deal(1, Decimal("1000"))
+            await deal_service.accept_deal(deal.id, 2)
+            await deal_service.attach_invoice(deal.id, "inv-1", "https://t.me/CryptoBot")
+            await deal_service.verify_indexes()
+            await deal_service.open_dispute(deal.id, 2)
+            await deal_service.resolve_dispute(deal.id, seller_amount=Decimal("0"), buyer_amount=Decimal("0"))
+            await deal_service.verify_indexes()
+
+            offer = await deal_service.create_deal(3, Decimal("500"))
+            await deal_service.cancel_deal(offer.id, 3)
+            assert await deal_service.cleanup_expired()
+            await deal_service.verify_indexes()
+
+            assert await archive_finished_deals(deal_service, chat_service, archive, timedelta(days=30))
+            await deal_service.verify_indexes()
+
+            archived = next(item for item in deals if item.status == DealStatus.COMPLETED)
+            await deal_service.mark_dispute_notified(archived.id)
+            assert (await deal_service.get_deal(archived.id)).dispute_notified
+            await deal_service.verify_indexes()
+        finally:
+            repository.close()
+            archive.close()
+
+    asyncio.run(main())
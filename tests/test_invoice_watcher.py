@@ -0,0 +1,98 @@
+import asyncio
+
+from cachebot.models.deal import Deal, DealStatus
+from cachebot.services.crypto_pay import CryptoPayClient
+from cachebot.services.deals import DealService
+from cachebot.services.scheduler import due_invoices, invoice_watcher
+from tests.fakes import FakeCryptoPay, Notes, make_deal, rate_provider, seeded_repository
+
+
+def reserved_deal(number: int) -> Deal:
+    return make_deal(
+        number,
+        status=DealStatus.RESERVED,
+        invoice_id=str(1000 + number),
+        invoice_url="https://t.me/CryptoBot",
+    )
+
+
+async def poll(tmp_path, server, deals, rounds, *, max_concurrency=4, before=None):
+    # Runs the watcher until the server has answered ``rounds`` getInvoices
+    # calls; ``before`` gets the deal service first.
+    repository = seeded_repository(tmp_path / "state.json", deals)
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    if before is not None:
+        await before(deal_service)
+    client = CryptoPayClient("token", server.api_base, max_concurrency, retry_backoff=0.01)
+    notes = Notes()
+    watcher = asyncio.create_task(
+        invoice_watcher(deal_service, client, None, notes, interval=0.01, max_interval=0.01)
+    )
+
+    async def answered():
+        while len(server.requested("getInvoices")) < rounds:
+            await asyncio.sleep(0.005)
+
+    try:
+        await asyncio.wait_for(answered(), 10)
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        await client.close()
+        repository.close()
+    return deal_service, notes
+
+
+def test_polls_in_chunks_with_capped_concurrency(tmp_path):
+    async def main():
+        async with FakeCryptoPay(latency=0.05) as server:
+            deals = [reserved_deal(number) for number in range(250)]
+            await poll(tmp_path, server, deals, 3, max_concurrency=2)
+        chunks = [payload["invoice_ids"].split(",") for payload in server.requested("getInvoices")[:3]]
+        assert sorted(len(chunk) for chunk in chunks) == [50, 100, 100]
+        assert sorted(sum(chunks, [])) == sorted(deal.invoice_id for deal in deals)
+        assert server.max_in_flight == 2
+
+    asyncio.run(main())
+
+
+def test_paid_invoice_settles_once_and_leaves_the_poll(tmp_path):
+    async def main():
+        async with FakeCryptoPay() as server:
+            deals = [reserved_deal(number) for number in range(3)]
+            server.invoices = {deal.invoice_id: "active" for deal in deals}
+            server.invoices[deals[0].invoice_id] = "paid"
+            deal_service, notes = await poll(tmp_path, server, deals, 4)
+        settled = await deal_service.get_deal(deals[0].id)
+        assert settled.status == DealStatus.PAID
+        assert [chat for chat, _ in notes.sent] == [1, 2]
+        later = [payload["invoice_ids"].split(",") for payload in server.requested("getInvoices")[1:]]
+        assert all(deals[0].invoice_id not in ids and len(ids) == 2 for ids in later)
+
+    asyncio.run(main())
+
+
+def test_invoices_settled_by_the_webhook_are_not_polled(tmp_path):
+    async def main():
+        deals = [reserved_deal(number) for number in range(3)]
+
+        async def webhook(deal_service):
+            await deal_service.settle_invoice(deals[1].invoice_id)
+
+        async with FakeCryptoPay() as server:
+            _, notes = await poll(tmp_path, server, deals, 2, before=webhook)
+        for payload in server.requested("getInvoices"):
+            assert deals[1].invoice_id not in payload["invoice_ids"].split(",")
+        assert notes.sent == []
+
+    asyncio.run(main())
+
+
+def test_older_invoices_are_polled_less_often():
+    first_seen = {"fresh": 995.0, "hour": 1000.0 - 3600, "minutes": 1000.0 - 600}
+    polled_at = dict.fromkeys(first_seen, 1000.0 - 45)
+    # 30 s for fresh ones, a tenth of the age after that, at most 300 s.
+    assert due_invoices(first_seen, polled_at, 1000.0, 30, 300) == ["fresh"]
+    assert due_invoices(first_seen, polled_at, 1000.0 + 20, 30, 300) == ["fresh", "minutes"]
+    assert due_invoices(first_seen, polled_at, 1000.0 + 260, 30, 300) == ["fresh", "hour", "minutes"]
+    assert due_invoices(first_seen, {}, 1000.0, 30, 300) == ["fresh", "hour", "minutes"]
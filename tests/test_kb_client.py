@@ -0,0 +1,68 @@
+import asyncio
+from decimal import Decimal
+
+from cachebot.services.kb_client import KBClient
+from tests.fakes import FakeKB
+
+
+async def credit_all(client, users):
+    return await asyncio.gather(
+        *(client.credit_balance(user_id, Decimal("100"), f"topup-{user_id}") for user_id in users)
+    )
+
+
+def test_credits_within_the_window_go_out_as_one_batch():
+    async def main():
+        async with FakeKB() as kb:
+            client = KBClient(kb.base_url, "token", batch_window_ms=50)
+            results = await credit_all(client, range(1, 6))
+            await client.close()
+        assert results == [True] * 5
+        assert [path for path, _ in kb.requests] == ["/balances/credit/batch"]
+        assert sorted(kb.applied) == [f"topup-{user_id}" for user_id in range(1, 6)]
+
+    asyncio.run(main())
+
+
+def test_a_lost_answer_is_retried_under_the_same_key():
+    async def main():
+        async with FakeKB() as kb:
+            kb.lose_answers = 1
+            client = KBClient(kb.base_url, "token")
+            assert await client.credit_balance(7, Decimal("100"))
+            kb.lose_answers = 1
+            batched = KBClient(kb.base_url, "token", batch_window_ms=10)
+            assert await credit_all(batched, [8, 9]) == [True, True]
+            await client.close()
+            await batched.close()
+        assert len(kb.requests) == 4
+        # Two requests per credit, each applied once.
+        assert sorted(credit["user_id"] for credit in kb.applied.values()) == [7, 8, 9]
+
+    asyncio.run(main())
+
+
+def test_batch_results_are_reported_per_credit():
+    async def main():
+        async with FakeKB() as kb:
+            kb.refused = {2}
+            client = KBClient(kb.base_url, "token", batch_window_ms=20)
+            results = await credit_all(client, [1, 2, 3])
+            await client.close()
+        assert results == [True, False, True]
+
+    asyncio.run(main())
+
+
+def test_an_unexpected_batch_answer_counts_as_failure():
+    async def main():
+        async with FakeKB() as kb:
+            kb.batch_answer = {"ok": True}
+            client = KBClient(kb.base_url, "token", batch_window_ms=20)
+            results = await credit_all(client, [1, 2])
+            kb.batch_answer = "<html>proxy</html>"
+            results += await credit_all(client, [3])
+            await client.close()
+        assert results == [False, False, False]
+
+    asyncio.run(main())
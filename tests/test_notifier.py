@@ -0,0 +1,57 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from cachebot import metrics
+from cachebot.services.notifier import Notifier
+
+
+class FloodedBot:
+    """Bot whose first call to ``flooded`` is answered with flood control."""
+
+    def __init__(self, flooded: int | None = None, retry_after: int = 1) -> None:
+        self.flooded = flooded
+        self.retry_after = retry_after
+        self.calls: list[tuple[float, int, str]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        now = asyncio.get_running_loop().time()
+        self.calls.append((now, chat_id, text))
+        if chat_id == self.flooded:
+            self.flooded = None
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood", self.retry_after)
+
+
+def test_flood_control_holds_back_every_chat():
+    async def main():
+        bot = FloodedBot(flooded=1)
+        notifier = Notifier(bot, rate=100, chat_interval=0.01, workers=4)
+        notifier.start()
+        notifier.send_message(1, "first")
+        await asyncio.sleep(0.05)
+        for chat_id in range(2, 6):
+            notifier.send_message(chat_id, "later")
+        await notifier.close(timeout=5)
+        refused_at = bot.calls[0][0]
+        assert all(at - refused_at >= 0.95 for at, _, _ in bot.calls[1:])
+        assert sorted(chat for _, chat, _ in bot.calls) == [1, 1, 2, 3, 4, 5]
+
+    asyncio.run(main())
+
+
+def test_a_full_queue_keeps_critical_messages():
+    async def main():
+        dropped = metrics.counter("notifier.dropped").value
+        bot = FloodedBot()
+        notifier = Notifier(bot, max_pending=2)
+        notifier.send_message(1, "a")
+        notifier.send_message(2, "b")
+        notifier.send_message(3, "offer")
+        notifier.send_message(4, "payment", critical=True)
+        notifier.start()
+        await notifier.close(timeout=5)
+        assert sorted(text for _, _, text in bot.calls) == ["a", "b", "payment"]
+        assert metrics.counter("notifier.dropped").value == dropped + 1
+
+    asyncio.run(main())
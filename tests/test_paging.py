@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from cachebot.models.deal import DealStatus
+from cachebot.services.archiver import archive_finished_deals
+from cachebot.services.chats import ChatService
+from cachebot.services.deals import DealFilter, DealService
+from cachebot.storage.archive import DealArchive
+from tests.fakes import make_deal, rate_provider, seeded_repository
+
+
+def user_deals(count: int):
+    # Deals of user 1 over 90 days, as seller and as buyer; some share a
+    # creation time so that the id breaks the tie.
+    statuses = list(DealStatus)
+    start = datetime.now(timezone.utc) - timedelta(days=90)
+    return [
+        make_deal(
+            number,
+            seller_id=1 if number % 2 else 5,
+            buyer_id=6 if number % 2 else 1,
+            status=statuses[number % len(statuses)],
+            created_at=start + timedelta(hours=36 * (number // 2)),
+            is_p2p=number % 3 == 0,
+        )
+        for number in range(count)
+    ]
+
+
+async def open_services(tmp_path, deals):
+    repository = seeded_repository(tmp_path / "state.json", deals)
+    archive = DealArchive(tmp_path / "archive.sqlite3")
+    deal_service = DealService(repository, rate_provider(repository), 15, archive=archive)
+    chat_service = ChatService(repository, archive)
+    return repository, archive, deal_service, chat_service
+
+
+async def all_pages(deal_service, limit, filters=None):
+    pages, cursor = [], None
+    while True:
+        page, cursor = await deal_service.user_deals_page(
+            1, limit=limit, cursor=cursor, filters=filters
+        )
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def newest_first(deals):
+    ordered = sorted(deals, key=lambda deal: (deal.created_at, deal.id), reverse=True)
+    return [deal.id for deal in ordered]
+
+
+def test_deal_pages_merge_the_working_set_and_the_archive(tmp_path):
+    async def main():
+        deals = user_deals(120)
+        repository, archive, deal_service, chat_service = await open_services(tmp_path, deals)
+        try:
+            archived = await archive_finished_deals(
+                deal_service, chat_service, archive, timedelta(days=30)
+            )
+            assert archived > 20
+            # A revived deal is in both places and must be listed once.
+            revived = next(deal for deal in deals[:20] if deal.status == DealStatus.COMPLETED)
+            await deal_service.mark_dispute_notified(revived.id)
+
+            pages = await all_pages(deal_service, 7)
+            assert all(len(page) == 7 for page in pages[:-1])
+            assert [deal.id for page in pages for deal in page] == newest_first(deals)
+
+            filters = DealFilter(statuses=frozenset({DealStatus.COMPLETED}), role="buyer")
+            expected = [
+                deal for deal in deals if deal.status == DealStatus.COMPLETED and deal.buyer_id == 1
+            ]
+            pages = await all_pages(deal_service, 3, filters)
+            assert [deal.id for page in pages for deal in page] == newest_first(expected)
+
+            listed = [deal.id async for deal in deal_service.iter_user_deals(1, page=11)]
+            assert listed == newest_first(deals)
+
+            counts = await deal_service.user_deal_counts(1)
+            assert sum(counts.values()) == len(deals)
+        finally:
+            repository.close()
+            archive.close()
+
+    asyncio.run(main())
+
+
+async def all_chat_pages(chat_service, deal_id, user_id, limit):
+    # Pages backwards from the latest messages, then returns them in chat order.
+    messages, more = await chat_service.page_messages_for_user(deal_id, user_id, limit=limit)
+    pages = [messages]
+    while more:
+        messages, more = await chat_service.page_messages_for_user(
+            deal_id, user_id, before=pages[-1][0].id, limit=limit
+        )
+        pages.append(messages)
+    return [message.id for page in reversed(pages) for message in page]
+
+
+def test_chat_pages_follow_the_chat_into_the_archive(tmp_path):
+    async def main():
+        old = datetime.now(timezone.utc) - timedelta(days=60)
+        deal = make_deal(1, status=DealStatus.COMPLETED, created_at=old)
+        repository, archive, deal_service, chat_service = await open_services(tmp_path, [deal])
+        try:
+            sent = []
+            for number in range(30):
+                # Every third message is for one side only.
+                recipient = (None, 1, 2)[number % 3]
+                sent.append(
+                    await chat_service.add_message(
+                        deal_id=deal.id,
+                        sender_id=0 if recipient else 1,
+                        text=f"m{number}",
+                        file_path=None,
+                        file_name=None,
+                        system=recipient is not None,
+                        recipient_id=recipient,
+                    )
+                )
+            visible = [message.id for message in sent if message.recipient_id in (None, 2)]
+            assert await all_chat_pages(chat_service, deal.id, 2, 4) == visible
+
+            middle = visible[5]
+            page, more = await chat_service.page_messages_for_user(deal.id, 2, after=middle, limit=3)
+            assert [message.id for message in page] == visible[6:9] and more
+
+            assert await archive_finished_deals(deal_service, chat_service, archive, timedelta(days=30))
+            assert await all_chat_pages(chat_service, deal.id, 2, 4) == visible
+            # A message to an archived chat continues it after the archived ones.
+            late = await chat_service.add_message(
+                deal_id=deal.id, sender_id=2, text="late", file_path=None, file_name=None
+            )
+            page, more = await chat_service.page_messages_for_user(
+                deal.id, 2, after=visible[-1], limit=10
+            )
+            assert [message.id for message in page] == [late.id] and not more
+        finally:
+            repository.close()
+            archive.close()
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import asyncio
+from decimal import Decimal
+
+from cachebot.models.payout import PayoutStatus
+from cachebot.services.crypto_pay import CryptoPayClient
+from cachebot.services.deals import DealService
+from cachebot.services.payouts import PayoutService
+from tests.fakes import FakeCryptoPay, Notes, rate_provider, seeded_repository
+
+
+async def withdraw(tmp_path, server, amount="10"):
+    # Requests one payout of user 5 and runs the workers until it settles.
+    repository = seeded_repository(tmp_path / "state.json", [])
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    await deal_service.deposit_balance(5, Decimal("100"))
+    client = CryptoPayClient("token", server.api_base, retry_backoff=0.01)
+    payouts = PayoutService(deal_service, client, Notes(), retry_delay=0.01, max_retry_delay=0.01)
+    await payouts.start()
+    try:
+        payout = await payouts.request(5, Decimal(amount), Decimal("1"))
+
+        async def settled():
+            while (await deal_service.get_payout(payout.id)).status == PayoutStatus.PENDING:
+                await asyncio.sleep(0.005)
+
+        await asyncio.wait_for(settled(), 10)
+        return await deal_service.get_payout(payout.id), await deal_service.balance_of(5)
+    finally:
+        await payouts.close()
+        await client.close()
+        repository.close()
+
+
+def test_a_proxy_page_after_the_transfer_is_not_refunded(tmp_path):
+    async def main():
+        async with FakeCryptoPay() as server:
+            server.transfer_faults = [(408, "<html>Request Timeout</html>")]
+            payout, balance = await withdraw(tmp_path, server)
+        # The retry with the same spend_id finds the transfer already made.
+        assert payout.status == PayoutStatus.SENT
+        assert len(server.requested("transfer")) == 2
+        assert len(server.transfers) == 1
+        assert balance == Decimal("89")
+
+    asyncio.run(main())
+
+
+def test_an_unknown_refusal_is_retried_under_the_same_spend_id(tmp_path):
+    async def main():
+        async with FakeCryptoPay() as server:
+            server.transfer_faults = ["SOMETHING_NEW", "SOMETHING_NEW"]
+            payout, balance = await withdraw(tmp_path, server)
+        spend_ids = {call["spend_id"] for call in server.requested("transfer")}
+        assert payout.status == PayoutStatus.SENT
+        assert len(server.requested("transfer")) == 3
+        assert spend_ids == {payout.spend_id}
+        assert balance == Decimal("89")
+
+    asyncio.run(main())
+
+
+def test_a_permanent_refusal_is_refunded(tmp_path):
+    async def main():
+        async with FakeCryptoPay() as server:
+            server.transfer_faults = ["INSUFFICIENT_FUNDS"]
+            payout, balance = await withdraw(tmp_path, server)
+        assert payout.status == PayoutStatus.REFUNDED
+        assert server.transfers == {}
+        assert balance == Decimal("100")
+
+    asyncio.run(main())
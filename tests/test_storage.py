@@ -0,0 +1,222 @@
+import asyncio
+import json
+import sqlite3
+from decimal import Decimal
+
+from cachebot.models.deal import DealStatus
+from cachebot.services.chats import ChatService
+from cachebot.services.deals import DealService
+from cachebot.services.topups import TopupService
+from cachebot.storage import (
+    BinaryStateRepository,
+    JournalStateRepository,
+    ShardedStateRepository,
+    SqliteStateRepository,
+    StateRepository,
+)
+from cachebot.storage.binary import _decode_column, _encode_column, _Field
+from cachebot.storage.sharded import SHARDS
+from cachebot.storage.state import encode_state
+from tests.fakes import make_deal, rate_provider, seeded_repository
+
+
+def seed(path):
+    seeded_repository(path, [make_deal(number) for number in range(20)]).close()
+    return path
+
+
+async def mutate(repository):
+    # One of each kind of write: a new deal, an updated record, a deleted one.
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    topups = TopupService(repository)
+    deal = await deal_service.create_deal(3, Decimal("500"))
+    await deal_service.deposit_balance(3, Decimal("7"))
+    await deal_service.mark_dispute_notified("deal-4")
+    await topups.create(user_id=3, amount=Decimal("5"), invoice_id="77")
+    await topups.create(user_id=3, amount=Decimal("6"), invoice_id="78")
+    await topups.pop_paid("77")
+    return deal
+
+
+def reopened(cls, *args, **kwargs):
+    repository = cls(*args, **kwargs)
+    try:
+        return encode_state(repository.snapshot())
+    finally:
+        repository.close()
+
+
+def check_mutated(state, deal_id):
+    # What ``mutate`` left; ``snapshot()`` of the writing repository still
+    # holds the loaded deals and balances, so this is checked after reopening.
+    assert deal_id in {item["id"] for item in state["deals"]}
+    assert [item["id"] for item in state["deals"] if item["dispute_notified"]] == ["deal-4"]
+    assert state["balances"] == {"3": "7"}
+    assert [item["amount"] for item in state["balance_events"]] == ["7"]
+    assert [item["invoice_id"] for item in state["topups"]] == ["78"]
+
+
+def test_journal_replays_commits_over_the_snapshot(tmp_path):
+    async def main():
+        path = seed(tmp_path / "state.json")
+        snapshot_text = path.read_text(encoding="utf-8")
+        repository = JournalStateRepository(path)
+        deal = await mutate(repository)
+        repository.close()
+        assert path.read_text(encoding="utf-8") == snapshot_text
+        assert path.with_suffix(".journal").stat().st_size > 0
+
+        state = reopened(JournalStateRepository, path)
+        check_mutated(state, deal.id)
+        repository = JournalStateRepository(path)
+        assert await repository.compact()
+        repository.close()
+        assert path.with_suffix(".journal").stat().st_size == 0
+        assert reopened(JournalStateRepository, path) == state
+
+    asyncio.run(main())
+
+
+def test_journal_drops_a_torn_tail(tmp_path):
+    async def main():
+        path = seed(tmp_path / "state.json")
+        repository = JournalStateRepository(path)
+        await mutate(repository)
+        repository.close()
+        state = reopened(JournalStateRepository, path)
+        journal = path.with_suffix(".journal")
+        size = journal.stat().st_size
+        with journal.open("a", encoding="utf-8") as handle:
+            handle.write('{"ops":[{"s":"balances","k":"3","v":"1000')
+
+        assert reopened(JournalStateRepository, path) == state
+        assert journal.stat().st_size == size
+        # Commits after the cut are appended to the valid prefix.
+        repository = JournalStateRepository(path)
+        deal_service = DealService(repository, rate_provider(repository), 15)
+        await deal_service.deposit_balance(3, Decimal("1"))
+        repository.close()
+        assert reopened(JournalStateRepository, path)["balances"] == {"3": "8"}
+
+    asyncio.run(main())
+
+
+def test_sqlite_imports_the_legacy_file_once(tmp_path):
+    legacy = seed(tmp_path / "state.json")
+    database = tmp_path / "state.sqlite3"
+    expected = reopened(StateRepository, legacy)
+    assert reopened(SqliteStateRepository, database, legacy_path=legacy) == expected
+    # Later changes to the old file are not imported again.
+    raw = json.loads(legacy.read_text(encoding="utf-8"))
+    raw["deals"] = []
+    legacy.write_text(json.dumps(raw), encoding="utf-8")
+    assert reopened(SqliteStateRepository, database, legacy_path=legacy) == expected
+
+
+def test_sqlite_upserts_and_deletes_rows(tmp_path):
+    async def main():
+        legacy = seed(tmp_path / "state.json")
+        database = tmp_path / "state.sqlite3"
+        repository = SqliteStateRepository(database, legacy_path=legacy)
+        deal = await mutate(repository)
+        repository.close()
+        check_mutated(reopened(SqliteStateRepository, database), deal.id)
+        with sqlite3.connect(database) as conn:
+            assert conn.execute("SELECT key FROM topups").fetchall() == [("78",)]
+            assert conn.execute("SELECT COUNT(*) FROM deals").fetchone() == (21,)
+            assert conn.execute(
+                "SELECT seller_id, status FROM deals WHERE key = ?", (deal.id,)
+            ).fetchone() == (3, "open")
+
+        # Lazily loaded history stays on disk and is read on demand.
+        lazy = SqliteStateRepository(database, lazy=True)
+        assert lazy.snapshot().balance_events == []
+        deal_service = DealService(lazy, rate_provider(lazy), 15)
+        assert [event.amount for event in await deal_service.balance_history(3)] == [Decimal("7")]
+        lazy.close()
+
+    asyncio.run(main())
+
+
+def test_sharded_splits_the_legacy_file(tmp_path):
+    async def main():
+        legacy = seed(tmp_path / "state.json")
+        # Commits still in the old journal are part of what gets split.
+        repository = JournalStateRepository(legacy)
+        deal = await mutate(repository)
+        repository.close()
+        expected = reopened(JournalStateRepository, legacy)
+        (tmp_path / "state.tmp").mkdir()  # left by a split that crashed
+
+        sharded = ShardedStateRepository(legacy, shard_class=JournalStateRepository)
+        assert encode_state(sharded.snapshot()) == expected
+        sharded.close()
+        shards = tmp_path / "state"
+        assert not (tmp_path / "state.tmp").exists()
+        for name, sections in SHARDS.items():
+            raw = json.loads((shards / f"{name}.json").read_text(encoding="utf-8"))
+            assert sorted(raw) == sorted(sections)
+
+        chats = (shards / "chats.json").read_bytes()
+        sharded = ShardedStateRepository(legacy, shard_class=JournalStateRepository)
+        deal_service = DealService(sharded, rate_provider(sharded), 15)
+        await deal_service.deposit_balance(3, Decimal("1"))
+        sharded.close()
+        assert (shards / "chats.json").read_bytes() == chats
+        assert not (shards / "chats.journal").stat().st_size
+        state = reopened(ShardedStateRepository, legacy, shard_class=JournalStateRepository)
+        assert state["balances"] == {"3": "8"}
+        assert deal.id in {item["id"] for item in state["deals"]}
+
+    asyncio.run(main())
+
+
+def test_binary_snapshot_round_trip(tmp_path):
+    async def main():
+        statuses = list(DealStatus)
+        deals = [
+            make_deal(
+                number,
+                status=statuses[number % len(statuses)],
+                buyer_id=None if number % 4 else 2,
+                invoice_id=str(number) if number % 3 else None,
+            )
+            for number in range(60)
+        ]
+        legacy = tmp_path / "state.json"
+        repository = seeded_repository(legacy, deals)
+        chats = ChatService(repository)
+        await chats.add_message(deal_id="deal-1", sender_id=1, text="hi", file_path=None, file_name=None)
+        await chats.add_message(
+            deal_id="deal-1",
+            sender_id=0,
+            text="only for 2",
+            file_path=None,
+            file_name=None,
+            system=True,
+            recipient_id=2,
+        )
+        repository.close()
+        expected = reopened(StateRepository, legacy)
+
+        binary = tmp_path / "state.bin"
+        assert reopened(BinaryStateRepository, binary, legacy_path=legacy) == expected
+        assert binary.read_bytes().startswith(b"CBSTATE")
+        assert reopened(BinaryStateRepository, binary) == expected
+
+        repository = BinaryStateRepository(binary)
+        deal = await mutate(repository)
+        repository.close()
+        check_mutated(reopened(BinaryStateRepository, binary), deal.id)
+
+    asyncio.run(main())
+
+
+def test_binary_dictionary_codes_are_little_endian():
+    spec = _Field("status", DealStatus)
+    statuses = [DealStatus.OPEN, DealStatus.PAID, DealStatus.OPEN, DealStatus.OPEN]
+    encoding, blobs = _encode_column(spec, statuses)
+    assert encoding == "dict"
+    assert blobs[1] == bytes([0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    column, _ = _decode_column(spec, encoding, [memoryview(blob) for blob in blobs], len(statuses))
+    assert column == statuses
@@ -0,0 +1,31 @@
+import asyncio
+from contextlib import suppress
+
+from cachebot.models.user import UserRole
+from cachebot.services.users import UserService
+from tests.fakes import seeded_repository
+
+
+def test_a_failed_write_keeps_presence_pending(tmp_path):
+    async def main():
+        repository = seeded_repository(tmp_path / "state.json", [])
+        users = UserService(repository, presence_interval=0)
+        await users.ensure_profile(1, full_name="A", username="a")
+        await users.ensure_profile(1, full_name="A", username="a")
+        written = []
+
+        async def persist_user_data(**sections):
+            raise OSError("disk full")
+
+        async def persist_profiles(profiles):
+            written.append(profiles[1].last_seen_at)
+
+        repository.persist_user_data = persist_user_data
+        repository.persist_profiles = persist_profiles
+        with suppress(OSError):
+            await users.set_role(1, UserRole.SELLER)
+        await users.flush_presence()
+        assert written == [(await users.profile_of(1)).last_seen_at]
+        repository.close()
+
+    asyncio.run(main())
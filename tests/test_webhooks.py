@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from cachebot.services.deals import DealService
+from cachebot.services.topups import TopupService
+from cachebot.services.webhooks import WebhookConsumer
+from cachebot.storage import WebhookInbox
+from tests.fakes import Notes, rate_provider, seeded_repository
+
+
+def fail_once(method):
+    calls = []
+
+    async def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("disk full")
+        return await method(*args, **kwargs)
+
+    return wrapper
+
+
+async def consume(tmp_path, events, *, patch=None, max_attempts=20):
+    # Accepts ``events`` (invoice_id, status) and runs the consumer until
+    # nothing is pending.
+    repository = seeded_repository(tmp_path / "state.json", [])
+    deal_service = DealService(repository, rate_provider(repository), 15)
+    topups = TopupService(repository)
+    await topups.create(user_id=7, amount=Decimal("25"), invoice_id="501")
+    if patch is not None:
+        patch(deal_service, topups)
+    inbox = WebhookInbox(tmp_path / "inbox.sqlite3")
+    notes = Notes()
+    consumer = WebhookConsumer(
+        inbox,
+        deal_service,
+        topups,
+        None,
+        notes,
+        retry_delay=0.01,
+        max_retry_delay=0.01,
+        max_attempts=max_attempts,
+    )
+    await consumer.start()
+    try:
+        accepted = [
+            await consumer.accept(invoice_id, status, {"invoice_id": invoice_id, "status": status})
+            for invoice_id, status in events
+        ]
+
+        async def finished():
+            while await inbox.pending_count():
+                await asyncio.sleep(0.005)
+
+        await asyncio.wait_for(finished(), 10)
+        return accepted, deal_service, topups, notes
+    finally:
+        await consumer.close()
+        inbox.close()
+        repository.close()
+
+
+def test_a_failed_credit_is_retried(tmp_path):
+    def patch(deal_service, topups):
+        deal_service.credit_topup = fail_once(deal_service.credit_topup)
+
+    async def main():
+        _, deal_service, topups, notes = await consume(tmp_path, [("501", "paid")], patch=patch)
+        assert await deal_service.balance_of(7) == Decimal("25")
+        assert await topups.get("501") is None
+        assert [chat for chat, _ in notes.sent] == [7]
+
+    asyncio.run(main())
+
+
+def test_a_retry_after_the_credit_does_not_credit_twice(tmp_path):
+    def patch(deal_service, topups):
+        topups.pop_paid = fail_once(topups.pop_paid)
+
+    async def main():
+        _, deal_service, topups, notes = await consume(tmp_path, [("501", "paid")], patch=patch)
+        assert await deal_service.balance_of(7) == Decimal("25")
+        assert len(await deal_service.balance_history(7)) == 1
+        assert await topups.get("501") is None
+        assert [chat for chat, _ in notes.sent] == [7]
+
+    asyncio.run(main())
+
+
+def test_replayed_events_are_accepted_once(tmp_path):
+    async def main():
+        events = [("501", "paid"), ("501", "paid"), ("501", "active"), ("501", "paid")]
+        accepted, deal_service, _, _ = await consume(tmp_path, events)
+        assert accepted == [True, False, True, False]
+        assert await deal_service.balance_of(7) == Decimal("25")
+        # A restarted consumer still knows the keys from the inbox.
+        inbox = WebhookInbox(tmp_path / "inbox.sqlite3")
+        assert await inbox.recent_keys(10) == ["501:paid", "501:active"]
+        assert not await inbox.add("501:paid", {})
+        inbox.close()
+
+    asyncio.run(main())
+
+
+def test_failing_events_go_dead_without_holding_back_newer_ones(tmp_path):
+    poison = [(str(number), "paid") for number in range(1000, 1150)]
+
+    def patch(deal_service, topups):
+        settle = deal_service.settle_invoice
+
+        async def settle_invoice(invoice_id):
+            if int(invoice_id) >= 1000:
+                raise RuntimeError("broken invoice")
+            return await settle(invoice_id)
+
+        deal_service.settle_invoice = settle_invoice
+
+    async def main():
+        _, deal_service, topups, _ = await consume(
+            tmp_path, poison + [("501", "paid")], patch=patch, max_attempts=3
+        )
+        assert await deal_service.balance_of(7) == Decimal("25")
+        inbox = WebhookInbox(tmp_path / "inbox.sqlite3")
+        assert await inbox.dead_count() == 150
+        assert await inbox.pending(200, datetime.now(timezone.utc)) == []
+        inbox.close()
+
+    asyncio.run(main())